@@ -1,2 +1,2 @@
 name = "bart_lib"
-__all__ = ["bart"]
\ No newline at end of file
+__all__ = ["aio", "bart", "cache", "client", "coalesce", "decoding", "departures", "fares", "history", "keys", "metrics", "planner", "poller", "prefetch", "ratelimit", "records", "replay", "resilience", "serve", "snapshot", "stations", "streaming", "transport"]
\ No newline at end of file
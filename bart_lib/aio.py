@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio client for the BART API.
+
+AsyncBart mirrors every public method of Bart as a coroutine, and each
+*_stream method as an async generator. Calls run on a bounded thread pool
+over one shared, keep-alive connection pool (and one shared response
+cache), so many requests can be in flight at once without opening a
+connection per call.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from bart_lib.bart import Bart
+from bart_lib.coalesce import AsyncSingleFlight
+from bart_lib.transport import RequestsTransport
+
+__author__ = "Luis Ulloa"
+
+
+class AsyncBart:
+    """
+    ----- Async Bart API -----
+    async with AsyncBart(key, max_concurrency=20) as bart:
+        etds = await bart.gather(*[bart.etd(abbr) for abbr in ('EMBR', 'MONT', 'POWL')])
+        count = await bart.train_count()
+
+    Every public Bart method is available as a coroutine with the same signature,
+    the *_stream methods as async generators:
+        async for station in bart.etd_stream('ALL'): ...
+    """
+
+    def __init__(self, key='MW9S-E7SL-26DU-VV8V', transport=None, cache=True, max_concurrency=10, coalesce=True,
+                 **kwargs):
+        """
+        :param key: BART API key, defaults to the universal key, or a list of keys or a KeyPool
+        :param transport: transport shared by all calls, defaults to a RequestsTransport
+                          whose pool holds max_concurrency connections
+        :param cache: see Bart
+        :param max_concurrency: max number of requests in flight at once
+        :param coalesce: share one call between coroutines making identical calls at the
+                         same time, counters are in coalescer.stats()
+        :param kwargs: any other Bart option, e.g. metrics, rate_limiter, resilience, snapshot or decoder
+        """
+        if transport is None:
+            transport = RequestsTransport(pool_size=max_concurrency)
+        self.bart = Bart(key, transport=transport, cache=cache, coalesce=coalesce, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.coalescer = AsyncSingleFlight() if coalesce else None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='bart')
+
+    async def _call(self, name, *args, **kwargs):
+        """ Runs Bart.name(*args, **kwargs) on the thread pool, joining an identical call in flight. """
+        loop = asyncio.get_event_loop()
+        method = functools.partial(getattr(self.bart, name), *args, **kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:   # e.g. etd_many() with a list of stations
+            key = None
+        if self.coalescer is None or key is None:
+            return await loop.run_in_executor(self._executor, method)
+        return await self.coalescer.do(key, lambda: loop.run_in_executor(self._executor, method))
+
+    async def gather(self, *aws, limit=None):
+        """
+        Awaits every coroutine in aws with at most limit of them running at once,
+        returns their results in order.
+
+        :param aws: coroutines, e.g. bart.etd('EMBR')
+        :param limit: concurrency bound, defaults to max_concurrency
+        """
+        semaphore = asyncio.Semaphore(limit or self.max_concurrency)
+
+        async def bounded(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*[bounded(aw) for aw in aws])
+
+    async def close(self):
+        """ Waits for running calls, then releases the thread pool and pooled connections. """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        self.bart.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _mirror(name):
+    """ Returns a coroutine method that runs Bart.name on AsyncBart's thread pool. """
+    @functools.wraps(getattr(Bart, name))
+    async def method(self, *args, **kwargs):
+        return await self._call(name, *args, **kwargs)
+    return method
+
+
+def _mirror_stream(name):
+    """ Returns an async generator method that pulls each record of Bart.name through AsyncBart's thread pool. """
+    @functools.wraps(getattr(Bart, name))
+    async def method(self, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        records = getattr(self.bart, name)(*args, **kwargs)
+        try:
+            while True:
+                record = await loop.run_in_executor(self._executor, next, records, _DONE)
+                if record is _DONE:
+                    return
+                yield record
+        finally:
+            try:
+                records.close()     # stopped early: drops the connection, no I/O to wait on
+            except ValueError:
+                pass                # cancelled while a read is still running on the pool
+    return method
+
+
+_DONE = object()
+
+for _name, _attr in vars(Bart).items():
+    if callable(_attr) and not _name.startswith('_') and _name != 'close':
+        setattr(AsyncBart, _name, (_mirror_stream if _name.endswith('_stream') else _mirror)(_name))
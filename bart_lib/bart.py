@@ -9,15 +9,39 @@ the BART return.
 BART API Documentation: https://api.bart.gov/docs/overview/index.aspx
 """
 
-import requests
+from collections import OrderedDict
+from contextlib import nullcontext
+from time import perf_counter
+
+from bart_lib.cache import ResponseCache, make_key
+from bart_lib.coalesce import SingleFlight
+from bart_lib.decoding import get_decoder
+from bart_lib.keys import KEY_ERROR_MAX_BYTES, KeyPool
+from bart_lib.metrics import NullMetrics
+from bart_lib.records import parse_etd, parse_fare, parse_routes, parse_routesched, parse_sched_item, parse_scheds, \
+    parse_station_etd, parse_stnaccess, parse_stns, parse_stnsched, parse_train, parse_trips, render_etd_root, \
+    render_fare, render_routesched_root, render_stns, render_stnsched_root, render_trips
+from bart_lib.snapshot import SNAPSHOT_COMMANDS, ScheduleSnapshot
+from bart_lib.streaming import StreamedResponse, iter_array
+from bart_lib.transport import RequestsTransport, wire_size
 
 __author__ = "Luis Ulloa"
 
+_NO_TIMER = nullcontext()
+
 
 class Bart:
     """
     ----- Bart API -----
     bart = Bart(key)  # key is optional, defaults to universal BART API key
+    bart = Bart(key, transport=RequestsTransport(pool_size=20, timeout=5, retries=2))
+    bart = Bart(key, cache=ResponseCache(maxsize=1024, ttls={'etd': 30}))  # cache=False disables caching
+    bart = Bart(key, snapshot='bart_schedules.db')  # persist schedule data across restarts
+    bart.fare_matrix = FareMatrix.load_or_build(bart, 'fares.bin')  # fare() from memory
+    bart = Bart(key, metrics=MemoryMetrics())  # per-command timings and counters
+    bart = Bart(key, rate_limiter=RateLimiter(TokenBucket(rate=5, burst=10)))
+    bart = Bart(key, decoder='json')  # JSON library, defaults to the fastest installed
+    bart = Bart([key1, key2, key3])   # spread requests over several keys, see bart_lib.keys
 
 
     Advisories
@@ -31,6 +55,7 @@ class Bart:
     Real-Time Estimates
     -------------------
     etd(orig, plat, direction)
+    etd_many(stations, plat, direction)
     etd_help()
 
 
@@ -67,6 +92,27 @@ class Bart:
     version()
 
 
+    Structured Data (namedtuple records, see bart_lib.records)
+    ----------------------------------------------------------
+    etd_data(orig, plat, direction)
+    arrive_data(orig, dest, time, date, b, a)
+    depart_data(orig, dest, time, date, b, a)
+    fare_data(orig, dest, date, sched)
+    routes_data(sched_num, date)
+    routesched_data(route, date, time, sched)
+    scheds_data()
+    stnsched_data(orig, date)
+    stnaccess_data(orig)
+    stns_data()
+
+
+    Streaming (yields records as the response arrives)
+    --------------------------------------------------
+    etd_stream(orig, plat, direction)
+    routesched_stream(route, date, time, sched)
+    stnsched_stream(orig, date)
+
+
     """
     # links are constants class variables, accessible with Bart.CONSTANT_NAME
     BSA_API_LINK = 'https://api.bart.gov/api/bsa.aspx'       # Advisories
@@ -76,8 +122,253 @@ class Bart:
     STN_API_LINK = 'https://api.bart.gov/api/stn.aspx'       # Station Information
     VERS_API_LINK = 'https://api.bart.gov/api/version.aspx'  # Version Information
 
-    def __init__(self, key='MW9S-E7SL-26DU-VV8V'):
-        self.key = key
+    # etd_many() requests at most this many stations one by one before using orig=ALL
+    ETD_MANY_THRESHOLD = 3
+
+    def __init__(self, key='MW9S-E7SL-26DU-VV8V', transport=None, cache=True, snapshot=None, fare_matrix=None,
+                 coalesce=True, metrics=None, rate_limiter=None, resilience=None, decoder=None):
+        """
+        :param key: BART API key, defaults to the universal key, or a list of keys or a KeyPool
+                    that upstream requests are spread over (bart.keys)
+        :param transport: object with a get(url, params) method, defaults to a
+                          pooled keep-alive RequestsTransport shared by every call
+        :param cache: True for a default ResponseCache, a ResponseCache instance,
+                      or False/None to send every call upstream
+        :param snapshot: ScheduleSnapshot or SQLite file path that stations, routes
+                         and schedules are persisted to, None to keep them in memory only
+        :param fare_matrix: FareMatrix that fare() answers current-schedule lookups from
+        :param coalesce: share one upstream request between threads making identical calls
+                         at the same time, counters are in bart.coalescer.stats()
+        :param metrics: MemoryMetrics, StatsdMetrics or any object with their interface
+                        (see bart_lib.metrics), defaults to NullMetrics which records nothing
+        :param rate_limiter: RateLimiter every upstream request waits on, can be shared by many
+                             Bart instances; requests it sheds raise RateLimitExceeded
+        :param resilience: Resilience policy (per-command timeouts, circuit breaker, stale
+                           fallbacks, see bart_lib.resilience). With one, failed upstream calls
+                           return the last good response or None instead of raising
+        :param decoder: 'orjson', 'msgspec', 'ujson', 'json' or a function decoding response bytes,
+                        defaults to the fastest library installed (see bart_lib.decoding)
+        """
+        self.keys = key if isinstance(key, KeyPool) else (KeyPool(key) if isinstance(key, (list, tuple)) else None)
+        self.key = self.keys.keys[0] if self.keys is not None else key     # the pool swaps in its own key
+        self.transport = transport if transport is not None else RequestsTransport()
+        # not `cache or None`: an empty ResponseCache is falsy
+        self.cache = ResponseCache() if cache is True else (None if cache is False else cache)
+        self.snapshot = ScheduleSnapshot(snapshot) if isinstance(snapshot, str) else snapshot
+        self.fare_matrix = fare_matrix
+        self.coalescer = SingleFlight() if coalesce else None
+        self.metrics = metrics if metrics is not None else NullMetrics()
+        self.rate_limiter = rate_limiter
+        self.resilience = resilience
+        self.decoder = get_decoder(decoder)
+        if resilience is not None and self.cache is not None:
+            self.cache.stale = max(self.cache.stale, resilience.stale_while_revalidate, resilience.stale_if_error)
+
+    def _get(self, link, payload, headers=None):
+        """
+        Sends a request for payload to link over the shared transport, once the
+        rate limiter (if any) lets it through, with a key from the key pool if any.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(payload['cmd'])
+        if self.keys is not None:
+            key = self.keys.acquire()
+            r = None
+            try:
+                r = self._send(link, dict(payload, key=key), headers)
+            finally:
+                self.keys.release(key, r)
+            return r
+        return self._send(link, payload, headers)
+
+    def _send(self, link, payload, headers=None):
+        if self.resilience is not None:
+            return self.resilience.send(self.transport, link, payload, headers)
+        if headers:
+            return self.transport.get(link, params=payload, headers=headers)
+        return self.transport.get(link, params=payload)
+
+    def _query(self, link, payload):
+        """
+        Returns the 'root' object of the JSON response for payload, None if
+        the API reported an error. Successful responses are served from and
+        stored in the cache, according to the TTL of the payload's command,
+        and schedule data is served from and stored in the snapshot, if any.
+        Identical requests already in flight on other threads are joined
+        instead of being sent again. With a resilience policy, expired responses
+        are served while they're refreshed, or when upstream fails.
+        """
+        cmd = payload['cmd']
+        key = make_key(link, payload)
+        cache = self.cache
+        if cache is None or cache.ttl(cmd) <= 0:
+            cache = None
+        else:
+            root = cache.get(key)
+            if root is not None:
+                self.metrics.incr(cmd, 'cache_hits')
+                return root
+            self.metrics.incr(cmd, 'cache_misses')
+
+        sched_num = None
+        if self.snapshot is not None and cmd in SNAPSHOT_COMMANDS:
+            sched_num = self._snapshot_sched()
+            root = self.snapshot.get(sched_num, key) if sched_num is not None else None
+            if root is not None:
+                self.metrics.incr(cmd, 'snapshot_hits')
+                if cache is not None:
+                    cache.set(key, root)
+                return root
+
+        resilience, stale = self.resilience, None
+        if resilience is not None and cache is not None:
+            stale = cache.get_stale(key)
+            if stale is not None and stale[1] <= resilience.stale_while_revalidate:
+                self.metrics.incr(cmd, 'stale_hits')
+                resilience.refresh(key, lambda: self._fetch(link, payload, key, cache, sched_num))
+                return stale[0]
+
+        try:
+            root, coalesced = self._coalesced_fetch(link, payload, key, cache, sched_num)
+        except Exception:
+            if resilience is None:
+                raise
+            self.metrics.incr(cmd, 'errors')
+            if stale is not None and stale[1] <= resilience.stale_if_error:
+                self.metrics.incr(cmd, 'stale_hits')
+                return stale[0]
+            return None
+        if coalesced:
+            self.metrics.incr(cmd, 'coalesced')
+        return root
+
+    def _coalesced_fetch(self, link, payload, key, cache, sched_num):
+        """ Returns (root, coalesced): _fetch's result, joined with an identical fetch in flight if any. """
+        if self.coalescer is None:
+            return self._fetch(link, payload, key, cache, sched_num), False
+        leader = []
+
+        def fetch():
+            leader.append(True)
+            return self._fetch(link, payload, key, cache, sched_num)
+        root = self.coalescer.do(key, fetch)
+        return root, not leader
+
+    def _fetch(self, link, payload, key, cache, sched_num):
+        """ Requests payload upstream, then stores the root in cache and under sched_num in the snapshot. """
+        cmd = payload['cmd']
+        started = perf_counter()
+        r = self._get(link, payload)
+        fetched = perf_counter()
+        try:
+            root = self.decoder(r.content)['root']
+        except (ValueError, KeyError, TypeError):
+            root = None     # not a BART JSON document, e.g. a proxy's error page
+        if self.metrics.enabled:
+            self._report(cmd, r, fetched - started, perf_counter() - fetched)
+        if root is None or self._is_error(root):
+            self.metrics.incr(cmd, 'errors')
+            return None
+        if cache is not None:
+            cache.set(key, root)
+        if sched_num is not None:
+            self.snapshot.put(root.get('sched_num', sched_num), key, root)
+        return root
+
+    def _report(self, cmd, r, request_time, decode_time):
+        """ Reports a response's size (decoded and on the wire) and request/ttfb/transfer/decode times to metrics. """
+        metrics = self.metrics
+        metrics.incr(cmd, 'requests')
+        metrics.incr(cmd, 'bytes', len(r.content))
+        wire = wire_size(r)
+        if wire is not None:
+            metrics.incr(cmd, 'wire_bytes', wire)
+        metrics.timing(cmd, 'request', request_time)
+        elapsed = getattr(r, 'elapsed', None)     # requests: time until the headers were parsed
+        if elapsed is not None:
+            ttfb = min(elapsed.total_seconds(), request_time)
+            metrics.timing(cmd, 'ttfb', ttfb)
+            metrics.timing(cmd, 'transfer', request_time - ttfb)
+        metrics.timing(cmd, 'decode', decode_time)
+
+    def _timer(self, cmd, phase):
+        """ Returns a context manager timing its block as cmd's phase, a no-op while metrics are disabled. """
+        return self.metrics.timer(cmd, phase) if self.metrics.enabled else _NO_TIMER
+
+    @staticmethod
+    def _is_error(root):
+        """ Returns True if root is BART's answer to a bad request: {'message': {'error': {...}}}. """
+        message = root.get('message')
+        return isinstance(message, dict) and 'error' in message
+
+    def _stream(self, link, payload, key):
+        """
+        Yields each element of the response's key array as soon as it has been received,
+        nothing if the API reported an error. Streamed requests wait on the rate limiter,
+        go through the resilience policy and report to metrics like any other, but bypass
+        the cache. With a resilience policy, a request that fails before any of the body
+        arrived yields nothing instead of raising. A key from the key pool is held
+        until the stream is read or abandoned.
+        """
+        cmd = payload['cmd']
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(cmd)
+        api_key = None
+        if self.keys is not None:
+            api_key = self.keys.acquire()
+            payload = dict(payload, key=api_key)
+        response = StreamedResponse(keep=KEY_ERROR_MAX_BYTES)
+        try:
+            if self.resilience is not None:
+                chunks = self.resilience.stream(self.transport, link, payload, response.started)
+            else:
+                chunks = self.transport.stream(link, params=payload, on_response=response.started)
+            try:
+                yield from iter_array(response.read(chunks), key)
+            except Exception:
+                self.metrics.incr(cmd, 'errors')
+                if self.resilience is None or response.size:
+                    raise
+                return
+            if self.metrics.enabled:
+                self._report_stream(cmd, response)
+        finally:
+            if api_key is not None:
+                # no status means no response arrived, which isn't the key's fault
+                self.keys.release(api_key, response if response.status_code is not None else None)
+
+    def _report_stream(self, cmd, response):
+        """ Reports a streamed response's size and request/ttfb/transfer times to metrics. """
+        metrics = self.metrics
+        finished = perf_counter()
+        metrics.incr(cmd, 'requests')
+        metrics.incr(cmd, 'bytes', response.size)
+        metrics.timing(cmd, 'request', finished - response.opened)
+        if response.headers_at is not None:
+            metrics.timing(cmd, 'ttfb', response.headers_at - response.opened)
+            metrics.timing(cmd, 'transfer', finished - response.headers_at)
+        if response.status_code != 200:
+            metrics.incr(cmd, 'errors')
+
+    def _snapshot_sched(self, snapshot=None):
+        """
+        Returns the schedule number in effect according to snapshot (defaults to self.snapshot),
+        re-checking scheds() once the snapshot's list is stale.
+        """
+        snapshot = snapshot if snapshot is not None else self.snapshot
+        if snapshot.schedules_stale():
+            schedules = self.scheds_data()
+            if schedules:
+                snapshot.update_schedules(schedules)
+        return snapshot.current_sched()
+
+    def close(self):
+        """ Releases the pooled connections held by the transport, if it has any, and the snapshot. """
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+        if self.snapshot is not None:
+            self.snapshot.close()
 
     def bsa(self, orig=None):
         """
@@ -87,9 +378,8 @@ class Bart:
         """
         cmd, res = 'bsa', ''
         payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'json': 'y'}
-        r = requests.get(self.BSA_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
+        data = self._query(self.BSA_API_LINK, payload)
+        if data is not None:
             time = data['time']
             date = data['date']
             res += "The following announcements were available on %s at %s...\n" % (date, time)
@@ -105,18 +395,17 @@ class Bart:
         """ Returns count of active trains. -1 if error occurs. """
         cmd = 'count'
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.BSA_API_LINK, params=payload)
-        if "error" not in r.text:
-            return r.json()['root']['traincount']
+        root = self._query(self.BSA_API_LINK, payload)
+        if root is not None:
+            return root['traincount']
         return -1
 
     def elev(self):
         """ Returns elevator announcement details. """
         cmd, res = 'elev', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.BSA_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
+        data = self._query(self.BSA_API_LINK, payload)
+        if data is not None:
             time = data['time']
             date = data['date']
             res += "The following announcements were available on %s at %s...\n" % (date, time)
@@ -134,9 +423,9 @@ class Bart:
         """ Returns/prints commands you can use with API. """
         cmd, res = 'help', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.BSA_API_LINK, params=payload)
-        if "error" not in r.text:
-            help_msg = r.json()['root']['message']['help']['#cdata-section']
+        root = self._query(self.BSA_API_LINK, payload)
+        if root is not None:
+            help_msg = root['message']['help']['#cdata-section']
             res += help_msg + '\n'
             res += "bsa(), train_count(), elev(), elev_help()\n"
         print(res)
@@ -153,42 +442,89 @@ class Bart:
         Note: If orig is 'all', can't use plat or dir. Can't use plat
                 and dir together either way (preference plat)
         """
+        root = self._etd_root(orig, plat, direction)
+        if root is None:
+            return ''
+        with self._timer('etd', 'render'):
+            return render_etd_root(root, orig)
+
+    def etd_data(self, orig, plat=None, direction=None):
+        """
+        Same request as etd(), but returns an ETDReport of StationETD/Departure
+        records instead of a string. None if an error occurs.
+        """
+        root = self._etd_root(orig, plat, direction)
+        if root is not None:
+            with self._timer('etd', 'parse'):
+                return parse_etd(root)
+        return None
+
+    def _etd_root(self, orig, plat, direction):
+        """ Returns the root of the etd response, None if an error occurs. """
         if plat is not None and direction is not None:  # preference to plat
             direction = None
 
-        cmd, res = 'etd', ''
-        payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'plat': plat,
+        payload = {'cmd': 'etd', 'key': self.key, 'orig': orig, 'plat': plat,
                    'dir': direction, 'json': 'y'}
-        r = requests.get(self.ETD_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
-            date, time = data['date'], data['time']
-            res += "Estimated departure time(s) for %s on %s %s...\n" % (orig, date, time)
-            if not data.get('station') and data.get('message') != "":
-                res += data['message']['warning'] + '\n'
-                return res      # nothing matching
-
-            for station in data.get('station'):
-                name = station['name']
-                res += "Departures for %s...\n" % name
-                for loc in station.get('etd'):
-                    dest = loc['destination']
-                    res += "For those leaving to %s:\n" % dest
-                    for departure in loc.get('estimate'):
-                        minutes = departure['minutes']
-                        platform = departure['platform']
-                        color = departure['color']
-                        res += "%s bart on platform %s leaving in %s minutes!\n" % (color, platform, minutes)
-                res += '\n'  # spacing b/w each station
-        return res
+        return self._query(self.ETD_API_LINK, payload)
+
+    def etd_stream(self, orig, plat=None, direction=None):
+        """
+        Same request as etd(), but yields a StationETD record for each station as soon
+        as it has been received instead of waiting for the whole response. Useful for
+        etd('ALL'), nothing is yielded if an error occurs.
+        """
+        if plat is not None and direction is not None:  # preference to plat
+            direction = None
+
+        payload = {'cmd': 'etd', 'key': self.key, 'orig': orig, 'plat': plat,
+                   'dir': direction, 'json': 'y'}
+        for station in self._stream(self.ETD_API_LINK, payload, 'station'):
+            yield parse_station_etd(station)
+
+    def etd_many(self, stations, plat=None, direction=None):
+        """
+        Returns a dict of station abbreviation -> tuple of Departure records for
+        every station in stations. Up to ETD_MANY_THRESHOLD stations are requested
+        one by one, more than that are served by a single orig=ALL request that's
+        filtered locally. Stations without departures (or with errors) map to ().
+
+        :param stations: iterable of station abbreviations
+        :param plat: specific platform, ranges b/w 1-4
+        :param direction: direction, 'n' north; 's' south
+
+        Note: same as etd(), plat takes preference over direction
+        """
+        if plat is not None and direction is not None:  # preference to plat
+            direction = None
+        wanted = list(OrderedDict.fromkeys(abbr.upper() for abbr in stations))
+        departures = dict.fromkeys(wanted, ())
+
+        if len(wanted) <= self.ETD_MANY_THRESHOLD:
+            for abbr in wanted:
+                report = self.etd_data(abbr, plat, direction)
+                if report is not None:
+                    departures[abbr] = tuple(dep for stn in report.stations for dep in stn.departures)
+            return departures
+
+        report = self.etd_data('ALL')  # ALL doesn't take plat or dir, filter them here instead
+        if report is None:
+            return departures
+        for stn in report.stations:
+            if stn.abbr in departures:
+                departures[stn.abbr] = tuple(
+                    dep for dep in stn.departures
+                    if (plat is None or dep.platform == str(plat))
+                    and (direction is None or (dep.direction or '')[:1].lower() == direction[:1].lower()))
+        return departures
 
     def etd_help(self):
         """ Shows commands for time departure part of api. """
         cmd, res = 'help', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.ETD_API_LINK, params=payload)
-        if "error" not in r.text:
-            help_msg = r.json()['root']['message']['help']['#cdata-section']
+        root = self._query(self.ETD_API_LINK, payload)
+        if root is not None:
+            help_msg = root['message']['help']['#cdata-section']
             res += help_msg + '\n'
             res += "etd(), etd_help()\n"
         print(res)  # show help details to user as well as return
@@ -206,9 +542,9 @@ class Bart:
         """
         cmd, res = 'routeinfo', ''
         payload = {'cmd': cmd, 'key': self.key, 'route': route_num, 'sched': sched_num, 'date': date, 'json': 'y'}
-        r = requests.get(self.ROUTE_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['routes']['route']
+        root = self._query(self.ROUTE_API_LINK, payload)
+        if root is not None:
+            data = root['routes']['route']
             name, origin, destination, route = data['name'], data['origin'], data['destination'], data['routeID']
             res += '%s is %s, going from %s to %s.\n' % (route, name, origin, destination)
         return res
@@ -224,21 +560,30 @@ class Bart:
         """
         cmd, res = 'routes', ''
         payload = {'cmd': cmd, 'key': self.key, 'sched': sched_num, 'date': date, 'json': 'y'}
-        r = requests.get(self.ROUTE_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['routes']
+        root = self._query(self.ROUTE_API_LINK, payload)
+        if root is not None:
+            data = root['routes']
             for route in data['route']:
                 name, abbr, route_id = route['name'], route['abbr'], route['routeID']
                 res += "%s - %s with abbreviation \"%s\"\n" % (route_id, name, abbr)
         return res
 
+    def routes_data(self, sched_num=None, date=None):
+        """ Same request as routes(), but returns a list of Route records. None if an error occurs. """
+        payload = {'cmd': 'routes', 'key': self.key, 'sched': sched_num, 'date': date, 'json': 'y'}
+        root = self._query(self.ROUTE_API_LINK, payload)
+        if root is not None:
+            with self._timer(payload['cmd'], 'parse'):
+                return parse_routes(root)
+        return None
+
     def route_help(self):
         """ Returns/prints commands for route (note: "help" refers to this method)"""
         cmd, res = 'help', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.ROUTE_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['message']['help']['#cdata-section']
+        root = self._query(self.ROUTE_API_LINK, payload)
+        if root is not None:
+            data = root['message']['help']['#cdata-section']
             res += data + '\n'
             res += "route_help(), routes(), route_info()\n"
         print(res)
@@ -256,24 +601,24 @@ class Bart:
         :param a: specifies how many trips after specified time should be returned  (0-4, default 2)
         :param command: used internally, no need to declare this, defaults to arrive
         """
-        cmd, res = command, ''
-        payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'dest': dest, 'time': time,
+        plan = self.arrive_data(orig, dest, time, date, b, a, command)
+        if plan is None:
+            return ''
+        with self._timer(command, 'render'):
+            return render_trips(plan)
+
+    def arrive_data(self, orig, dest, time=None, date=None, b=None, a=None, command="arrive"):
+        """
+        Same request as arrive(), but returns a TripPlan of Trip/Fare records
+        instead of a string. None if an error occurs.
+        """
+        payload = {'cmd': command, 'key': self.key, 'orig': orig, 'dest': dest, 'time': time,
                    'date': date, 'b': b, 'a': a, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
-            res += "Trips from %s to %s...\n" % (data['origin'], data['destination'])
-            trips = data['schedule']['request']['trip']
-            for i in range(0, len(trips), 2):    # each trip has a leg following it
-                trip = trips[i]
-                # leg = trips[i+1]['leg']   # won't use any data from legs, but know it's here!
-                res += "Trip from %s to %s on %s with the following fares...\n" \
-                       % (trip['@origTimeMin'], trip['@destTimeMin'], trip['@origTimeDate'])
-                res += "Standard: " + trip['@fare'] + '\n'
-                for fare in trip['fares']['fare']:
-                    res += "%s: %s (%s)\n" % (fare['@name'], fare['@amount'], fare['@class'])
-                res += '\n'  # spacing
-        return res
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            with self._timer(payload['cmd'], 'parse'):
+                return parse_trips(root)
+        return None
 
     def depart(self, orig, dest, time=None, date=None, b=None, a=None):
         """
@@ -289,6 +634,10 @@ class Bart:
         """
         return self.arrive(orig, dest, time, date, b, a, "depart")
 
+    def depart_data(self, orig, dest, time=None, date=None, b=None, a=None):
+        """ Same request as depart(), but returns a TripPlan. None if an error occurs. """
+        return self.arrive_data(orig, dest, time, date, b, a, "depart")
+
     def fare(self, orig, dest, date=None, sched=None):
         """
         Requests the fare information for a trip between two stations.
@@ -298,23 +647,43 @@ class Bart:
         :param date: specific date mm/dd/yyyy, current date default
         :param sched: specific schedule to use (optional)
         """
-        cmd, res = 'fare', ''
-        payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'dest': dest, 'date': date, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
-            res += "A trip from %s to %s has the following fares...\n" % (data['origin'], data['destination'])
-            for fare in data['fares']['fare']:
-                res += "%s for %s (%s)\n" % (fare['@amount'], fare['@name'], fare['@class'])
-        return res
+        quote = self.fare_data(orig, dest, date, sched)
+        if quote is None:
+            return ''
+        with self._timer('fare', 'render'):
+            return render_fare(quote)
+
+    def fare_data(self, orig, dest, date=None, sched=None):
+        """
+        Same request as fare(), but returns a FareQuote of Fare records
+        instead of a string. None if an error occurs. Served from the
+        fare matrix, if there is one and its schedule is still in effect,
+        unless a date or schedule is given.
+        """
+        matrix = self.fare_matrix
+        if matrix is not None and date is None and sched is None and matrix.current(self):
+            quote = matrix.get(orig, dest)
+            if quote is not None:
+                return quote
+        return self._fare_query(orig, dest, date, sched)
+
+    def _fare_query(self, orig, dest, date=None, sched=None):
+        """ Requests a FareQuote from the API (or cache), never from the fare matrix. None if an error occurs. """
+        payload = {'cmd': 'fare', 'key': self.key, 'orig': orig, 'dest': dest, 'date': date, 'sched': sched,
+                   'json': 'y'}
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            with self._timer(payload['cmd'], 'parse'):
+                return parse_fare(root)
+        return None
 
     def holiday(self):
         """ Returns BART schedule type for any holiday. """
         cmd, res = 'holiday', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['holidays'][0]
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            data = root['holidays'][0]
             for hday in data['holiday']:
                 name, date, sched_type = hday['name'], hday['date'], hday['schedule_type']
                 res += "%s on %s has a %s schedule type.\n" % (name, date, sched_type)
@@ -329,36 +698,66 @@ class Bart:
         :param time: specifies what time to use hh:mm tt (defaults to now)
         :param sched: specifies schedule to use (defaults to current schedule)
         """
-        cmd, res = 'routesched', ''
-        payload = {'cmd': cmd, 'key': self.key, 'route': route, 'time': time,
+        root = self._routesched_root(route, date, time, sched)
+        if root is None:
+            return ''
+        with self._timer('routesched', 'render'):
+            return render_routesched_root(root)
+
+    def routesched_data(self, route, date=None, time=None, sched=None):
+        """
+        Same request as routesched(), but returns a RouteSchedule of Train/TrainStop
+        records instead of a string. None if an error occurs.
+        """
+        root = self._routesched_root(route, date, time, sched)
+        if root is not None:
+            with self._timer('routesched', 'parse'):
+                return parse_routesched(root)
+        return None
+
+    def _routesched_root(self, route, date, time, sched):
+        """ Returns the root of the routesched response, None if an error occurs. """
+        payload = {'cmd': 'routesched', 'key': self.key, 'route': route, 'time': time,
                    'date': date, 'sched': sched, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
-            res += "For schedule number %s on %s...\n" % (data['sched_num'], data['date'])
-            for path in data['route']['train']:
-                stops = ', '.join([loc['@station'] + "(" + loc["@origTime"] + ")"
-                                   for loc in path['stop'] if loc.get('@origTime')])
-                res += "Train with ID %s has the following stops: %s\n" % (path['@trainId'], stops)
-        return res
+        return self._query(self.SCHED_API_LINK, payload)
+
+    def routesched_stream(self, route, date=None, time=None, sched=None):
+        """
+        Same request as routesched(), but yields a Train record for each train as soon
+        as it has been received. Nothing is yielded if an error occurs.
+        """
+        payload = {'cmd': 'routesched', 'key': self.key, 'route': route, 'time': time,
+                   'date': date, 'sched': sched, 'json': 'y'}
+        for train in self._stream(self.SCHED_API_LINK, payload, 'train'):
+            yield parse_train(train)
 
     def scheds(self):
         """ Returns schedule id's and effective dates. """
         cmd, res = 'scheds', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        data = r.json()['root']['schedules']
-        for sched in data['schedule']:
-            res += "Schedule %s has effective date %s\n" % (sched['@id'], sched['@effectivedate'])
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            data = root['schedules']
+            for sched in data['schedule']:
+                res += "Schedule %s has effective date %s\n" % (sched['@id'], sched['@effectivedate'])
         return res
 
+    def scheds_data(self):
+        """ Same request as scheds(), but returns a list of Schedule records. None if an error occurs. """
+        payload = {'cmd': 'scheds', 'key': self.key, 'json': 'y'}
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            with self._timer(payload['cmd'], 'parse'):
+                return parse_scheds(root)
+        return None
+
     def special(self):
         """ Returns information about current and upcoming BART special schedules. """
         cmd, res = 'special', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['special_schedules']
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            data = root['special_schedules']
             for spec in data['special_schedule']:
                 res += "From %s to %s: %s\n" % \
                       (spec['start_date'], spec['end_date'], spec['text']['#cdata-section'])
@@ -373,26 +772,44 @@ class Bart:
         :param orig: station for which schedule is requested
         :param date: specifies date to use mm/dd/yy (default today)
         """
-        cmd, res = 'stnsched', ''
-        payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'date': date, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
-            res += "%s schedule (%s) details on %s...\n" % \
-                  (data['station']['name'], data['sched_num'], data['date'])
-            for route in data['station']['item']:
-                res += "Train %s with %s, (Head Station %s): from %s to %s.\n" % \
-                      (route['@trainId'], route['@line'], route['@trainHeadStation'],
-                       route['@origTime'], route['@destTime'])
-        return res
+        root = self._stnsched_root(orig, date)
+        if root is None:
+            return ''
+        with self._timer('stnsched', 'render'):
+            return render_stnsched_root(root)
+
+    def stnsched_data(self, orig, date=None):
+        """
+        Same request as stnsched(), but returns a StationSchedule of SchedItem
+        records instead of a string. None if an error occurs.
+        """
+        root = self._stnsched_root(orig, date)
+        if root is not None:
+            with self._timer('stnsched', 'parse'):
+                return parse_stnsched(root)
+        return None
+
+    def _stnsched_root(self, orig, date):
+        """ Returns the root of the stnsched response, None if an error occurs. """
+        payload = {'cmd': 'stnsched', 'key': self.key, 'orig': orig, 'date': date, 'json': 'y'}
+        return self._query(self.SCHED_API_LINK, payload)
+
+    def stnsched_stream(self, orig, date=None):
+        """
+        Same request as stnsched(), but yields a SchedItem record for each train as soon
+        as it has been received. Nothing is yielded if an error occurs.
+        """
+        payload = {'cmd': 'stnsched', 'key': self.key, 'orig': orig, 'date': date, 'json': 'y'}
+        for item in self._stream(self.SCHED_API_LINK, payload, 'item'):
+            yield parse_sched_item(item)
 
     def sched_help(self):
         """ Prints/Returns commands for time departure part of api. """
         cmd, res = 'help', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.SCHED_API_LINK, params=payload)
-        if "error" not in r.text:
-            help_msg = r.json()['root']['message']['help']['#cdata-section']
+        root = self._query(self.SCHED_API_LINK, payload)
+        if root is not None:
+            help_msg = root['message']['help']['#cdata-section']
             res += help_msg + '\n'
             res += "arrive(), depart(), fare(), sched_help(), holiday(), routesched(), scheds(), special(), stnsched()\n"
         print(res)
@@ -409,9 +826,9 @@ class Bart:
         """
         cmd, res = 'stninfo', ''
         payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'json': 'y'}
-        r = requests.get(self.STN_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['stations']['station']
+        root = self._query(self.STN_API_LINK, payload)
+        if root is not None:
+            data = root['stations']['station']
             name = data['name']
             address, city, state, zipcode = data['address'], data['city'], data['state'], data['zipcode']
             link = data['link']['#cdata-section']
@@ -420,17 +837,20 @@ class Bart:
 
     def stns(self):
         """ Provides list of BART stations with their abbreviations, full names, and addresses. """
-        cmd, res = 'stns', ''
-        payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.STN_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
-            for station in data['stations']['station']:
-                name = station['name']
-                abbr = station['abbr']
-                address, city, state, zipc = station['address'], station['city'], station['state'], station['zipcode']
-                res += "%s (\"%s\") is at %s, %s, %s %s.\n" % (name, abbr, address, city, state, zipc)
-        return res
+        stations = self.stns_data()
+        if stations is None:
+            return ''
+        with self._timer('stns', 'render'):
+            return render_stns(stations)
+
+    def stns_data(self):
+        """ Same request as stns(), but returns a list of Station records. None if an error occurs. """
+        payload = {'cmd': 'stns', 'key': self.key, 'json': 'y'}
+        root = self._query(self.STN_API_LINK, payload)
+        if root is not None:
+            with self._timer(payload['cmd'], 'parse'):
+                return parse_stns(root)
+        return None
 
     def stnaccess(self, orig):
         """
@@ -445,9 +865,9 @@ class Bart:
         """
         cmd, res = 'stnaccess', ''
         payload = {'cmd': cmd, 'key': self.key, 'orig': orig, 'json': 'y'}
-        r = requests.get(self.STN_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']['stations']['station']
+        root = self._query(self.STN_API_LINK, payload)
+        if root is not None:
+            data = root['stations']['station']
             parking, bike, bike_station, lockers = data['@parking_flag'],data['@bike_flag'],\
                 data['@bike_station_flag'], data['@locker_flag']
 
@@ -458,13 +878,23 @@ class Bart:
             res += "Lockers: " + ("yes" if lockers == '1' else "no") + '\n'
         return res
 
+    def stnaccess_data(self, orig):
+        """ Same request as stnaccess(), but returns a StationAccess record. None if an error occurs. """
+        payload = {'cmd': 'stnaccess', 'key': self.key, 'orig': orig, 'json': 'y'}
+        root = self._query(self.STN_API_LINK, payload)
+        if root is not None:
+            with self._timer(payload['cmd'], 'parse'):
+                access = parse_stnaccess(root)
+            return access if access.abbr else access._replace(abbr=orig.upper())
+        return None
+
     def stn_help(self):
         """ Returns/prints commands for time departure part of api. """
         cmd, res = 'help', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.STN_API_LINK, params=payload)
-        if "error" not in r.text:
-            help_msg = r.json()['root']['message']['help']['#cdata-section']
+        root = self._query(self.STN_API_LINK, payload)
+        if root is not None:
+            help_msg = root['message']['help']['#cdata-section']
             res += help_msg + '\n'
             res += "stn_help(), stninfo(), stnaccess(), stns()\n"
         print(res)
@@ -474,9 +904,8 @@ class Bart:
         """ Returns version details. """
         cmd, res = 'ver', ''
         payload = {'cmd': cmd, 'key': self.key, 'json': 'y'}
-        r = requests.get(self.VERS_API_LINK, params=payload)
-        if "error" not in r.text:
-            data = r.json()['root']
+        data = self._query(self.VERS_API_LINK, payload)
+        if data is not None:
             api_version = data['apiVersion']
             api_copyright = data['copyright']
             api_license = data['license']
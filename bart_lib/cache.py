@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory response cache used by the Bart wrapper.
+
+Entries are keyed on (API link, cmd, normalized payload) and expire after a
+per-command TTL: seconds for real-time data like etd, hours or a day for
+station, route and schedule data that BART changes at most daily.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+__author__ = "Luis Ulloa"
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# seconds each command's response stays fresh, commands not listed aren't cached
+DEFAULT_TTLS = {
+    # Advisories
+    'bsa': MINUTE,
+    'count': 15,
+    'elev': MINUTE,
+    # Real-Time Estimates
+    'etd': 15,
+    # Route Information
+    'routeinfo': DAY,
+    'routes': DAY,
+    # Schedule Information
+    'arrive': MINUTE,
+    'depart': MINUTE,
+    'fare': DAY,
+    'holiday': DAY,
+    'routesched': 6 * HOUR,
+    'scheds': 6 * HOUR,
+    'special': HOUR,
+    'stnsched': 6 * HOUR,
+    # Station Information
+    'stnaccess': DAY,
+    'stninfo': DAY,
+    'stns': DAY,
+    # Version Information
+    'ver': DAY,
+    # every *_help()
+    'help': DAY,
+}
+
+# payload fields BART treats case-insensitively
+STATION_FIELDS = ('orig', 'dest')
+
+
+def make_key(link, payload):
+    """
+    Returns the cache key for a request: (link, cmd, normalized payload).
+    The API key and None values don't change the response, so they're dropped.
+
+    :param link: API link the payload is sent to
+    :param payload: query parameters of the request
+    """
+    items = []
+    for name, value in payload.items():
+        if value is None or name in ('key', 'cmd'):
+            continue
+        value = str(value)
+        if name in STATION_FIELDS:
+            value = value.upper()
+        items.append((name, value))
+    return link, payload.get('cmd'), tuple(sorted(items))
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache with per-command TTLs and hit/miss counters.
+
+    cache = ResponseCache(maxsize=512, ttls={'etd': 30})
+
+    :param maxsize: max number of responses kept, least recently used are evicted first
+    :param ttls: overrides for DEFAULT_TTLS, a TTL of 0 disables caching for that command
+    :param stale: seconds expired responses are kept for get_stale(), see bart_lib.resilience
+    """
+
+    def __init__(self, maxsize=512, ttls=None, stale=0):
+        self.maxsize = maxsize
+        self.stale = stale
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def ttl(self, cmd):
+        """ Returns how many seconds responses for cmd stay fresh. """
+        return self.ttls.get(cmd, 0)
+
+    def get(self, key):
+        """ Returns the fresh value stored for key, None on a miss. """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None and now - entry[0] > self.stale:
+                del self._entries[key]      # expired
+            self.misses += 1
+            return None
+
+    def get_stale(self, key):
+        """ Returns (value, seconds since it expired) for an expired entry kept for key, None if there isn't one. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            age = time.monotonic() - entry[0]
+            return (entry[1], age) if 0 <= age <= self.stale else None
+
+    def set(self, key, value):
+        """ Stores value for key if its command is cacheable, evicting the LRU entry when full. """
+        ttl = self.ttl(key[1])
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Drops every entry, counters are kept. """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns a dict of hits, misses, evictions, size and hit_rate. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self._entries)
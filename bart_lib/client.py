@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Thin client for a Bart sidecar started with python -m bart_lib.serve.
+
+BartClient has every public Bart method with the same signature, but each
+call is a local HTTP request (over TCP or a Unix socket) to the sidecar,
+which serves all workers from one cache, connection pool and coalescer.
+Records come back as the same namedtuples Bart returns.
+
+bart = BartClient('/tmp/bart.sock')      # or BartClient('127.0.0.1:8377')
+bart.etd('EMBR')
+bart.stnsched_data('ASHB').items[0]
+"""
+
+import functools
+import http.client
+import json
+import socket
+import threading
+
+from bart_lib import records
+from bart_lib.bart import Bart
+
+__author__ = "Luis Ulloa"
+
+DEFAULT_ADDRESS = '127.0.0.1:8377'
+
+
+class RemoteError(Exception):
+    """ Raised when the sidecar's call failed, with the remote exception's type and message. """
+
+
+def to_wire(obj):
+    """ Returns obj as JSON-ready data, records tagged with their type so from_wire can rebuild them. """
+    if isinstance(obj, tuple):
+        if hasattr(obj, '_fields'):
+            return {'__record__': type(obj).__name__, 'fields': [to_wire(value) for value in obj]}
+        return {'__tuple__': [to_wire(value) for value in obj]}
+    if isinstance(obj, list):
+        return [to_wire(value) for value in obj]
+    if isinstance(obj, dict):
+        return {key: to_wire(value) for key, value in obj.items()}
+    return obj
+
+
+def _from_wire_hook(obj):
+    if '__record__' in obj:
+        return getattr(records, obj['__record__'])(*obj['fields'])
+    if '__tuple__' in obj:
+        return tuple(obj['__tuple__'])
+    return obj
+
+
+def from_wire(data):
+    """ Decodes a JSON document written from to_wire() data. """
+    return json.loads(data, object_hook=_from_wire_hook)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTPConnection over a Unix domain socket. """
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class BartClient:
+    """
+    ----- Bart Sidecar Client -----
+    Same methods as Bart; see python -m bart_lib.serve --help for the server side.
+
+    :param address: 'host:port' of a TCP sidecar, or the path of its Unix socket
+    :param timeout: seconds to wait for the sidecar
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()     # one keep-alive connection per thread
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if '/' in self.address:
+                conn = UnixHTTPConnection(self.address, timeout=self.timeout)
+            else:
+                host, _, port = self.address.rpartition(':')
+                conn = http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, body=None):
+        """
+        Returns the body of the sidecar's response, retrying once on a dropped keep-alive connection.
+        Any failure drops this thread's connection, the next call opens a new one.
+        """
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body, headers)
+                r = conn.getresponse()
+                data = r.read()
+                break
+            except Exception as e:
+                conn.close()    # e.g. after a timeout it's stuck waiting for the old response
+                self._local.conn = None
+                if attempt == 2 or not isinstance(e, (ConnectionError, http.client.BadStatusLine)):
+                    raise
+        if r.status != 200:
+            raise RemoteError(json.loads(data.decode('utf-8')).get('error', 'HTTP %d' % r.status))
+        return data
+
+    def _call(self, name, *args, **kwargs):
+        """ Runs Bart.name(*args, **kwargs) on the sidecar and returns its result. """
+        body = json.dumps({'args': to_wire(list(args)), 'kwargs': to_wire(kwargs)})
+        return from_wire(self._request('POST', '/call/' + name, body.encode('utf-8')))['result']
+
+    def stats(self):
+        """ Returns the sidecar's cache, coalescer and key pool stats. """
+        return json.loads(self._request('GET', '/stats').decode('utf-8'))
+
+    def close(self):
+        """ Closes this thread's connection to the sidecar. """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _remote(name):
+    """ Returns a method that runs Bart.name on the sidecar, printing help text like Bart does. """
+    @functools.wraps(getattr(Bart, name))
+    def method(self, *args, **kwargs):
+        res = self._call(name, *args, **kwargs)
+        if name.endswith('help'):
+            print(res)
+        return res
+    return method
+
+
+def _remote_stream(name):
+    """ Returns a generator method for Bart.name; the sidecar answers with the whole list. """
+    @functools.wraps(getattr(Bart, name))
+    def method(self, *args, **kwargs):
+        yield from self._call(name, *args, **kwargs)
+    return method
+
+
+for _name, _attr in vars(Bart).items():
+    if callable(_attr) and not _name.startswith('_') and _name != 'close':
+        setattr(BartClient, _name, (_remote_stream if _name.endswith('_stream') else _remote)(_name))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Request coalescing (single-flight) for identical concurrent calls.
+
+When several threads (or coroutines) ask for the same thing at the same
+time, only the first one runs the call and the rest wait for, and share,
+its result or exception.
+"""
+
+import threading
+
+__author__ = "Luis Ulloa"
+
+
+class _Call:
+    """ One in-flight call and everyone waiting on it. """
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = self.error = None
+
+
+class SingleFlight:
+    """
+    Thread-safe single-flight group.
+
+    flight = SingleFlight()
+    flight.do(key, fn)    # runs fn once per key at a time, concurrent callers share its result
+    """
+
+    def __init__(self):
+        self.calls = self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}     # key -> _Call
+
+    def do(self, key, fn):
+        """
+        Returns fn(), unless a call for key is already running, in which case
+        waits for it and returns (or raises) what it did.
+
+        :param key: hashable identity of the call, e.g. link + normalized payload
+        :param fn: zero-argument callable doing the actual work
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+        return call.result
+
+    def stats(self):
+        """ Returns a dict of calls, coalesced (calls that waited on another) and in_flight. """
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._inflight)}
+
+
+class AsyncSingleFlight:
+    """
+    Single-flight group for coroutines running on one event loop.
+
+    flight = AsyncSingleFlight()
+    await flight.do(key, lambda: fetch(...))    # factory is only called by the first caller
+    """
+
+    def __init__(self):
+        self.calls = self.coalesced = 0
+        self._inflight = {}     # key -> asyncio.Future
+
+    async def do(self, key, factory):
+        """
+        Returns await factory(), unless a call for key is already running, in
+        which case awaits that one's result instead.
+
+        :param key: hashable identity of the call
+        :param factory: zero-argument callable returning an awaitable
+        """
+        import asyncio      # already loaded by the running loop, kept out of plain Bart imports
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(factory())
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self):
+        """ Returns a dict of calls, coalesced (calls that waited on another) and in_flight. """
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._inflight)}
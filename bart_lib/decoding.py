@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+JSON decoders and HTTP content decoding for API responses.
+
+Bart decodes every response body with the fastest JSON library installed,
+straight from the raw bytes (no intermediate str): orjson, then msgspec,
+then ujson, and the standard library's json otherwise. They all build the
+same dicts and lists, so switching is only a matter of speed:
+
+bart = Bart()                       # fastest available
+bart = Bart(decoder='json')         # force the standard library
+
+Transports ask for compressed bodies with accept_encoding() (brotli only
+if the brotli or brotlicffi package is installed) and undo the compression
+with decompress() or a Decompressor, chunk by chunk when streaming.
+"""
+
+import json
+import zlib
+
+__author__ = "Luis Ulloa"
+
+# preference order of auto-selected decoders
+DECODERS = ('orjson', 'msgspec', 'ujson', 'json')
+
+BOM = b'\xef\xbb\xbf'
+
+
+def _orjson():
+    import orjson
+    return orjson.loads
+
+
+def _msgspec():
+    import msgspec
+    return msgspec.json.Decoder().decode
+
+
+def _ujson():
+    import ujson
+    return ujson.loads
+
+
+def _json():
+    return json.loads
+
+
+_LOADERS = {'orjson': _orjson, 'msgspec': _msgspec, 'ujson': _ujson, 'json': _json}
+
+
+def available_decoders():
+    """ Returns the names of the installed decoders, in preference order. """
+    names = []
+    for name in DECODERS:
+        try:
+            _LOADERS[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_decoder(name=None):
+    """
+    Returns a function decoding a UTF-8 JSON body (bytes) into Python objects. It raises a
+    ValueError subclass for malformed JSON, whichever library is behind it.
+
+    :param name: one of DECODERS, None for the fastest one installed, or a callable
+                 taking bytes, returned as is
+    """
+    if callable(name):
+        return name
+    if name is not None and name not in _LOADERS:
+        raise ValueError("unknown decoder %r, expected one of %s" % (name, ', '.join(DECODERS)))
+    if name is None:
+        for name in DECODERS:   # 'json' always imports
+            try:
+                loads = _LOADERS[name]()
+                break
+            except ImportError:
+                continue
+    else:
+        loads = _LOADERS[name]()
+
+    def decode(content):
+        if content[:3] == BOM:
+            content = content[3:]   # only the standard library skips it by itself
+        return loads(content)
+    decode.name = name
+    return decode
+
+
+# ----- content encodings -----
+
+def load_brotli():
+    """ Returns the brotli (or API-compatible brotlicffi) module, None if neither is installed. """
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            return None
+    return brotli
+
+
+def accept_encoding():
+    """ Returns the Accept-Encoding header value for the encodings decompress() supports here. """
+    return 'gzip, deflate, br' if load_brotli() is not None else 'gzip, deflate'
+
+
+class Decompressor:
+    """
+    Incremental decoder for one response's Content-Encoding.
+
+    :param encoding: Content-Encoding header value, None or 'identity' for no compression
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding = (encoding or 'identity').strip().lower()
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            self._obj = zlib.decompressobj(32 + zlib.MAX_WBITS)    # gzip or zlib header, detected
+        elif encoding == 'br':
+            brotli = load_brotli()
+            if brotli is None:
+                raise ValueError("br encoded response, but brotli isn't installed")
+            self._obj = brotli.Decompressor()
+        elif encoding == 'identity':
+            self._obj = None
+        else:
+            raise ValueError("unsupported Content-Encoding %r" % encoding)
+        self._first = True
+
+    def decompress(self, chunk):
+        """ Returns the decoded bytes of the next chunk of the body. """
+        if self._obj is None or not chunk:
+            return chunk
+        if self.encoding == 'br':
+            return self._obj.process(chunk)
+        if self._first and self.encoding == 'deflate':
+            self._first = False
+            if chunk[0] & 0x0f != 8:    # no zlib header: raw deflate, as some servers send it
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(chunk)
+
+    def flush(self):
+        """ Returns whatever decoded bytes are still buffered at the end of the body. """
+        if self._obj is None or self.encoding == 'br':
+            return b''
+        return self._obj.flush()
+
+
+def decompress(content, encoding):
+    """
+    Returns a whole response body with its Content-Encoding undone.
+
+    :param content: body bytes as received
+    :param encoding: Content-Encoding header value, None for no compression
+    """
+    if not encoding or encoding.strip().lower() == 'identity':
+        return content
+    decompressor = Decompressor(encoding)
+    return decompressor.decompress(content) + decompressor.flush()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Offline index of scheduled departures per station.
+
+DepartureIndex answers "next trains from ASHB after 5:40 PM" without
+rendering or scanning stnsched() output. The first query about a station
+fetches its stnsched items once, parses their departure times into a
+sorted array of service-day minutes (plus one per line), and from then on
+every query is a bisect into those arrays. A station's timetable is
+fetched again once BART's schedule number or the service day changes.
+
+departures = DepartureIndex(bart)
+departures.next_departures('ASHB', '5:40 PM', n=3)            # [SchedItem, ...]
+departures.next_departures('ASHB', '5:40 PM', line='ROUTE 7')
+departures.between('ASHB', '5:00 PM', '6:00 PM')
+"""
+
+import datetime
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from bart_lib.cache import HOUR
+from bart_lib.planner import SERVICE_DAY_START, service_time
+from bart_lib.records import parse_time
+from bart_lib.snapshot import DATE_FORMAT, current_sched_num
+
+__author__ = "Luis Ulloa"
+
+
+def service_minutes(value=None):
+    """
+    Returns service-day minutes (past 24:00 until 3:00 AM) for a query time.
+
+    :param value: h:mm am/pm string, service-day minutes as a number, or None for now
+    """
+    if value is None:
+        now = datetime.datetime.now()
+        return service_time(now.hour * 60 + now.minute)
+    return service_time(parse_time(value)) if isinstance(value, str) else value
+
+
+class StationTimetable:
+    """
+    One station's departures for one service day, sorted by time.
+
+    :param sched: StationSchedule (see Bart.stnsched_data)
+    """
+
+    def __init__(self, sched):
+        self.abbr = sched.abbr
+        self.sched_num = sched.sched_num
+        self.date = sched.date
+        timed = sorted(((service_time(parse_time(item.orig_time)), i) for i, item in enumerate(sched.items)))
+        self.times = array('i', [minutes for minutes, _ in timed])
+        self.items = [sched.items[i] for _, i in timed]
+        by_line = {}
+        for minutes, i in timed:
+            item = sched.items[i]
+            entry = by_line.setdefault(item.line.upper(), (array('i'), []))
+            entry[0].append(minutes)
+            entry[1].append(item)
+        self.lines = by_line    # line -> (times, items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _arrays(self, line):
+        if line is None:
+            return self.times, self.items
+        return self.lines.get(line.upper(), ((), ()))
+
+    def after(self, minutes, n=3, line=None):
+        """ Returns the first n SchedItems leaving at or after minutes, on line if given. """
+        times, items = self._arrays(line)
+        i = bisect_left(times, minutes)
+        return items[i:i + n]
+
+    def between(self, start, end, line=None):
+        """ Returns the SchedItems leaving from start up to (not including) end, on line if given. """
+        times, items = self._arrays(line)
+        return items[bisect_left(times, start):bisect_left(times, end)]
+
+
+class DepartureIndex:
+    """
+    ----- Departure Index -----
+    departures = DepartureIndex(bart)                       # nothing fetched yet
+    departures.next_departures('ASHB', '5:40 PM')           # one stnsched() for ASHB, then a bisect
+    departures.next_departures('ASHB', 1060, n=5, line='ROUTE 7')
+    departures.between('ASHB', '5:00 PM', '6:00 PM')        # [SchedItem, ...]
+    departures.preload()                                    # every station, concurrently
+
+    Times are h:mm am/pm strings or service-day minutes (1:00 AM is 25 * 60), None for now.
+
+    :param bart: Bart instance the station schedules are fetched with
+    :param date: mm/dd/yyyy service date, None to follow the current service day
+    :param check_every: seconds between checks of scheds() for a new schedule number
+    """
+
+    def __init__(self, bart, date=None, check_every=HOUR):
+        self.bart = bart
+        self.date = date
+        self.check_every = check_every
+        self.sched_num = None
+        self.fetches = 0
+        self._tables = {}       # abbr -> StationTimetable, or None if its stnsched failed
+        self._service_date = None
+        self._expires = 0       # time.time() of the next schedule/service day check
+        self._lock = threading.Lock()     # held while checking
+
+    def _check(self):
+        """ Drops every timetable once the schedule number or the service day changed. """
+        with self._lock:
+            now = time.time()
+            if now < self._expires:
+                return      # another thread just checked
+            date, expires = self.date, now + self.check_every
+            if date is None:
+                day_start = datetime.datetime.now() - datetime.timedelta(minutes=SERVICE_DAY_START)
+                date = day_start.strftime(DATE_FORMAT)
+                rollover = datetime.datetime.combine(day_start.date() + datetime.timedelta(days=1), datetime.time())
+                expires = min(expires, (rollover + datetime.timedelta(minutes=SERVICE_DAY_START)).timestamp())
+            schedules = self.bart.scheds_data()
+            sched_num = current_sched_num(schedules) if schedules else self.sched_num
+            if sched_num != self.sched_num or date != self._service_date:
+                self._tables = {}
+            self.sched_num, self._service_date, self._expires = sched_num, date, expires
+
+    def station(self, orig):
+        """ Returns orig's StationTimetable, fetching it on first use; None if stnsched failed. """
+        if time.time() >= self._expires:
+            self._check()
+        orig = orig.upper()
+        try:
+            return self._tables[orig]
+        except KeyError:
+            pass
+        self.fetches += 1
+        sched = self.bart.stnsched_data(orig, self._service_date)
+        table = StationTimetable(sched) if sched is not None else None
+        self._tables[orig] = table      # a failure stays None until the next check
+        return table
+
+    def preload(self, stations=None, max_workers=8):
+        """
+        Fetches the timetables of stations (every station from stns() by default) concurrently,
+        max_workers at a time. Returns the number of stations loaded.
+        """
+        if stations is None:
+            stations = [stn.abbr for stn in self.bart.stns_data() or ()]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return sum(table is not None for table in executor.map(self.station, stations))
+
+    def next_departures(self, orig, after=None, n=3, line=None):
+        """
+        Returns the next n SchedItems leaving orig at or after a time, earliest first.
+
+        :param orig: station abbreviation
+        :param after: h:mm am/pm string or service-day minutes, None for now
+        :param n: max departures returned
+        :param line: only trains on this line, e.g. 'ROUTE 7'
+        """
+        table = self.station(orig)
+        if table is None:
+            return []
+        return table.after(service_minutes(after), n, line)
+
+    def between(self, orig, start, end, line=None):
+        """
+        Returns the SchedItems leaving orig from start up to (not including) end, earliest first.
+
+        :param orig: station abbreviation
+        :param start: h:mm am/pm string or service-day minutes, None for now
+        :param end: h:mm am/pm string or service-day minutes
+        :param line: only trains on this line, e.g. 'ROUTE 7'
+        """
+        table = self.station(orig)
+        if table is None:
+            return []
+        return table.between(service_minutes(start), service_minutes(end), line)
+
+    def lines(self, orig):
+        """ Returns the names of the lines leaving orig, sorted. """
+        table = self.station(orig)
+        return sorted(table.lines) if table is not None else []
+
+    def __len__(self):
+        return sum(table is not None for table in self._tables.values())
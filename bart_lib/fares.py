@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed all-pairs fare matrix.
+
+FareMatrix holds every station-to-station fare of one schedule in a dense
+array of cents (fare class x origin x destination), so fare lookups are a
+couple of dict hits and an index instead of an HTTP round trip. It's filled
+with bounded concurrent fare() requests, saved to a compact binary file, and
+rebuilt only when scheds() reports a new schedule. A running process re-checks
+the schedule every CHECK_EVERY seconds and, once a new one is in effect, answers
+fares from the API while the matrix is rebuilt in the background.
+
+bart = Bart()
+bart.fare_matrix = FareMatrix.load_or_build(bart, 'fares.bin')
+bart.fare('ASHB', 'CIVC')   # served from memory
+"""
+
+import json
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from bart_lib.cache import HOUR
+from bart_lib.records import Fare, FareQuote
+from bart_lib.snapshot import current_sched_num
+
+__author__ = "Luis Ulloa"
+
+MISSING = -1
+
+
+def to_cents(amount):
+    """ Returns a fare amount string like '2.10' in cents. """
+    dollars, _, cents = amount.partition('.')
+    return int(dollars or 0) * 100 + int((cents + '00')[:2])
+
+
+def from_cents(cents):
+    """ Returns cents formatted like BART's fare amounts, e.g. '2.10'. """
+    return "%d.%02d" % divmod(cents, 100)
+
+
+class FareMatrix:
+    """
+    Dense fare table for one schedule.
+
+    :param sched_num: schedule number the fares belong to
+    :param stations: list of station abbreviations, the matrix's row/column order
+    :param classes: list of (name, fare_class) pairs, e.g. ('Clipper', 'clipper')
+    :param cents: array('i') of len(classes) * len(stations) ** 2 fares in cents, MISSING if unknown
+    :param path: file the matrix was loaded from or saved to, a rebuild is saved there
+    """
+    MAGIC = b'BARTFARE1\n'
+
+    # seconds between checks that sched_num is still the schedule in effect
+    CHECK_EVERY = HOUR
+
+    def __init__(self, sched_num, stations, classes, cents=None, path=None):
+        self.sched_num = sched_num
+        self.path = path
+        self.checked = time.monotonic()
+        self.outdated = False
+        self._lock = threading.Lock()
+        self.stations = list(stations)
+        self.classes = [tuple(cls) for cls in classes]
+        self.index = {abbr: i for i, abbr in enumerate(self.stations)}
+        size = len(self.classes) * len(self.stations) ** 2
+        self.cents = cents if cents is not None else array('i', [MISSING]) * size
+        if len(self.cents) != size:
+            raise ValueError("fare matrix has %d entries, expected %d" % (len(self.cents), size))
+
+    def _offset(self, cls, orig, dest):
+        n = len(self.stations)
+        return (cls * n + orig) * n + dest
+
+    def get(self, orig, dest):
+        """ Returns the FareQuote for orig -> dest, None if the pair isn't in the matrix. """
+        i, j = self.index.get(orig.upper()), self.index.get(dest.upper())
+        if i is None or j is None:
+            return None
+        fares = []
+        for cls, (name, fare_class) in enumerate(self.classes):
+            cents = self.cents[self._offset(cls, i, j)]
+            if cents != MISSING:
+                fares.append(Fare(name, from_cents(cents), fare_class))
+        return FareQuote(self.stations[i], self.stations[j], tuple(fares)) if fares else None
+
+    def set(self, orig, dest, quote):
+        """ Stores every fare of quote (a FareQuote) for orig -> dest, adding unseen fare classes. """
+        i, j = self.index[orig.upper()], self.index[dest.upper()]
+        for fare in quote.fares:
+            key = (fare.name, fare.fare_class)
+            if key not in self.classes:
+                self.classes.append(key)
+                self.cents.extend(array('i', [MISSING]) * len(self.stations) ** 2)
+            self.cents[self._offset(self.classes.index(key), i, j)] = to_cents(fare.amount)
+
+    def __len__(self):
+        """ Returns the number of station pairs that have at least one fare. """
+        n = len(self.stations)
+        return sum(1 for i in range(n) for j in range(n)
+                   if any(self.cents[self._offset(cls, i, j)] != MISSING for cls in range(len(self.classes))))
+
+    @classmethod
+    def build(cls, bart, sched_num, stations=None, max_workers=8):
+        """
+        Fetches every station pair's fare with at most max_workers requests in flight.
+
+        The fares are requested for sched_num (the schedule in effect if None), never
+        from a fare matrix already attached to bart.
+
+        :param bart: Bart instance used for stns_data() and fare requests
+        :param sched_num: schedule number the fares are for
+        :param stations: station abbreviations, defaults to every station from stns()
+        :param max_workers: max concurrent fare() requests
+        """
+        if stations is None:
+            stations = [stn.abbr for stn in bart.stns_data() or ()]
+        matrix = cls(sched_num, stations, [])
+        pairs = [(orig, dest) for orig in matrix.stations for dest in matrix.stations if orig != dest]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            quotes = executor.map(lambda pair: bart._fare_query(*pair, sched=sched_num), pairs)
+            for (orig, dest), quote in zip(pairs, quotes):
+                if quote is not None:
+                    matrix.set(orig, dest, quote)
+        return matrix
+
+    def save(self, path):
+        """ Writes the matrix to path: a magic line, a JSON header line, then the raw array. """
+        header = {'sched_num': self.sched_num, 'stations': self.stations, 'classes': self.classes,
+                  'itemsize': self.cents.itemsize}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            self.cents.tofile(f)
+        os.replace(tmp, path)     # readers never see a half-written file
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a matrix written by save(), None if path doesn't exist or isn't a whole fare matrix. """
+        try:
+            with open(path, 'rb') as f:
+                if f.readline() != cls.MAGIC:
+                    return None
+                header = json.loads(f.readline().decode('utf-8'))
+                cents = array('i')
+                if cents.itemsize != header['itemsize']:
+                    return None
+                cents.frombytes(f.read())
+            return cls(header['sched_num'], header['stations'], header['classes'], cents, path)
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            return None     # truncated or corrupt, load_or_build rebuilds it
+
+    @classmethod
+    def load_or_build(cls, bart, path, max_workers=8):
+        """
+        Returns the matrix saved at path if it's for the schedule in effect today,
+        otherwise builds it for that schedule and saves it to path.
+
+        :param bart: Bart instance used for scheds_data(), stns_data() and fare_data()
+        :param path: file the matrix is cached in
+        :param max_workers: max concurrent fare() requests while building
+        """
+        matrix = cls.load(path)
+        sched_num = _current_sched(bart)
+        if matrix is not None and (sched_num is None or matrix.sched_num == sched_num):
+            return matrix       # up to date, or can't tell (keep serving what we have)
+        matrix = cls.build(bart, sched_num, max_workers=max_workers)
+        matrix.save(path)
+        return matrix
+
+    def refresh(self, bart, max_workers=8):
+        """
+        Returns a matrix for the schedule in effect: this one if it still is (or that can't
+        be told), otherwise a new one built for it, saved to path if this one has a path.
+
+        :param bart: Bart instance used for scheds_data(), stns_data() and fare requests
+        :param max_workers: max concurrent fare() requests while building
+        """
+        sched_num = _current_sched(bart)
+        if sched_num is None or sched_num == self.sched_num:
+            return self
+        matrix = type(self).build(bart, sched_num, max_workers=max_workers)
+        if self.path is not None:
+            matrix.save(self.path)
+        return matrix
+
+    def current(self, bart):
+        """
+        Returns True while sched_num is the schedule in effect, re-checked with scheds()
+        at most every CHECK_EVERY seconds. Once it isn't, returns False and rebuilds the
+        matrix on a background thread, which replaces bart.fare_matrix when it's done.
+
+        :param bart: Bart instance this matrix is attached to
+        """
+        with self._lock:
+            if self.outdated or time.monotonic() - self.checked < self.CHECK_EVERY:
+                return not self.outdated
+            self.checked = time.monotonic()
+        sched_num = _current_sched(bart)
+        if sched_num is None or sched_num == self.sched_num:
+            return True
+        with self._lock:
+            if self.outdated:
+                return False    # another thread noticed first and is rebuilding
+            self.outdated = True
+        threading.Thread(target=self._replace, args=(bart,), name='bart-fare-matrix', daemon=True).start()
+        return False
+
+    def _replace(self, bart):
+        try:
+            matrix = self.refresh(bart)
+        except Exception:
+            with self._lock:
+                self.outdated = False   # check and try again in CHECK_EVERY seconds
+            return
+        if matrix is self:
+            with self._lock:
+                self.outdated = False   # the schedule couldn't be told after all
+        elif bart.fare_matrix is self:
+            bart.fare_matrix = matrix
+
+
+def _current_sched(bart):
+    """ Returns the schedule number in effect according to bart.scheds_data(), None if unknown. """
+    schedules = bart.scheds_data()
+    return current_sched_num(schedules) if schedules else None
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar history of ETD observations for service analytics.
+
+ETDHistory appends every departure of each etd report as one row of
+fixed-width columns (array.array, one per field) and can persist them as
+one raw file per column, memory-mapped on load. Strings (stations,
+destinations, colors) are dictionary-encoded to small integer codes.
+
+Aggregates reduce the columns in a single counting pass over (key...,
+value) tuples: collections.Counter over zipped columns in C, or numpy's
+unique() when numpy is installed. Only the small result is touched in
+Python, so millions of rows aggregate in well under a second.
+
+history = ETDHistory('etd_history')
+history.record(bart.etd_data('ALL'), train_count=bart.train_count())
+history.flush()
+history.headways()      # {('EMBR', 2, 'YELLOW'): (mean minutes, samples), ...}
+"""
+
+import json
+import mmap
+import os
+import time
+from array import array
+from collections import Counter
+
+__author__ = "Luis Ulloa"
+
+# column name -> array typecode
+COLUMNS = (
+    ('snap', 'I'),          # report number, rows of one etd report share it
+    ('station', 'H'),       # code into stations
+    ('destination', 'H'),   # code into destinations (abbreviations)
+    ('color', 'B'),         # code into colors
+    ('platform', 'B'),      # 0 if unknown
+    ('direction', 'B'),     # 0 unknown, 1 North, 2 South
+    ('minutes', 'h'),       # 0 for 'Leaving'
+    ('gap', 'h'),           # minutes after the previous train to the same destination in the report, -1 if first
+    ('length', 'B'),        # cars, 0 if unknown
+    ('delay', 'i'),         # seconds
+)
+DIRECTIONS = {'North': 1, 'South': 2}
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _numpy():
+    """ Returns the numpy module, None if it isn't installed. """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class ETDHistory:
+    """
+    Append-only columnar store of ETD departures.
+
+    :param path: directory the columns are persisted in, None to keep them in memory only.
+                 Existing columns are memory-mapped read-only, new rows are kept in memory
+                 until flush() appends them.
+    :param use_numpy: aggregate with numpy if it's installed (the result is the same)
+    """
+    META = 'meta.json'
+
+    def __init__(self, path=None, use_numpy=True):
+        self.path = path
+        self.np = _numpy() if use_numpy else None
+        self.stations, self.destinations, self.colors = [], [], []
+        self.snaps = []             # (timestamp, reported train count or None) per report
+        self._codes = {}            # (dictionary name, string) -> code
+        self._mapped = {}           # column -> read-only memoryview of the flushed rows
+        self._maps = []
+        self._tail = {name: array(code) for name, code in COLUMNS}
+        if path is not None and os.path.exists(os.path.join(path, self.META)):
+            self._load()
+
+    # ----- writing -----
+
+    def _code(self, dictionary, value):
+        code = self._codes.get((dictionary, value))
+        if code is None:
+            values = getattr(self, dictionary)
+            code = self._codes[(dictionary, value)] = len(values)
+            values.append(value)
+        return code
+
+    def record(self, report, timestamp=None, train_count=None):
+        """
+        Appends every departure of an ETDReport (see Bart.etd_data) as one row each.
+        Returns the number of rows added.
+
+        :param report: ETDReport, None (a failed call) is ignored
+        :param timestamp: seconds since the epoch, defaults to now
+        :param train_count: trains in service reported at the same time (Bart.train_count()), if known
+        """
+        if report is None:
+            return 0
+        snap = len(self.snaps)
+        self.snaps.append((timestamp if timestamp is not None else time.time(), _int(train_count, None)))
+        tail = self._tail
+        added = 0
+        for stn in report.stations:
+            station = self._code('stations', stn.abbr.upper())
+            previous = {}
+            for dep in stn.departures:
+                destination = self._code('destinations', dep.abbreviation or dep.destination)
+                minutes = 0 if dep.minutes == 'Leaving' else _int(dep.minutes)
+                last = previous.get(destination)
+                previous[destination] = minutes
+                for name, value in (('snap', snap), ('station', station), ('destination', destination),
+                                    ('color', self._code('colors', dep.color or '')),
+                                    ('platform', _int(dep.platform)),
+                                    ('direction', DIRECTIONS.get(dep.direction, 0)),
+                                    ('minutes', minutes), ('gap', minutes - last if last is not None else -1),
+                                    ('length', _int(dep.length)), ('delay', _int(dep.delay))):
+                    tail[name].append(value)
+                added += 1
+        return added
+
+    def flush(self):
+        """ Appends rows recorded since the last flush to the column files and remaps them. """
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        rows = len(self)
+        flushed = rows - len(self._tail['snap'])
+        self.close()
+        for name, code in COLUMNS:
+            with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                f.truncate(flushed * self._tail[name].itemsize)    # drop rows a crashed flush left behind
+                self._tail[name].tofile(f)
+        meta = {'rows': rows, 'stations': self.stations, 'destinations': self.destinations,
+                'colors': self.colors, 'snaps': self.snaps}
+        tmp = os.path.join(self.path, self.META + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, self.META))     # the new rows only count from here
+        self._tail = {name: array(code) for name, code in COLUMNS}
+        self._load()
+
+    # ----- reading -----
+
+    def _load(self):
+        with open(os.path.join(self.path, self.META)) as f:
+            meta = json.load(f)
+        self.stations, self.destinations, self.colors = meta['stations'], meta['destinations'], meta['colors']
+        self.snaps = [tuple(snap) for snap in meta['snaps']]
+        self._codes = {}
+        for dictionary in ('stations', 'destinations', 'colors'):
+            self._codes.update(((dictionary, value), code) for code, value in enumerate(getattr(self, dictionary)))
+        rows = meta['rows']
+        for name, code in COLUMNS:
+            with open(os.path.join(self.path, name + '.bin'), 'rb') as f:
+                if rows:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._maps.append(mapped)
+                    self._mapped[name] = memoryview(mapped)[:rows * array(code).itemsize].cast(code)
+                else:
+                    self._mapped[name] = memoryview(array(code))
+
+    def __len__(self):
+        return len(self._tail['snap']) + (len(self._mapped['snap']) if self._mapped else 0)
+
+    def column(self, name):
+        """ Returns a column's values, flushed rows first: a numpy array if numpy is used, a list otherwise. """
+        mapped, tail = self._mapped.get(name), self._tail[name]
+        if self.np is not None:
+            parts = [self.np.frombuffer(part, dtype=self.np.dtype(tail.typecode))
+                     for part in (mapped, tail) if part is not None and len(part)]
+            if len(parts) == 1:
+                return parts[0]     # zero-copy view of the mapped file (or the tail)
+            return self.np.concatenate(parts) if parts else self.np.zeros(0, dtype=tail.typecode)
+        return (mapped.tolist() if mapped is not None else []) + tail.tolist()
+
+    def _counts(self, keys, value):
+        """ Returns a Counter of (key column values..., value column value) tuples over every row. """
+        columns = [self.column(name) for name in keys + (value,)]
+        np = self.np
+        if np is None:
+            return Counter(zip(*columns))
+        if not len(columns[0]):
+            return Counter()
+        # mixed-radix encode each row into one int64, count the distinct codes, decode them
+        offsets = [int(col.min()) for col in columns]
+        radices = [int(col.max()) - offset + 1 for col, offset in zip(columns, offsets)]
+        combined = np.zeros(len(columns[0]), dtype=np.int64)
+        for col, offset, radix in zip(columns, offsets, radices):
+            combined *= radix
+            combined += col.astype(np.int64) - offset
+        codes, counts = np.unique(combined, return_counts=True)
+        res = Counter()
+        for code, count in zip(codes.tolist(), counts.tolist()):
+            values = []
+            for offset, radix in zip(reversed(offsets), reversed(radices)):
+                code, digit = divmod(code, radix)
+                values.append(digit + offset)
+            res[tuple(reversed(values))] = count
+        return res
+
+    def _decode(self, keys, values):
+        decoded = []
+        for key, value in zip(keys, values):
+            names = {'station': self.stations, 'destination': self.destinations, 'color': self.colors}.get(key)
+            decoded.append(names[value] if names is not None else value)
+        return tuple(decoded)
+
+    # ----- aggregates -----
+
+    def headways(self, by=('station', 'platform', 'color')):
+        """
+        Returns {(by values...): (mean headway in minutes, samples)}. A sample is the gap
+        between two consecutive trains to the same destination in one report.
+
+        :param by: columns to group on, e.g. ('color',) for per-line headways
+        """
+        by = tuple(by)
+        totals = {}
+        for key, count in self._counts(by, 'gap').items():
+            if key[-1] < 0:
+                continue    # first train to a destination, no gap
+            entry = totals.setdefault(key[:-1], [0, 0])
+            entry[0] += key[-1] * count
+            entry[1] += count
+        return {self._decode(by, key): (total / samples, samples) for key, (total, samples) in totals.items()}
+
+    def delays(self, by=('station',)):
+        """
+        Returns {(by values...): {'count', 'delayed', 'mean', 'p50', 'p90', 'max'}} of delays in seconds.
+
+        :param by: columns to group on, e.g. ('color',) for per-line delays
+        """
+        by = tuple(by)
+        histograms = {}
+        for key, count in self._counts(by, 'delay').items():
+            histograms.setdefault(key[:-1], {})[key[-1]] = count
+        res = {}
+        for key, histogram in histograms.items():
+            values = sorted(histogram)
+            count = sum(histogram.values())
+
+            def quantile(q):
+                seen, target = 0, q * count
+                for value in values:
+                    seen += histogram[value]
+                    if seen >= target:
+                        return value
+                return values[-1]
+            res[self._decode(by, key)] = {
+                'count': count, 'delayed': sum(n for value, n in histogram.items() if value > 0),
+                'mean': sum(value * n for value, n in histogram.items()) / count,
+                'p50': quantile(0.5), 'p90': quantile(0.9), 'max': values[-1]}
+        return res
+
+    def departures(self, by=('station',)):
+        """ Returns {(by values...): departures recorded}, e.g. by=('station', 'color'). """
+        by = tuple(by)
+        res = Counter()
+        for key, count in self._counts(by[:-1], by[-1]).items():
+            res[self._decode(by, key)] += count
+        return dict(res)
+
+    def train_counts(self):
+        """
+        Returns (timestamp, departures listed, distinct destination/color lines, reported train count)
+        for every report, to compare what etd showed with train_count().
+        """
+        lines = Counter(snap for snap, _, _ in self._counts(('snap', 'destination'), 'color'))
+        rows = self._counts((), 'snap')
+        return [(timestamp, rows.get((snap,), 0), lines.get(snap, 0), reported)
+                for snap, (timestamp, reported) in enumerate(self.snaps)]
+
+    def close(self):
+        """ Releases the memory-mapped columns; maps still referenced by numpy columns are left to them. """
+        for view in list(self._mapped.values()) + self._maps:
+            try:
+                view.release() if isinstance(view, memoryview) else view.close()
+            except BufferError:
+                pass    # numpy arrays from column() still point into it, the map closes with them
+        self._mapped = {}
+        self._maps = []
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of BART API keys that upstream requests are spread over.
+
+The API limits each key, so a Bart given several keys can send that many
+times more requests. KeyPool hands every request the key with the most
+headroom (or the next one in turn), keeps a token bucket per key so none
+of them goes over its own rate, and takes a key out of rotation for a
+while when the API rejects it: HTTP 401/403/429 or an invalid key error.
+
+bart = Bart(key=['KEY-ONE', 'KEY-TWO', 'KEY-THREE'])               # default pool
+bart = Bart(key=KeyPool(['KEY-ONE', 'KEY-TWO'], rate=5, strategy='round_robin'))
+bart.keys.stats()       # per-key requests, errors, in flight, quarantine
+"""
+
+import re
+import threading
+import time
+
+__author__ = "Luis Ulloa"
+
+LEAST_LOADED, ROUND_ROBIN = 'least_loaded', 'round_robin'
+
+# responses that blame the key rather than the request
+KEY_STATUSES = (401, 403)
+THROTTLED_STATUS = 429
+KEY_ERROR = re.compile(rb'invalid[^"]{0,20}key|api key', re.IGNORECASE)
+
+# longest body still checked for KEY_ERROR, BART's error documents are tiny
+KEY_ERROR_MAX_BYTES = 1024
+
+
+def mask(key):
+    """ Returns key with all but its first and last 4 characters hidden, for stats and logs. """
+    if len(key) <= 8:
+        return key[:2] + '*' * (len(key) - 2)
+    return key[:4] + re.sub(r'[^-]', '*', key[4:-4]) + key[-4:]
+
+
+class KeyState:
+    """ Usage counters and token bucket of one key, guarded by its KeyPool's lock. """
+
+    def __init__(self, key, burst):
+        self.key = key
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.requests = self.errors = self.failures = self.quarantines = 0
+        self.strikes = 0            # quarantines since the key last worked, doubles the next one
+        self.quarantined_until = 0
+
+    def stats(self, now):
+        return {'requests': self.requests, 'errors': self.errors, 'in_flight': self.in_flight,
+                'tokens': round(self.tokens, 2), 'quarantines': self.quarantines,
+                'quarantined': max(0.0, round(self.quarantined_until - now, 1))}
+
+
+class KeyPool:
+    """
+    Thread-safe pool of API keys with per-key token accounting and quarantine.
+
+    :param keys: API keys
+    :param rate: requests per second each key may send, None to only count them
+    :param burst: per-key bucket size, defaults to rate
+    :param strategy: LEAST_LOADED picks the key with the fewest requests in flight and the
+                     most tokens left, ROUND_ROBIN takes the available keys in turn
+    :param failures: key errors in a row that quarantine a key (a 429 quarantines at once)
+    :param quarantine: seconds a key is first quarantined for, doubling each time up to max_quarantine
+    :param max_quarantine: longest quarantine in seconds
+    """
+
+    def __init__(self, keys, rate=None, burst=None, strategy=LEAST_LOADED, failures=3, quarantine=30,
+                 max_quarantine=600):
+        if isinstance(keys, str):
+            keys = [keys]
+        if not keys:
+            raise ValueError("KeyPool needs at least one key")
+        if strategy not in (LEAST_LOADED, ROUND_ROBIN):
+            raise ValueError("unknown strategy %r, expected %r or %r" % (strategy, LEAST_LOADED, ROUND_ROBIN))
+        self.keys = list(keys)
+        self.rate = float(rate) if rate is not None else None
+        self.burst = float(burst if burst is not None else max(1, rate or 1))
+        self.strategy = strategy
+        self.failures = failures
+        self.quarantine = quarantine
+        self.max_quarantine = max_quarantine
+        self._states = [KeyState(key, self.burst) for key in self.keys]
+        self._by_key = {state.key: state for state in self._states}
+        self._next = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _refill(self, state, now):
+        if self.rate is not None:
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+
+    def _pick(self, ready):
+        if self.strategy == ROUND_ROBIN:
+            count = len(self._states)
+            for offset in range(count):
+                state = self._states[(self._next + offset) % count]
+                if state in ready:
+                    self._next = (self._next + offset + 1) % count
+                    return state
+        return min(ready, key=lambda state: (state.in_flight, -state.tokens, state.requests))
+
+    def acquire(self, timeout=None):
+        """
+        Returns the key the next request should use, waiting up to timeout seconds (forever
+        if None) for one to have a token. Every key is used again while all are quarantined.
+        Each acquire() must be followed by a release().
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                usable = [state for state in self._states if state.quarantined_until <= now] or self._states
+                for state in usable:
+                    self._refill(state, now)
+                ready = [state for state in usable if self.rate is None or state.tokens >= 1]
+                if ready:
+                    state = self._pick(ready)
+                    if self.rate is not None:
+                        state.tokens -= 1
+                    state.in_flight += 1
+                    state.requests += 1
+                    return state.key
+                wait = min((1 - state.tokens) / self.rate for state in usable)
+                if deadline is not None:
+                    if now >= deadline:
+                        raise TimeoutError("no API key had a token within %ss" % timeout)
+                    wait = min(wait, deadline - now)
+                self._cond.wait(max(wait, 0.001))
+
+    def release(self, key, response=None):
+        """
+        Returns key to the pool, quarantining it if response blames the key.
+
+        :param key: key from acquire()
+        :param response: the request's response, None if it failed before one arrived
+                         (network errors aren't the key's fault)
+        """
+        with self._cond:
+            state = self._by_key[key]
+            state.in_flight -= 1
+            if response is not None:
+                status = response.status_code
+                if status == THROTTLED_STATUS:
+                    self._fail(state, quarantine=True)
+                elif status in KEY_STATUSES or self._key_error(response):
+                    self._fail(state)
+                else:
+                    state.failures = state.strikes = 0
+            self._cond.notify_all()
+
+    @staticmethod
+    def _key_error(response):
+        """ Returns True if a 200 response is BART's invalid key error. """
+        content = response.content
+        return len(content) <= KEY_ERROR_MAX_BYTES and KEY_ERROR.search(content) is not None
+
+    def _fail(self, state, quarantine=False):
+        state.errors += 1
+        state.failures += 1
+        now = time.monotonic()
+        if state.quarantined_until > now:
+            return      # used while every key was quarantined, it's already serving its time
+        if quarantine or state.failures >= self.failures:
+            state.quarantined_until = now + min(self.quarantine * 2 ** state.strikes, self.max_quarantine)
+            state.quarantines += 1
+            state.strikes += 1
+            state.failures = 0
+
+    def stats(self):
+        """ Returns {masked key: {'requests', 'errors', 'in_flight', 'tokens', 'quarantines', 'quarantined'}}. """
+        with self._cond:
+            now = time.monotonic()
+            for state in self._states:
+                self._refill(state, now)
+            return {mask(state.key): state.stats(now) for state in self._states}
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation hooks for the Bart wrapper.
+
+Bart reports to its metrics object on every call:
+
+    timing(cmd, phase, seconds)   phase is one of PHASES
+    incr(cmd, name, value=1)      name is one of COUNTERS
+
+NullMetrics (the default) does nothing and Bart skips its timers entirely.
+MemoryMetrics keeps counters and latency histograms in memory and can
+render them in the Prometheus text format, StatsdMetrics sends them to a
+StatsD daemon over UDP.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+__author__ = "Luis Ulloa"
+
+# request: whole upstream round trip; ttfb: until response headers arrived (DNS, connect,
+# TLS, server time); transfer: reading the body; decode: JSON; parse: records; render: strings
+PHASES = ('request', 'ttfb', 'transfer', 'decode', 'parse', 'render')
+
+COUNTERS = ('requests', 'bytes', 'wire_bytes', 'errors',
+            'cache_hits', 'cache_misses', 'snapshot_hits', 'stale_hits', 'coalesced')
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class NullMetrics:
+    """ Metrics sink that drops everything. Bart doesn't time anything while enabled is False. """
+    enabled = False
+
+    def timing(self, cmd, phase, seconds):
+        pass
+
+    def incr(self, cmd, name, value=1):
+        pass
+
+    @contextmanager
+    def timer(self, cmd, phase):
+        """ Times the with block as cmd's phase. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(cmd, phase, time.perf_counter() - start)
+
+
+class Histogram:
+    """ Fixed-bucket latency histogram. """
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)     # last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket holding the q-th quantile (0 < q <= 1). """
+        target, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return 0.0
+
+
+class MemoryMetrics(NullMetrics):
+    """
+    Thread-safe in-memory counters and histograms, keyed by (cmd, name/phase).
+
+    metrics = MemoryMetrics()
+    bart = Bart(metrics=metrics)
+    metrics.summary()        # {'etd': {'request': {'count': 3, 'mean': 0.08, 'p99': 0.1}, 'bytes': 5120, ...}}
+    metrics.prometheus()     # text exposition format
+    """
+    enabled = True
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def timing(self, cmd, phase, seconds):
+        with self._lock:
+            histogram = self.histograms.get((cmd, phase))
+            if histogram is None:
+                histogram = self.histograms[(cmd, phase)] = Histogram()
+            histogram.observe(seconds)
+
+    def incr(self, cmd, name, value=1):
+        with self._lock:
+            self.counters[(cmd, name)] = self.counters.get((cmd, name), 0) + value
+
+    def summary(self):
+        """ Returns {cmd: {counter: value, phase: {'count', 'mean', 'p50', 'p99'}}}. """
+        res = {}
+        with self._lock:
+            for (cmd, name), value in self.counters.items():
+                res.setdefault(cmd, {})[name] = value
+            for (cmd, phase), hist in self.histograms.items():
+                res.setdefault(cmd, {})[phase] = {'count': hist.count, 'mean': hist.total / hist.count,
+                                                  'p50': hist.quantile(0.5), 'p99': hist.quantile(0.99)}
+        return res
+
+    def prometheus(self, prefix='bart'):
+        """ Returns every counter and histogram in the Prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            for name in sorted({name for _, name in self.counters}):
+                lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+                lines.extend(['%s_%s_total{cmd="%s"} %d' % (prefix, name, cmd, value)
+                              for (cmd, counter), value in sorted(self.counters.items()) if counter == name])
+            if self.histograms:
+                lines.append("# TYPE %s_seconds histogram" % prefix)
+            for (cmd, phase), hist in sorted(self.histograms.items()):
+                labels = 'cmd="%s",phase="%s"' % (cmd, phase)
+                seen = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), hist.counts):
+                    seen += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, le, seen))
+                lines.append('%s_seconds_sum{%s} %r' % (prefix, labels, hist.total))
+                lines.append('%s_seconds_count{%s} %d' % (prefix, labels, hist.count))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """ Drops every counter and histogram. """
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+class StatsdMetrics(NullMetrics):
+    """
+    Sends metrics to a StatsD daemon over UDP: timings as '<prefix>.<cmd>.<phase>:<ms>|ms'
+    and counters as '<prefix>.<cmd>.<name>:<value>|c'. Sends never block or raise.
+
+    :param host: StatsD host
+    :param port: StatsD UDP port
+    :param prefix: metric name prefix
+    """
+    enabled = True
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='bart'):
+        import socket
+        self.address = (host, port)
+        self.prefix = prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def _send(self, line):
+        try:
+            self._sock.sendto(line.encode('ascii'), self.address)
+        except OSError:
+            pass    # metrics are best effort
+
+    def timing(self, cmd, phase, seconds):
+        self._send("%s.%s.%s:%.3f|ms" % (self.prefix, cmd, phase, seconds * 1000))
+
+    def incr(self, cmd, name, value=1):
+        self._send("%s.%s.%s:%d|c" % (self.prefix, cmd, name, value))
+
+    def close(self):
+        self._sock.close()
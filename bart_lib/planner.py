@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Offline trip planner over BART route schedules.
+
+TripPlanner indexes the train/stop data from routesched() into a timetable
+of elementary connections (one train running between two consecutive stops)
+and answers earliest-arrival and latest-departure queries with the Connection
+Scan Algorithm, including transfers between trains. arrive()/depart() return
+the same TripPlan records, and render to the same strings, as Bart's.
+"""
+
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from bart_lib.records import Trip, TripPlan, format_time, parse_time, render_trips
+
+__author__ = "Luis Ulloa"
+
+Journey = namedtuple('Journey', 'dep_time arr_time')
+
+DAY = 24 * 60
+
+# times before this (3:00 AM) belong to the previous service day, e.g. 12:30 AM -> 24:30
+SERVICE_DAY_START = 3 * 60
+
+NEVER = 1 << 30
+
+
+def service_time(minutes):
+    """ Returns minutes after midnight on the service day's clock, which runs past 24:00. """
+    return minutes + DAY if minutes < SERVICE_DAY_START else minutes
+
+
+class TripPlanner:
+    """
+    ----- Offline Trip Planner -----
+    planner = TripPlanner.from_bart(bart)            # one routesched() per route, then no network
+    planner.depart('ASHB', 'CIVC', '5:40 PM')       # same output as bart.depart('ASHB', 'CIVC', '5:40pm')
+    planner.arrive_data('ASHB', 'CIVC', '6:00 PM')   # TripPlan of Trip records
+    planner.earliest_arrival('ASHB', 'CIVC', '5:40 PM')
+
+    :param schedules: iterable of RouteSchedule records (see Bart.routesched_data) for one service day
+    :param date: service date the schedules are for, mm/dd/yyyy, used for Trip.date
+    :param fares: optional callable (orig, dest) -> FareQuote used to fill in trip fares
+    :param transfer_time: minutes needed to change trains at a station
+    """
+
+    def __init__(self, schedules, date=None, fares=None, transfer_time=0):
+        self.date = date or datetime.date.today().strftime('%m/%d/%Y')
+        self.fares = fares
+        self.transfer_time = transfer_time
+        self.stations = {}      # abbr -> index
+        connections = []        # (dep, arr, from, to, train)
+        train_num = 0
+        for sched in schedules:
+            for train in sched.trains:
+                prev = None
+                for stop in train.stops:
+                    minutes = service_time(parse_time(stop.orig_time))
+                    if prev is not None:
+                        while minutes < prev[1]:     # crossed midnight mid-trip
+                            minutes += DAY
+                        connections.append((prev[1], minutes, prev[0], self._station(stop.station), train_num))
+                    else:
+                        self._station(stop.station)
+                    prev = (self.stations[stop.station], minutes)
+                train_num += 1
+        self.train_count = train_num
+
+        connections.sort()
+        self.dep = array('i', [conn[0] for conn in connections])
+        self.arr = array('i', [conn[1] for conn in connections])
+        self.frm = array('i', [conn[2] for conn in connections])
+        self.to = array('i', [conn[3] for conn in connections])
+        self.train = array('i', [conn[4] for conn in connections])
+        # connection indices ordered by arrival time, for the backward (latest departure) scan
+        self.by_arr = array('i', sorted(range(len(connections)), key=self.arr.__getitem__))
+        self.arr_sorted = array('i', [self.arr[i] for i in self.by_arr])
+
+    @classmethod
+    def from_bart(cls, bart, date=None, fares=True, transfer_time=0):
+        """
+        Builds a planner from every route's routesched() for date (default today).
+
+        :param bart: Bart instance used to fetch routes and route schedules
+        :param date: mm/dd/yyyy, defaults to today
+        :param fares: True to look fares up with bart.fare_data (cached), or a callable/None, see TripPlanner
+        :param transfer_time: minutes needed to change trains at a station
+        """
+        routes = bart.routes_data(date=date) or []
+        schedules = [bart.routesched_data(route.number, date=date) for route in routes]
+        return cls([sched for sched in schedules if sched is not None], date,
+                   bart.fare_data if fares is True else fares, transfer_time)
+
+    def __len__(self):
+        """ Returns the number of connections in the timetable. """
+        return len(self.dep)
+
+    def _station(self, abbr):
+        return self.stations.setdefault(abbr, len(self.stations))
+
+    def _earliest(self, orig, dest, time):
+        """ Returns the earliest arrival time at dest leaving orig at or after time, None if unreachable. """
+        arrival = [NEVER] * len(self.stations)
+        arrival[orig] = time
+        boarded = bytearray(self.train_count)
+        dep, arr, frm, to, train = self.dep, self.arr, self.frm, self.to, self.train
+        transfer = self.transfer_time
+        for i in range(bisect_left(dep, time), len(dep)):
+            if dep[i] > arrival[dest]:
+                break
+            trn = train[i]
+            if not boarded[trn]:
+                at = arrival[frm[i]]
+                if at == NEVER or at + (transfer if frm[i] != orig else 0) > dep[i]:
+                    continue
+                boarded[trn] = 1
+            if arr[i] < arrival[to[i]]:
+                arrival[to[i]] = arr[i]
+        return arrival[dest] if arrival[dest] != NEVER else None
+
+    def _latest(self, orig, dest, time):
+        """ Returns the latest departure time from orig arriving at dest at or before time, None if impossible. """
+        departure = [-NEVER] * len(self.stations)
+        departure[dest] = time
+        alighted = bytearray(self.train_count)
+        dep, arr, frm, to, train, by_arr = self.dep, self.arr, self.frm, self.to, self.train, self.by_arr
+        transfer = self.transfer_time
+        for j in range(bisect_right(self.arr_sorted, time) - 1, -1, -1):
+            i = by_arr[j]
+            if arr[i] < departure[orig]:
+                break
+            trn = train[i]
+            if not alighted[trn]:
+                leave = departure[to[i]]
+                if leave == -NEVER or arr[i] + (transfer if to[i] != dest else 0) > leave:
+                    continue
+                alighted[trn] = 1
+            if dep[i] > departure[frm[i]]:
+                departure[frm[i]] = dep[i]
+        return departure[orig] if departure[orig] != -NEVER else None
+
+    def _ids(self, orig, dest):
+        stations = self.stations
+        orig, dest = orig.upper(), dest.upper()
+        if orig not in stations or dest not in stations or orig == dest:
+            return None
+        return stations[orig], stations[dest]
+
+    def _journey_after(self, orig, dest, time):
+        arr_time = self._earliest(orig, dest, time)
+        if arr_time is None:
+            return None
+        return Journey(self._latest(orig, dest, arr_time), arr_time)
+
+    def _journey_before(self, orig, dest, time):
+        dep_time = self._latest(orig, dest, time)
+        if dep_time is None:
+            return None
+        return Journey(dep_time, self._earliest(orig, dest, dep_time))
+
+    @staticmethod
+    def _time(time):
+        if time is None:
+            now = datetime.datetime.now()
+            return service_time(now.hour * 60 + now.minute)
+        return service_time(parse_time(time)) if isinstance(time, str) else time
+
+    def earliest_arrival(self, orig, dest, time=None):
+        """
+        Returns the Journey (dep_time, arr_time in service-day minutes) that leaves orig
+        at or after time and reaches dest first, leaving as late as possible. None if there's none.
+
+        :param time: h:mm am/pm string or service-day minutes, defaults to now
+        """
+        ids = self._ids(orig, dest)
+        return self._journey_after(ids[0], ids[1], self._time(time)) if ids else None
+
+    def latest_departure(self, orig, dest, time=None):
+        """
+        Returns the Journey that reaches dest by time and leaves orig last, arriving as
+        early as possible. None if there's none.
+
+        :param time: h:mm am/pm string or service-day minutes, defaults to now
+        """
+        ids = self._ids(orig, dest)
+        return self._journey_before(ids[0], ids[1], self._time(time)) if ids else None
+
+    def _before(self, ids, journey, n):
+        """ Returns up to n journeys arriving before journey, earliest first. """
+        journeys = []
+        while len(journeys) < n:
+            journey = self._journey_before(ids[0], ids[1], journey.arr_time - 1)
+            if journey is None:
+                break
+            journeys.append(journey)
+        return journeys[::-1]
+
+    def _after(self, ids, journey, n):
+        """ Returns up to n journeys leaving after journey, earliest first. """
+        journeys = []
+        while len(journeys) < n:
+            journey = self._journey_after(ids[0], ids[1], journey.dep_time + 1)
+            if journey is None:
+                break
+            journeys.append(journey)
+        return journeys
+
+    def _around(self, ids, first, b, a):
+        """ Returns b journeys ending with first, followed by the a journeys after first. """
+        if first is None:
+            return []
+        if b == 0:
+            return self._after(ids, first, a)
+        return self._before(ids, first, b - 1) + [first] + self._after(ids, first, a)
+
+    def _plan(self, orig, dest, journeys):
+        quote = self.fares(orig, dest) if self.fares is not None else None
+        fares = quote.fares if quote is not None else ()
+        standard = fares[0].amount if fares else ''
+        return TripPlan(orig.upper(), dest.upper(),
+                        [Trip(format_time(journey.dep_time), format_time(journey.arr_time), self.date, standard, fares)
+                         for journey in journeys])
+
+    def arrive_data(self, orig, dest, time=None, b=2, a=2):
+        """
+        Returns a TripPlan of up to b trips arriving at dest by time and a trips arriving
+        after it, like Bart.arrive_data. None for unknown stations.
+
+        :param orig: origination station (abbreviation)
+        :param dest: destination station (abbreviation)
+        :param time: arrival time h:mm am/pm, defaults to now
+        :param b: trips arriving by time (0-4)
+        :param a: trips arriving after time (0-4)
+        """
+        ids = self._ids(orig, dest)
+        if ids is None:
+            return None
+        first = self._journey_before(ids[0], ids[1], self._time(time))
+        if first is None:       # nothing arrives that early, everything is "after"
+            first = self._journey_after(ids[0], ids[1], 0)
+            journeys = self._around(ids, first, 1, a - 1) if a else []
+        else:
+            journeys = self._around(ids, first, b, a)
+        return self._plan(orig, dest, journeys)
+
+    def depart_data(self, orig, dest, time=None, b=2, a=2):
+        """
+        Returns a TripPlan of up to b trips leaving orig before time and a trips leaving
+        at or after it, like Bart.depart_data. None for unknown stations.
+
+        :param orig: origination station (abbreviation)
+        :param dest: destination station (abbreviation)
+        :param time: departure time h:mm am/pm, defaults to now
+        :param b: trips leaving before time (0-4)
+        :param a: trips leaving at or after time (0-4)
+        """
+        ids = self._ids(orig, dest)
+        if ids is None:
+            return None
+        first = self._journey_after(ids[0], ids[1], self._time(time))
+        if first is None:       # nothing leaves that late, everything is "before"
+            journeys = self._around(ids, self._journey_before(ids[0], ids[1], NEVER - 1), b, 0)
+        else:
+            journeys = self._before(ids, first, b) + self._around(ids, first, 1, a - 1) if a else \
+                self._before(ids, first, b)
+        return self._plan(orig, dest, journeys)
+
+    def arrive(self, orig, dest, time=None, b=2, a=2):
+        """ Same as arrive_data, rendered the way Bart.arrive() prints trips. '' for unknown stations. """
+        plan = self.arrive_data(orig, dest, time, b, a)
+        return render_trips(plan) if plan is not None else ''
+
+    def depart(self, orig, dest, time=None, b=2, a=2):
+        """ Same as depart_data, rendered the way Bart.depart() prints trips. '' for unknown stations. """
+        plan = self.depart_data(orig, dest, time, b, a)
+        return render_trips(plan) if plan is not None else ''
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Polling subscribers for real-time departure estimates.
+
+ETDSubscriber polls etd and only reports what changed since the last poll:
+departures that were added, removed, or whose minutes changed. It sends
+conditional requests (If-None-Match / If-Modified-Since) so servers that
+honour them can answer 304, and otherwise skips parsing when the body's
+hash is the same as last time.
+
+AdaptivePoller keeps one ETDSubscriber per station on a single heap of
+next-poll times, and polls each station only as often as its trains make
+worthwhile (see AdaptivePoller.delay).
+"""
+
+import datetime
+import hashlib
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+from bart_lib.planner import DAY, SERVICE_DAY_START, service_time
+from bart_lib.records import parse_etd, parse_time
+
+__author__ = "Luis Ulloa"
+
+# kind is 'added' (old is None), 'removed' (new is None) or 'changed'
+DepartureChange = namedtuple('DepartureChange', 'kind station old new')
+
+
+def departure_keys(report):
+    """
+    Returns a dict of departure identity -> Departure for an ETDReport. A departure is
+    identified by station, destination and platform, plus its position among those
+    (1st, 2nd... train), since the API doesn't give trains a stable id.
+    """
+    keyed = {}
+    for station in report.stations:
+        seen = {}
+        for dep in station.departures:
+            group = (station.abbr, dep.abbreviation or dep.destination, dep.platform)
+            seen[group] = seen.get(group, 0) + 1
+            keyed[group + (seen[group],)] = dep
+    return keyed
+
+
+def diff_departures(old, new):
+    """
+    Returns the list of DepartureChange between two departure_keys() dicts.
+
+    :param old: departures from the previous poll
+    :param new: departures from this poll
+    """
+    changes = []
+    for key, dep in new.items():
+        before = old.get(key)
+        if before is None:
+            changes.append(DepartureChange('added', key[0], None, dep))
+        elif before != dep:
+            changes.append(DepartureChange('changed', key[0], before, dep))
+    changes.extend(DepartureChange('removed', key[0], dep, None) for key, dep in old.items() if key not in new)
+    return changes
+
+
+class ETDSubscriber:
+    """
+    ----- ETD Subscriber -----
+    sub = ETDSubscriber(bart, 'ALL')
+    sub.subscribe(lambda changes: print(len(changes), "departures changed"))
+    sub.poll()                       # one tick, returns the changes it reported
+    sub.run(interval=5, stop=event)  # poll until event is set
+
+    :param bart: Bart instance whose transport is used
+    :param orig: station abbreviation, ALL for every station
+    :param plat: specific platform, ranges b/w 1-4
+    :param direction: direction, 'n' north; 's' south
+    """
+
+    def __init__(self, bart, orig='ALL', plat=None, direction=None):
+        if plat is not None and direction is not None:  # preference to plat, same as etd()
+            direction = None
+        self.bart = bart
+        self.orig = orig
+        self.plat = plat
+        self.direction = direction
+        self.callbacks = []
+        self.report = None          # last ETDReport
+        self.departures = {}        # last departure_keys()
+        self.etag = self.last_modified = self.digest = None
+        self.polls = self.not_modified = self.unchanged = self.changed = 0
+
+    def subscribe(self, callback):
+        """ Registers callback(changes), called with the list of DepartureChange after each poll with changes. """
+        self.callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """ Removes a callback registered with subscribe(). """
+        self.callbacks.remove(callback)
+
+    def _headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def poll(self):
+        """ Polls etd once, notifies callbacks if anything changed, and returns the changes. """
+        self.polls += 1
+        payload = {'cmd': 'etd', 'key': self.bart.key, 'orig': self.orig, 'plat': self.plat,
+                   'dir': self.direction, 'json': 'y'}
+        r = self.bart._get(self.bart.ETD_API_LINK, payload, headers=self._headers())
+        if r.status_code == 304:
+            self.not_modified += 1
+            return []
+        self.etag = r.headers.get('ETag')
+        self.last_modified = r.headers.get('Last-Modified')
+
+        digest = hashlib.sha1(r.content).digest()
+        if digest == self.digest:
+            self.unchanged += 1
+            return []
+
+        try:
+            root = self.bart.decoder(r.content)['root']
+        except (ValueError, KeyError, TypeError):
+            return []
+        if self.bart._is_error(root):
+            return []
+        self.digest = digest
+        report = parse_etd(root)
+        departures = departure_keys(report)
+        changes = diff_departures(self.departures, departures)
+        self.report, self.departures = report, departures
+        if not changes:
+            self.unchanged += 1     # only the timestamp moved
+            return changes
+
+        self.changed += 1
+        for callback in list(self.callbacks):
+            callback(changes)
+        return changes
+
+    def run(self, interval=5, stop=None):
+        """
+        Polls every interval seconds until stop (a threading.Event) is set.
+
+        :param interval: seconds between polls
+        :param stop: threading.Event, runs forever if None
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.poll()
+            stop.wait(interval)
+
+    def stats(self):
+        """ Returns a dict of polls, not_modified (304s), unchanged and changed poll counts. """
+        return {'polls': self.polls, 'not_modified': self.not_modified,
+                'unchanged': self.unchanged, 'changed': self.changed}
+
+
+def soonest_minutes(report):
+    """ Returns the minutes until the soonest departure in an ETDReport ('Leaving' is 0), None if it has none. """
+    soonest = None
+    for station in report.stations if report is not None else ():
+        for dep in station.departures:
+            try:
+                minutes = 0 if dep.minutes == 'Leaving' else int(dep.minutes)
+            except (TypeError, ValueError):
+                continue
+            if soonest is None or minutes < soonest:
+                soonest = minutes
+    return soonest
+
+
+def advisory_stations(root):
+    """
+    Returns the set of station abbreviations a bsa response reports delays for,
+    with 'BART' for system-wide advisories; empty if there are none.
+    """
+    stations = set()
+    for elem in (root or {}).get('bsa') or ():
+        description = elem.get('description') or {}
+        text = description.get('#cdata-section', '') if isinstance(description, dict) else description
+        if not elem.get('type') and text.lower().startswith('no delays'):
+            continue
+        stations.add((elem.get('station') or 'BART').upper())
+    return stations
+
+
+def service_clock(timestamp):
+    """ Returns (service date as mm/dd/yyyy, service-day minutes with fractions) of a local epoch timestamp. """
+    now = datetime.datetime.fromtimestamp(timestamp)
+    date = (now - datetime.timedelta(minutes=SERVICE_DAY_START)).strftime('%m/%d/%Y')
+    return date, service_time(now.hour * 60 + now.minute) + now.second / 60
+
+
+class AdaptivePoller:
+    """
+    ----- Adaptive ETD Poller -----
+    poller = AdaptivePoller(bart, ['EMBR', 'MONT', 'ASHB'], interval=5)
+    poller.subscribe(lambda changes: print(len(changes), "departures changed"))
+    poller.run(stop=event)     # or poller.step() from your own loop
+    poller.stats()             # {'polls': 812, 'fixed_polls': 4320, 'saved': 3459, ...}
+
+    Every station is an ETDSubscriber whose next poll time sits on one heap, see delay()
+    for how far apart polls are. Advisories (bsa) are checked every advisory_interval
+    while any station is in service, and stations they report delays for go back to
+    polling every interval seconds.
+
+    :param bart: Bart instance whose transport is used
+    :param stations: station abbreviations, defaults to every station from stns()
+    :param interval: seconds between polls of a busy station, the fixed interval savings are counted against
+    :param max_interval: most seconds between polls while a station has scheduled trains
+    :param horizon: minutes before a scheduled departure a quiet station is polled again
+    :param backoff: factor the gap grows by with each poll that changed nothing
+    :param advisory_interval: seconds between bsa checks, None to ignore advisories
+    :param clock: function returning the current time in seconds since the epoch
+    """
+
+    def __init__(self, bart, stations=None, interval=5, max_interval=120, horizon=10, backoff=1.5,
+                 advisory_interval=60, clock=time.time):
+        if stations is None:
+            stations = [stn.abbr for stn in bart.stns_data() or ()]
+        self.bart = bart
+        self.interval = interval
+        self.max_interval = max_interval
+        self.horizon = horizon
+        self.backoff = backoff
+        self.advisory_interval = advisory_interval
+        self.clock = clock
+        self.subscribers = {abbr.upper(): ETDSubscriber(bart, abbr.upper()) for abbr in stations}
+        self.advisories = set()
+        self._schedules = {}        # abbr -> (service date, sorted service-day minutes of departures or None)
+        self._quiet = {}            # abbr -> polls in a row that changed nothing
+        self._due = {}              # abbr -> time its live heap entry is due
+        self._heap = []
+        self.started = None
+        self.polls = self.advisory_polls = self.schedule_calls = self.errors = 0
+
+    def subscribe(self, callback):
+        """ Registers callback(changes), called with the list of DepartureChange of any station that changed. """
+        for sub in self.subscribers.values():
+            sub.subscribe(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """ Removes a callback registered with subscribe(). """
+        for sub in self.subscribers.values():
+            sub.unsubscribe(callback)
+
+    def _push(self, key, due):
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key or '', key))
+
+    def _departures(self, abbr, date):
+        """ Returns the sorted service-day minutes of abbr's departures on date, None if unknown. """
+        cached = self._schedules.get(abbr)
+        if cached is not None and cached[0] == date:
+            return cached[1]
+        self.schedule_calls += 1
+        try:
+            sched = self.bart.stnsched_data(abbr, date)
+        except Exception:
+            sched = None
+        times = None
+        if sched is not None and sched.items:
+            times = sorted(service_time(parse_time(item.orig_time)) for item in sched.items)
+        self._schedules[abbr] = (date, times)
+        return times
+
+    def delay(self, abbr, now):
+        """
+        Returns the seconds until abbr should be polled again, the longest of:
+
+        - the schedule: if no train is scheduled to leave within horizon minutes, the time
+          until horizon minutes before the next one (the next service day's first one
+          overnight, woken at the start of that service day to re-read its schedule),
+        - the live estimates: half the minutes until the soonest departure, at least interval
+          and at most max_interval, growing by backoff with every poll that changed nothing.
+          Stations with an advisory reported for them (or all of BART) keep to interval.
+        """
+        date, minute = service_clock(now)
+        times = self._departures(abbr, date)
+        wait = 0
+        if times is not None:
+            i = bisect_left(times, minute)
+            upcoming = times[i] if i < len(times) else times[0] + DAY
+            wait = max(0, (upcoming - self.horizon - minute) * 60)
+            wait = min(wait, (DAY + SERVICE_DAY_START - minute) * 60)
+        if self.advisories & {abbr, 'BART'}:
+            return max(wait, self.interval)
+        live = self.interval * self.backoff ** self._quiet.get(abbr, 0)
+        soonest = soonest_minutes(self.subscribers[abbr].report)
+        if soonest is not None:
+            live = max(live, soonest * 60 / 2)
+        return max(wait, min(max(live, self.interval), self.max_interval))
+
+    def _poll(self, abbr, now):
+        self.polls += 1
+        try:
+            changes = self.subscribers[abbr].poll()
+        except Exception:
+            self.errors += 1
+            self._quiet[abbr] = 0
+            return
+        self._quiet[abbr] = 0 if changes else self._quiet.get(abbr, 0) + 1
+
+    def _check_advisories(self, now):
+        self.advisory_polls += 1
+        try:
+            root = self.bart._query(self.bart.BSA_API_LINK, {'cmd': 'bsa', 'key': self.bart.key, 'json': 'y'})
+        except Exception:
+            self.errors += 1
+            return
+        advisories = advisory_stations(root)
+        new = advisories - self.advisories
+        self.advisories = advisories
+        for abbr in self.subscribers:
+            if new & {abbr, 'BART'} and self._due.get(abbr, now) > now + self.interval:
+                self._push(abbr, now + self.delay(abbr, now))    # tighten polls the advisory affects
+
+    def step(self, now=None):
+        """ Runs every poll due by now (defaults to clock()), returns the time the next one is due. """
+        now = self.clock() if now is None else now
+        if self.started is None:
+            self.started = now
+            for abbr in self.subscribers:
+                self._push(abbr, now)
+            if self.advisory_interval is not None:
+                self._push(None, now)
+        while self._heap and self._heap[0][0] <= now:
+            due, _, key = heapq.heappop(self._heap)
+            if self._due.get(key) != due:
+                continue    # rescheduled since
+            if key is None:
+                self._check_advisories(now)
+                stations = [t for k, t in self._due.items() if k is not None]
+                self._push(None, max(now + self.advisory_interval, min(stations, default=now)))
+            else:
+                self._poll(key, now)
+                self._push(key, now + self.delay(key, now))
+        return self._heap[0][0] if self._heap else now + self.interval
+
+    def run(self, stop=None):
+        """
+        Polls every station as it comes due until stop (a threading.Event) is set.
+
+        :param stop: threading.Event, runs forever if None
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            stop.wait(max(0, self.step() - self.clock()))
+
+    def stats(self, now=None):
+        """
+        Returns a dict of polls (etd), advisory_polls (bsa), schedule_calls (stnsched) and errors,
+        fixed_polls: the etd polls a fixed interval would have sent for every station since
+        the first step(), and saved: fixed_polls minus all of this poller's upstream calls.
+        """
+        now = self.clock() if now is None else now
+        elapsed = now - self.started if self.started is not None else 0
+        fixed = len(self.subscribers) * (int(elapsed // self.interval) + 1) if self.started is not None else 0
+        return {'polls': self.polls, 'advisory_polls': self.advisory_polls, 'schedule_calls': self.schedule_calls,
+                'errors': self.errors, 'fixed_polls': fixed,
+                'saved': fixed - self.polls - self.advisory_polls - self.schedule_calls}
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk prefetch of schedule data into a ScheduleSnapshot.
+
+Warming means one stnsched() per station and one routesched() per route.
+Prefetcher downloads them on a thread pool, which only waits on sockets,
+and hands each raw body to a process pool that decodes, checks and parses
+it outside the GIL. The checked roots go into the snapshot in one
+transaction, where every Bart (and process) using that snapshot file
+finds them.
+
+bart = Bart(snapshot='bart_schedules.db')
+stats = Prefetcher(bart, progress=print_progress).run()
+bart.stnsched('ASHB')   # answered from the snapshot
+
+or, from a shell: python -m bart_lib.prefetch bart_schedules.db
+"""
+
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+from bart_lib.bart import Bart
+from bart_lib.cache import make_key
+from bart_lib.decoding import get_decoder
+from bart_lib.records import parse_routesched, parse_stnsched
+from bart_lib.snapshot import ScheduleSnapshot
+
+__author__ = "Luis Ulloa"
+
+PARSERS = {'routesched': parse_routesched, 'stnsched': parse_stnsched}
+
+_decoders = {}      # each worker process loads a decoder on first use
+
+
+def warm_jobs(bart, date=None, stations=None, routes=None):
+    """
+    Returns the (link, payload) of every stnsched and routesched request, with the same
+    payloads stnsched_data()/routesched_data() send, so their cache keys match.
+
+    :param date: mm/dd/yyyy, None for today's schedule
+    :param stations: station abbreviations, defaults to every station from stns()
+    :param routes: route numbers, defaults to every route from routes()
+    """
+    if stations is None:
+        stations = [stn.abbr for stn in bart.stns_data() or ()]
+    if routes is None:
+        routes = [route.number for route in bart.routes_data(date=date) or ()]
+    jobs = [(bart.SCHED_API_LINK, {'cmd': 'stnsched', 'key': bart.key, 'orig': orig, 'date': date, 'json': 'y'})
+            for orig in stations]
+    jobs.extend((bart.SCHED_API_LINK, {'cmd': 'routesched', 'key': bart.key, 'route': route, 'time': None,
+                                       'date': date, 'sched': None, 'json': 'y'})
+                for route in routes)
+    return jobs
+
+
+def parse_body(cmd, content, keep_record=False, decoder=None):
+    """
+    Decodes, checks and parses one response body, runs in the worker processes.
+    Returns (sched_num, compact root JSON, record or None), or None if it's an API error.
+
+    :param decoder: decoder name or (picklable) function, see get_decoder
+    """
+    decode = _decoders.get(decoder)
+    if decode is None:
+        decode = _decoders[decoder] = get_decoder(decoder)
+    try:
+        root = decode(content)['root']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if Bart._is_error(root):
+        return None
+    record = PARSERS[cmd](root)     # also validates the document before it's stored
+    return root.get('sched_num'), json.dumps(root, separators=(',', ':')), record if keep_record else None
+
+
+def print_progress(done, total, cmd, arg, ok):
+    """ Progress callback that keeps a one-line counter on stderr. """
+    sys.stderr.write("\rprefetched %d/%d %-10s %-6s %s" % (done, total, cmd, arg, "ok" if ok else "failed"))
+    if done == total:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+
+class Prefetcher:
+    """
+    Downloads schedule data concurrently, parses it on a process pool and stores it
+    in bart's snapshot.
+
+    :param bart: Bart instance to fetch with; its rate limiter, metrics and decoder apply
+                 (a custom decoder function must be picklable to reach the parser processes)
+    :param snapshot: ScheduleSnapshot to fill, defaults to bart.snapshot
+    :param max_workers: max requests in flight
+    :param processes: parser processes, defaults to one per CPU but this one; 0 parses on this thread
+    :param progress: optional callable(done, total, cmd, arg, ok) called after every job
+    :param keep_records: also return the parsed records to self.records; pickling them back
+                         from the workers costs the main process about half of what parsing does
+    """
+
+    def __init__(self, bart, snapshot=None, max_workers=16, processes=None, progress=None, keep_records=False):
+        self.bart = bart
+        self.snapshot = snapshot if snapshot is not None else bart.snapshot
+        if self.snapshot is None:
+            raise ValueError("Prefetcher needs a ScheduleSnapshot to store results in")
+        self.max_workers = max_workers
+        self.processes = (os.cpu_count() or 1) - 1 if processes is None else processes
+        self.progress = progress
+        self.keep_records = keep_records
+        self.decoder = getattr(bart.decoder, 'name', bart.decoder)    # names pickle, decoders may not
+        self.records = {}
+
+    def _download(self, link, payload):
+        """ Returns the raw body for payload, None if the request failed or was shed. """
+        cmd = payload['cmd']
+        started = perf_counter()
+        try:
+            r = self.bart._get(link, payload)
+        except Exception:
+            return None     # transport error or RateLimitExceeded, the job just fails
+        metrics = self.bart.metrics
+        metrics.incr(cmd, 'requests')
+        metrics.incr(cmd, 'bytes', len(r.content))
+        metrics.timing(cmd, 'request', perf_counter() - started)
+        return r.content if r.status_code == 200 else None
+
+    def run(self, date=None, stations=None, routes=None):
+        """
+        Prefetches every station's stnsched and every route's routesched (see warm_jobs),
+        stores them and returns stats: {'jobs', 'stored', 'failed', 'bytes', 'seconds'}.
+        With keep_records, parsed records are kept in self.records, keyed by (cmd, station or route).
+        """
+        started = perf_counter()
+        sched_num = self.bart._snapshot_sched(self.snapshot)
+        jobs = warm_jobs(self.bart, date, stations, routes)
+        total, done, size, rows = len(jobs), 0, 0, []
+
+        def finish(link, payload, parsed):
+            nonlocal done
+            done += 1
+            cmd = payload['cmd']
+            arg = payload.get('orig', payload.get('route'))
+            num = (parsed[0] or sched_num) if parsed is not None else None
+            if num is None:
+                self.bart.metrics.incr(cmd, 'errors')
+            else:
+                rows.append((num, make_key(link, payload), parsed[1]))
+                if self.keep_records:
+                    self.records[(cmd, arg)] = parsed[2]
+            if self.progress is not None:
+                self.progress(done, total, cmd, arg, num is not None)
+
+        parser = ProcessPoolExecutor(self.processes) if self.processes else None
+        try:
+            parses = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as downloads:
+                fetches = {downloads.submit(self._download, link, payload): (link, payload) for link, payload in jobs}
+                for future in as_completed(fetches):
+                    link, payload = fetches[future]
+                    content = future.result()
+                    if content is None:
+                        finish(link, payload, None)
+                        continue
+                    size += len(content)
+                    if parser is None:
+                        finish(link, payload, parse_body(payload['cmd'], content, self.keep_records,
+                                                         self.decoder))
+                    else:     # parsing overlaps the remaining downloads
+                        future = parser.submit(parse_body, payload['cmd'], content, self.keep_records,
+                                               self.decoder)
+                        parses[future] = (link, payload)
+            for future in as_completed(parses):
+                link, payload = parses[future]
+                finish(link, payload, future.result())
+        finally:
+            if parser is not None:
+                parser.shutdown()
+
+        self.snapshot.put_many(rows, encoded=True)
+        return {'jobs': total, 'stored': len(rows), 'failed': total - len(rows), 'bytes': size,
+                'seconds': perf_counter() - started}
+
+
+if __name__ == "__main__":
+    # python -m bart_lib.prefetch SNAPSHOT [--processes N] [--workers N]
+    def option(name, default):
+        flag = '--' + name
+        return int(sys.argv[sys.argv.index(flag) + 1]) if flag in sys.argv else default
+
+    if len(sys.argv) < 2 or sys.argv[1].startswith('--'):
+        sys.exit("usage: python -m bart_lib.prefetch SNAPSHOT [--processes N] [--workers N]")
+    snapshot = ScheduleSnapshot(sys.argv[1])
+    bart = Bart(snapshot=snapshot)
+    try:
+        stats = Prefetcher(bart, max_workers=option('workers', 16), processes=option('processes', None),
+                           progress=print_progress).run()
+    finally:
+        bart.close()
+    print("stored %(stored)d of %(jobs)d responses (%(bytes)d bytes) in %(seconds).2fs" % stats)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side rate limiting for upstream BART API calls.
+
+A token bucket refills at a fixed rate. Every upstream request takes one
+token and waits for one when the bucket is empty. Requests have a priority
+class from their command: real-time estimates and advisories go first,
+interactive queries next, bulk schedule/fare prefetches last. Bulk work
+that would wait longer than its max_wait is shed with RateLimitExceeded.
+
+TokenBucket is shared by threads of one process. FileTokenBucket keeps its
+state in a locked file, so every process on a host can share one budget.
+"""
+
+import os
+import struct
+import threading
+import time
+
+__author__ = "Luis Ulloa"
+
+REALTIME, INTERACTIVE, BULK = 0, 1, 2
+
+COMMAND_PRIORITIES = {
+    'bsa': REALTIME, 'count': REALTIME, 'elev': REALTIME, 'etd': REALTIME,
+    'routesched': BULK, 'stnsched': BULK, 'fare': BULK,
+}
+
+# seconds each priority may wait for a token before it's shed, None waits as long as it takes
+DEFAULT_MAX_WAIT = {REALTIME: None, INTERACTIVE: 30.0, BULK: 5.0}
+
+
+class RateLimitExceeded(Exception):
+    """ Raised when a request is shed because it couldn't get a token in time. """
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. A waiting request only gets a token once no
+    request of a more urgent priority is waiting.
+
+    :param rate: tokens added per second
+    :param burst: bucket size, the most requests that can go out back to back
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waiting = [0, 0, 0]
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """
+        Takes a token, waiting up to timeout seconds (forever if None). Returns False if it timed out.
+
+        :param priority: REALTIME, INTERACTIVE or BULK
+        :param timeout: max seconds to wait
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.tokens >= 1 and not any(self.waiting[:priority]):
+                        self.tokens -= 1
+                        return True
+                    wait = max((1 - self.tokens) / self.rate, 0.001)
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                self.waiting[priority] -= 1
+                self._cond.notify_all()
+
+
+class FileTokenBucket:
+    """
+    Token bucket whose state lives in a small file locked with flock, shared by every
+    process on the host that uses the same path. Processes don't see each other's
+    queues, so priorities work by reserve instead: INTERACTIVE requests leave
+    reserve tokens in the bucket and BULK requests leave twice that, which keeps
+    headroom for REALTIME requests.
+
+    :param path: state file, created if needed
+    :param rate: tokens added per second
+    :param burst: bucket size
+    :param reserve: tokens per priority step kept for more urgent requests, defaults to burst / 4
+    """
+    STATE = struct.Struct('dd')     # tokens, updated (time.time())
+
+    def __init__(self, path, rate, burst=None, reserve=None):
+        import fcntl    # POSIX only
+        self._flock = fcntl.flock
+        self._locks = (fcntl.LOCK_EX, fcntl.LOCK_UN)
+        self.path = path
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.reserve = self.burst / 4 if reserve is None else reserve
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _take(self, priority):
+        """ Takes a token if one is available to priority, returns seconds to wait otherwise (0 if taken). """
+        self._flock(self._fd, self._locks[0])
+        try:
+            data = os.pread(self._fd, self.STATE.size, 0)
+            now = time.time()
+            if len(data) == self.STATE.size:
+                tokens, updated = self.STATE.unpack(data)
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            else:
+                tokens = self.burst
+            needed = 1 + self.reserve * priority
+            taken = tokens >= needed
+            if taken:
+                tokens -= 1
+            os.pwrite(self._fd, self.STATE.pack(tokens, now), 0)
+            return 0 if taken else (needed - tokens) / self.rate
+        finally:
+            self._flock(self._fd, self._locks[1])
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """ Takes a token, waiting up to timeout seconds (forever if None). Returns False if it timed out. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(priority)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(max(wait, 0.001))
+
+    def close(self):
+        os.close(self._fd)
+
+
+class RateLimiter:
+    """
+    Maps commands to priorities and sheds requests that wait too long.
+
+    limiter = RateLimiter(TokenBucket(rate=5, burst=10))
+    bart = Bart(rate_limiter=limiter)          # share limiter between Bart instances/threads
+    limiter = RateLimiter(FileTokenBucket('/tmp/bart.bucket', rate=5))  # ...or processes
+
+    :param bucket: TokenBucket or FileTokenBucket
+    :param priorities: overrides for COMMAND_PRIORITIES, commands not listed are INTERACTIVE
+    :param max_wait: overrides for DEFAULT_MAX_WAIT
+    """
+
+    def __init__(self, bucket, priorities=None, max_wait=None):
+        self.bucket = bucket
+        self.priorities = dict(COMMAND_PRIORITIES)
+        self.priorities.update(priorities or {})
+        self.max_wait = dict(DEFAULT_MAX_WAIT)
+        self.max_wait.update(max_wait or {})
+        self.granted = self.shed = 0
+
+    def acquire(self, cmd):
+        """ Waits for cmd's turn, raises RateLimitExceeded if it's shed. """
+        priority = self.priorities.get(cmd, INTERACTIVE)
+        if not self.bucket.acquire(priority, self.max_wait[priority]):
+            self.shed += 1
+            raise RateLimitExceeded("%s request shed after waiting %ss for the rate limit"
+                                    % (cmd, self.max_wait[priority]))
+        self.granted += 1
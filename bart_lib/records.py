@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Structured records for BART API responses.
+
+The parse_* functions turn the 'root' object of a JSON response into
+compact namedtuples, which is what Bart's *_data methods return. Bart's
+string methods render their output from these same records, except for the
+large etd, routesched and stnsched responses: the render_*_root functions
+write those straight from the root, without building records first.
+"""
+
+from collections import namedtuple
+from itertools import groupby
+from operator import attrgetter
+
+__author__ = "Luis Ulloa"
+
+
+# stns, stnaccess
+Station = namedtuple('Station', 'abbr name address city state zipcode latitude longitude')
+StationAccess = namedtuple('StationAccess', 'abbr name parking bike bike_station lockers')
+
+# etd
+Departure = namedtuple('Departure', 'destination abbreviation minutes platform direction color length delay')
+StationETD = namedtuple('StationETD', 'abbr name departures')
+ETDReport = namedtuple('ETDReport', 'date time stations warning')
+
+# arrive, depart, fare
+Fare = namedtuple('Fare', 'name amount fare_class')
+Trip = namedtuple('Trip', 'orig_time dest_time date fare fares')
+TripPlan = namedtuple('TripPlan', 'origin destination trips')
+FareQuote = namedtuple('FareQuote', 'origin destination fares')
+
+# routes
+Route = namedtuple('Route', 'number route_id abbr name')
+
+# routesched
+TrainStop = namedtuple('TrainStop', 'station orig_time')
+Train = namedtuple('Train', 'train_id stops')
+RouteSchedule = namedtuple('RouteSchedule', 'sched_num date trains')
+
+# scheds
+Schedule = namedtuple('Schedule', 'sched_id effective_date')
+
+# stnsched
+SchedItem = namedtuple('SchedItem', 'train_id line head_station orig_time dest_time')
+StationSchedule = namedtuple('StationSchedule', 'abbr name sched_num date items')
+
+
+def parse_time(value):
+    """
+    Returns the minutes after midnight of a BART time like '5:40 PM', '05:40pm' or '17:40'.
+
+    :param value: time string, seconds and a trailing time zone ('05:40:01 PM PDT') are ignored
+    """
+    value = value.strip().upper()
+    meridiem = None
+    for suffix in ('AM', 'PM'):
+        if suffix in value:
+            meridiem = suffix
+            value = value[:value.index(suffix)].strip()
+    hours, minutes = value.split(':')[:2]
+    hours, minutes = int(hours), int(minutes)
+    if meridiem is not None:
+        hours = hours % 12 + (12 if meridiem == 'PM' else 0)
+    return hours * 60 + minutes
+
+
+def format_time(minutes):
+    """ Returns minutes after midnight formatted the way BART prints times, e.g. '5:40 PM'. """
+    hours, minutes = divmod(minutes % (24 * 60), 60)
+    return "%d:%02d %s" % (hours % 12 or 12, minutes, 'AM' if hours < 12 else 'PM')
+
+
+def parse_stns(root):
+    """ Returns a list of Station records from a stns response. """
+    return [Station(stn['abbr'], stn['name'], stn['address'], stn['city'], stn['state'], stn['zipcode'],
+                    float(stn['gtfs_latitude']) if stn.get('gtfs_latitude') else None,
+                    float(stn['gtfs_longitude']) if stn.get('gtfs_longitude') else None)
+            for stn in root['stations']['station']]
+
+
+def parse_stnaccess(root):
+    """ Returns a StationAccess, with boolean flags, from a stnaccess response. """
+    stn = root['stations']['station']
+    return StationAccess(stn.get('abbr'), stn['name'], stn['@parking_flag'] == '1', stn['@bike_flag'] == '1',
+                         stn['@bike_station_flag'] == '1', stn['@locker_flag'] == '1')
+
+
+def parse_departure(estimate, loc):
+    """ Returns a Departure for one estimate of an etd destination (loc). """
+    return Departure(loc['destination'], loc.get('abbreviation'), estimate['minutes'],
+                     estimate['platform'], estimate.get('direction'), estimate['color'],
+                     estimate.get('length'), estimate.get('delay'))
+
+
+def parse_station_etd(station):
+    """ Returns a StationETD for one element of an etd response's station list. """
+    departures = tuple(parse_departure(estimate, loc)
+                       for loc in station.get('etd') for estimate in loc.get('estimate'))
+    return StationETD(station.get('abbr'), station['name'], departures)
+
+
+def parse_etd(root):
+    """ Returns an ETDReport from an etd response. """
+    warning = None
+    if not root.get('station') and root.get('message') != "":
+        warning = root['message']['warning']
+    stations = [parse_station_etd(station) for station in root.get('station') or ()]
+    return ETDReport(root['date'], root['time'], stations, warning)
+
+
+def parse_fares(fares):
+    """ Returns a tuple of Fare records from a 'fares' object. """
+    return tuple(Fare(fare['@name'], fare['@amount'], fare['@class']) for fare in fares['fare'])
+
+
+def parse_trips(root):
+    """ Returns a TripPlan from an arrive/depart response. """
+    trips = root['schedule']['request']['trip']
+    return TripPlan(root['origin'], root['destination'],
+                    [Trip(trip['@origTimeMin'], trip['@destTimeMin'], trip['@origTimeDate'],
+                          trip['@fare'], parse_fares(trip['fares']))
+                     for trip in trips[::2]])     # each trip has a leg following it
+
+
+def parse_fare(root):
+    """ Returns a FareQuote from a fare response. """
+    return FareQuote(root['origin'], root['destination'], parse_fares(root['fares']))
+
+
+def parse_routes(root):
+    """ Returns a list of Route records from a routes response. """
+    return [Route(route['number'], route['routeID'], route['abbr'], route['name'])
+            for route in root['routes']['route']]
+
+
+def parse_train(path):
+    """ Returns a Train for one element of a routesched response's train list, skipping stops it doesn't make. """
+    return Train(path['@trainId'], tuple(TrainStop(loc['@station'], loc['@origTime'])
+                                         for loc in path['stop'] if loc.get('@origTime')))
+
+
+def parse_routesched(root):
+    """ Returns a RouteSchedule from a routesched response. """
+    return RouteSchedule(root['sched_num'], root['date'], [parse_train(path) for path in root['route']['train']])
+
+
+def parse_scheds(root):
+    """ Returns a list of Schedule records from a scheds response. """
+    return [Schedule(sched['@id'], sched['@effectivedate']) for sched in root['schedules']['schedule']]
+
+
+def parse_sched_item(item):
+    """ Returns a SchedItem for one element of a stnsched response's item list. """
+    return SchedItem(item['@trainId'], item['@line'], item['@trainHeadStation'], item['@origTime'], item['@destTime'])
+
+
+def parse_stnsched(root):
+    """ Returns a StationSchedule from a stnsched response. """
+    station = root['station']
+    return StationSchedule(station.get('abbr'), station['name'], root['sched_num'], root['date'],
+                           [parse_sched_item(item) for item in station['item']])
+
+
+def render_stns(stations):
+    """ Renders Station records the way Bart.stns() prints them. """
+    return ''.join(["%s (\"%s\") is at %s, %s, %s %s.\n" % (stn.name, stn.abbr, stn.address, stn.city,
+                                                            stn.state, stn.zipcode)
+                    for stn in stations])
+
+
+def render_etd(report, orig):
+    """ Renders an ETDReport the way Bart.etd() prints it. """
+    lines = ["Estimated departure time(s) for %s on %s %s...\n" % (orig, report.date, report.time)]
+    if report.warning is not None:
+        lines.append(report.warning + '\n')
+        return ''.join(lines)      # nothing matching
+
+    for station in report.stations:
+        lines.append("Departures for %s...\n" % station.name)
+        for dest, departures in groupby(station.departures, key=attrgetter('destination')):
+            lines.append("For those leaving to %s:\n" % dest)
+            lines.extend(["%s bart on platform %s leaving in %s minutes!\n" % (dep.color, dep.platform, dep.minutes)
+                          for dep in departures])
+        lines.append('\n')  # spacing b/w each station
+    return ''.join(lines)
+
+
+def render_etd_root(root, orig):
+    """
+    Renders an etd response's root like render_etd(), without building records. Appending
+    to one string (which CPython grows in place) keeps it as fast and small as it ever was.
+    """
+    res = "Estimated departure time(s) for %s on %s %s...\n" % (orig, root['date'], root['time'])
+    if not root.get('station') and root.get('message') != "":
+        return res + root['message']['warning'] + '\n'     # nothing matching
+
+    for station in root['station']:
+        res += "Departures for %s...\n" % station['name']
+        for loc in station.get('etd'):
+            res += "For those leaving to %s:\n" % loc['destination']
+            for estimate in loc.get('estimate'):
+                res += "%s bart on platform %s leaving in %s minutes!\n" % (estimate['color'], estimate['platform'],
+                                                                             estimate['minutes'])
+        res += '\n'  # spacing b/w each station
+    return res
+
+
+def render_trips(plan):
+    """ Renders a TripPlan the way Bart.arrive()/depart() print it. """
+    lines = ["Trips from %s to %s...\n" % (plan.origin, plan.destination)]
+    for trip in plan.trips:
+        lines.append("Trip from %s to %s on %s with the following fares...\n"
+                     % (trip.orig_time, trip.dest_time, trip.date))
+        lines.append("Standard: " + trip.fare + '\n')
+        lines.extend(["%s: %s (%s)\n" % (fare.name, fare.amount, fare.fare_class) for fare in trip.fares])
+        lines.append('\n')  # spacing
+    return ''.join(lines)
+
+
+def render_fare(quote):
+    """ Renders a FareQuote the way Bart.fare() prints it. """
+    lines = ["A trip from %s to %s has the following fares...\n" % (quote.origin, quote.destination)]
+    lines.extend(["%s for %s (%s)\n" % (fare.amount, fare.name, fare.fare_class) for fare in quote.fares])
+    return ''.join(lines)
+
+
+def render_routesched(sched):
+    """ Renders a RouteSchedule the way Bart.routesched() prints it. """
+    lines = ["For schedule number %s on %s...\n" % (sched.sched_num, sched.date)]
+    lines.extend(["Train with ID %s has the following stops: %s\n"
+                  % (train.train_id, ', '.join([stop.station + "(" + stop.orig_time + ")" for stop in train.stops]))
+                  for train in sched.trains])
+    return ''.join(lines)
+
+
+def render_routesched_root(root):
+    """ Renders a routesched response's root like render_routesched(), without building records. """
+    res = "For schedule number %s on %s...\n" % (root['sched_num'], root['date'])
+    for path in root['route']['train']:
+        stops = ', '.join([loc['@station'] + "(" + loc['@origTime'] + ")"
+                           for loc in path['stop'] if loc.get('@origTime')])
+        res += "Train with ID %s has the following stops: %s\n" % (path['@trainId'], stops)
+    return res
+
+
+def render_stnsched(sched):
+    """ Renders a StationSchedule the way Bart.stnsched() prints it. """
+    lines = ["%s schedule (%s) details on %s...\n" % (sched.name, sched.sched_num, sched.date)]
+    lines.extend(["Train %s with %s, (Head Station %s): from %s to %s.\n"
+                  % (item.train_id, item.line, item.head_station, item.orig_time, item.dest_time)
+                  for item in sched.items])
+    return ''.join(lines)
+
+
+def render_stnsched_root(root):
+    """ Renders a stnsched response's root like render_stnsched(), without building records. """
+    station = root['station']
+    res = "%s schedule (%s) details on %s...\n" % (station['name'], root['sched_num'], root['date'])
+    for item in station['item']:
+        res += "Train %s with %s, (Head Station %s): from %s to %s.\n" % \
+               (item['@trainId'], item['@line'], item['@trainHeadStation'], item['@origTime'], item['@destTime'])
+    return res
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Record/replay transports for offline testing and benchmarking.
+
+RecordingTransport wraps a real transport and saves every response body to
+a fixture file. ReplayTransport serves those files back, so the whole Bart
+API can run with no network at all:
+
+bart = Bart(transport=RecordingTransport(RequestsTransport(), 'fixtures'))
+bart.etd('ALL')                                   # real request, saved
+bart = Bart(transport=ReplayTransport('fixtures'))
+bart.etd('ALL')                                   # same answer, from disk
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+
+from bart_lib.cache import make_key
+
+__author__ = "Luis Ulloa"
+
+UNSAFE = re.compile(r'[^A-Za-z0-9._=-]+')
+
+# longest fixture file name before the parameters are replaced by their hash
+MAX_NAME = 120
+
+
+def fixture_name(url, params=None):
+    """
+    Returns the relative fixture path for a request, e.g. 'sched/stnsched-orig=ASHB.json'.
+    The API key and unset parameters don't change the name.
+
+    :param url: API link
+    :param params: query string payload
+    """
+    link, cmd, items = make_key(url, params or {})
+    api = os.path.splitext(link.rstrip('/').rsplit('/', 1)[-1])[0]
+    name = '-'.join([cmd or 'index'] + ['%s=%s' % item for item in items if item[0] != 'json'])
+    name = UNSAFE.sub('_', name)
+    if len(name) > MAX_NAME:
+        name = '%s-%s' % (cmd, hashlib.sha1(name.encode('utf-8')).hexdigest()[:16])
+    return os.path.join(api, name + '.json')
+
+
+class ReplayResponse:
+    """ Minimal requests.Response stand-in served by ReplayTransport. """
+
+    def __init__(self, content, status_code=200, headers=None, url=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = url
+        self.elapsed = datetime.timedelta(0)
+        self.encoding = 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+    def json(self):
+        return json.loads(self.content.decode(self.encoding))
+
+
+class RecordingTransport:
+    """
+    Transport that forwards requests to another transport and saves every body.
+
+    :param transport: transport that makes the real requests
+    :param directory: fixture directory, created if needed
+    """
+
+    def __init__(self, transport, directory):
+        self.transport = transport
+        self.directory = directory
+        self.recorded = []
+
+    def _save(self, url, params, content):
+        path = os.path.join(self.directory, fixture_name(url, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.recorded.append(path)
+
+    def get(self, url, params=None, **kwargs):
+        r = self.transport.get(url, params=params, **kwargs)
+        if r.status_code == 200:
+            self._save(url, params, r.content)
+        return r
+
+    def stream(self, url, params=None, **kwargs):
+        chunks = []
+        for chunk in self.transport.stream(url, params=params, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self._save(url, params, b''.join(chunks))
+
+    def close(self):
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+
+
+class ReplayTransport:
+    """
+    Transport that answers from fixture files recorded by RecordingTransport.
+    Files are read once and kept in memory.
+
+    :param directory: fixture directory
+    :param strict: raise FileNotFoundError for requests without a fixture, otherwise
+                   answer them with a BART-style error (Bart methods then return '')
+    """
+    MISSING = b'{"root": {"message": {"error": {"text": "No fixture recorded for this request."}}}}'
+
+    def __init__(self, directory, strict=True):
+        self.directory = directory
+        self.strict = strict
+        self.requests = 0
+        self._bodies = {}
+
+    def _load(self, url, params):
+        name = fixture_name(url, params)
+        body = self._bodies.get(name)
+        if body is None:
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    body = self._bodies[name] = f.read()
+            except FileNotFoundError:
+                if self.strict:
+                    raise FileNotFoundError("no fixture %s for %s %r" % (name, url, params))
+                return None
+        return body
+
+    def get(self, url, params=None, **kwargs):
+        self.requests += 1
+        body = self._load(url, params)
+        if body is None:
+            return ReplayResponse(self.MISSING, 404, url=url)
+        return ReplayResponse(body, url=url)
+
+    def stream(self, url, params=None, chunk_size=8192, on_response=None, **kwargs):
+        self.requests += 1
+        body = self._load(url, params)
+        if on_response is not None:
+            on_response(200 if body is not None else 404, {})
+        body = body or self.MISSING
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Resilience policy for upstream BART API calls.
+
+With Bart(resilience=Resilience()) every upstream request:
+
+- gets a per-command (connect, read) timeout, short for real-time data,
+  long for whole-day schedules,
+- goes through a circuit breaker, which fails fast with CircuitOpen once
+  the API has failed failures times in a row and lets one trial request
+  through every reset_after seconds until it recovers,
+- falls back to the last good response: expired cache entries are kept
+  for stale_if_error seconds and served when upstream fails, and within
+  stale_while_revalidate seconds of expiring they're served right away
+  while a background thread refreshes them.
+
+API errors (e.g. an invalid station) are answers, not failures: they
+don't trip the breaker and aren't replaced by stale data.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bart_lib.cache import DAY, MINUTE
+
+__author__ = "Luis Ulloa"
+
+# (connect, read) seconds per command, commands not listed use DEFAULT_TIMEOUT
+DEFAULT_TIMEOUTS = {
+    'bsa': (2, 3), 'count': (2, 3), 'elev': (2, 3), 'etd': (2, 3),
+    'routesched': (3.05, 15), 'stnsched': (3.05, 15), 'scheds': (3.05, 10),
+}
+DEFAULT_TIMEOUT = (3.05, 6)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitOpen(Exception):
+    """ Raised instead of sending a request while the circuit breaker is open. """
+
+
+class UpstreamError(Exception):
+    """ Raised for a 5xx response from the API. """
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    :param failures: consecutive failures that open the circuit
+    :param reset_after: seconds the circuit stays open before a trial request is let through
+    """
+
+    def __init__(self, failures=5, reset_after=30):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = None
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ Returns True if a request may be sent now; in half-open state only one is. """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = HALF_OPEN      # this caller is the trial request
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state, self.consecutive = CLOSED, 0
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.state == HALF_OPEN or self.consecutive >= self.failures:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+
+class Resilience:
+    """
+    Timeouts, circuit breaking and stale fallbacks for one or more Bart instances.
+
+    bart = Bart(resilience=Resilience(timeouts={'etd': (1, 2)}, stale_if_error=HOUR))
+
+    :param timeouts: overrides for DEFAULT_TIMEOUTS
+    :param breaker: CircuitBreaker to use, None for none (defaults to CircuitBreaker())
+    :param stale_while_revalidate: seconds after expiring that a cached response is still served
+                                   while it's refreshed in the background, 0 to always wait
+    :param stale_if_error: seconds after expiring that a cached response is served if upstream fails
+    :param refresh_workers: threads refreshing stale responses in the background
+    """
+
+    def __init__(self, timeouts=None, breaker=True, stale_while_revalidate=MINUTE, stale_if_error=DAY,
+                 refresh_workers=2):
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.breaker = CircuitBreaker() if breaker is True else breaker
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='bart-refresh')
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def timeout(self, cmd):
+        """ Returns the (connect, read) timeout for cmd. """
+        return self.timeouts.get(cmd, DEFAULT_TIMEOUT)
+
+    def send(self, transport, link, payload, headers=None):
+        """
+        Sends payload over transport with cmd's timeout, through the circuit breaker.
+        Raises CircuitOpen while the circuit is open, UpstreamError for a 5xx response
+        and the transport's exception if the request failed.
+        """
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpen("BART API circuit is open after %d failures" % breaker.consecutive)
+        try:
+            r = transport.get(link, params=payload, timeout=self.timeout(payload['cmd']), headers=headers)
+        except Exception:
+            if breaker is not None:
+                breaker.failure()
+            raise
+        if r.status_code >= 500:
+            if breaker is not None:
+                breaker.failure()
+            raise UpstreamError("BART API answered HTTP %d" % r.status_code)
+        if breaker is not None:
+            breaker.success()
+        return r
+
+    def stream(self, transport, link, payload, on_response=None):
+        """
+        Yields the body chunks of payload's response from transport's stream(), with cmd's
+        timeout and through the circuit breaker. Raises like send(): CircuitOpen, UpstreamError
+        for a 5xx response, or the transport's exception. Headers with a non-5xx status count
+        as a success, so a caller that stops reading early doesn't keep the breaker half-open.
+
+        :param on_response: optional callable(status_code, headers) passed on to the transport
+        """
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpen("BART API circuit is open after %d failures" % breaker.consecutive)
+
+        def started(status_code, headers):
+            if status_code >= 500:
+                raise UpstreamError("BART API answered HTTP %d" % status_code)
+            if breaker is not None:
+                breaker.success()
+            if on_response is not None:
+                on_response(status_code, headers)
+        try:
+            yield from transport.stream(link, params=payload, timeout=self.timeout(payload['cmd']),
+                                        on_response=started)
+        except Exception:
+            if breaker is not None:
+                breaker.failure()
+            raise
+
+    def refresh(self, key, fn):
+        """ Runs fn() on a background thread unless a refresh of key is already running. """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                fn()
+            except Exception:
+                pass    # the stale response stays until a refresh succeeds or it's too old
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        self._executor.submit(run)
+
+    def close(self):
+        """ Waits for running refreshes and stops the refresh threads. """
+        self._executor.shutdown()
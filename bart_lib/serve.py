@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Local sidecar that serves every Bart method to other processes.
+
+One sidecar per host holds a single Bart, so its response cache, keep-alive
+connection pool, coalescer, snapshot and rate limiter are shared by every
+worker that talks to it through bart_lib.client.BartClient:
+
+    python -m bart_lib.serve --unix /tmp/bart.sock
+    python -m bart_lib.serve --port 8377 --snapshot bart_schedules.db
+
+Endpoints: POST /call/<method> with {"args": [...], "kwargs": {...}},
+GET /stats (cache, coalescer and key pool stats) and GET /metrics (Prometheus text).
+"""
+
+import argparse
+import json
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bart_lib.bart import Bart
+from bart_lib.client import DEFAULT_ADDRESS, from_wire, to_wire
+from bart_lib.metrics import MemoryMetrics
+
+__author__ = "Luis Ulloa"
+
+# every method a client may call
+METHODS = frozenset(name for name, attr in vars(Bart).items()
+                    if callable(attr) and not name.startswith('_') and name != 'close')
+
+
+class BartHandler(BaseHTTPRequestHandler):
+    """ Request handler, the server's bart attribute answers the calls. """
+    protocol_version = 'HTTP/1.1'     # keep-alive, clients hold one connection per thread
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, obj):
+        self._send(status, json.dumps(obj).encode('utf-8'))
+
+    def do_GET(self):
+        bart = self.server.bart
+        if self.path == '/stats':
+            self._send_json(200, {'cache': bart.cache.stats() if bart.cache is not None else None,
+                                  'coalescer': bart.coalescer.stats() if bart.coalescer is not None else None,
+                                  'keys': bart.keys.stats() if bart.keys is not None else None})
+        elif self.path == '/metrics' and hasattr(bart.metrics, 'prometheus'):
+            self._send(200, bart.metrics.prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send_json(404, {'error': "no such endpoint %s" % self.path})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        name = self.path[len('/call/'):] if self.path.startswith('/call/') else None
+        if name not in METHODS:
+            self._send_json(404, {'error': "no such method %s" % self.path})
+            return
+        try:
+            call = from_wire(body.decode('utf-8'))
+            res = getattr(self.server.bart, name)(*call.get('args', ()), **call.get('kwargs', {}))
+            if name.endswith('_stream'):
+                res = list(res)
+        except Exception as e:
+            self._send_json(500, {'error': "%s: %s" % (type(e).__name__, e)})
+            return
+        self._send_json(200, {'result': to_wire(res)})
+
+
+class BartServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server over TCP, one thread per client connection.
+
+    :param address: (host, port)
+    :param bart: Bart instance shared by every request
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, bart):
+        self.bart = bart
+        super().__init__(address, BartHandler)
+
+
+class UnixBartServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Same as BartServer, over a Unix domain socket. A stale socket file at path is replaced.
+
+    :param path: socket path
+    :param bart: Bart instance shared by every request
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, path, bart):
+        self.bart = bart
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, BartHandler)
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)     # BaseHTTPRequestHandler expects a (host, port) client address
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bart_lib.serve',
+                                     description="Serves every Bart method to local clients (BartClient).")
+    parser.add_argument('--host', default=DEFAULT_ADDRESS.split(':')[0])
+    parser.add_argument('--port', type=int, default=int(DEFAULT_ADDRESS.split(':')[1]))
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--key', action='append', help="BART API key, defaults to the universal key; "
+                                                       "repeat it to spread requests over several keys")
+    parser.add_argument('--snapshot', metavar='PATH', help="schedule snapshot file, see ScheduleSnapshot")
+    args = parser.parse_args(argv)
+
+    keys = {'key': args.key if len(args.key) > 1 else args.key[0]} if args.key else {}
+    bart = Bart(snapshot=args.snapshot, metrics=MemoryMetrics(), **keys)
+    if args.unix:
+        server = UnixBartServer(args.unix, bart)
+    else:
+        server = BartServer((args.host, args.port), bart)
+    print("serving Bart on %s" % (args.unix or "%s:%d" % server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        bart.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk snapshot of BART schedule data.
+
+Station, route and schedule responses only change when BART publishes a new
+schedule, so ScheduleSnapshot keeps them in a SQLite file keyed by schedule
+number. A Bart created with snapshot=path answers those queries from disk
+on startup, and picks up a new schedule once scheds() says it's effective.
+"""
+
+import datetime
+import json
+import threading
+import time
+
+from bart_lib.records import Schedule
+
+__author__ = "Luis Ulloa"
+
+# commands whose responses are fixed for a whole schedule number
+SNAPSHOT_COMMANDS = ('routes', 'routesched', 'stns', 'stnsched')
+
+# commands whose default (no date) response depends on today's day type
+DATED_COMMANDS = ('routesched', 'stnsched')
+
+DATE_FORMAT = '%m/%d/%Y'
+
+
+def parse_effective_date(effective_date):
+    """ Returns the datetime.date of a scheds() effective date like '01/01/2026 12:00 AM'. """
+    return datetime.datetime.strptime(effective_date.split()[0], DATE_FORMAT).date()
+
+
+def current_sched_num(schedules, today=None):
+    """
+    Returns the id of the schedule in effect on today, None if there isn't one.
+
+    :param schedules: iterable of Schedule records, see Bart.scheds_data()
+    :param today: datetime.date, defaults to today
+    """
+    today = today or datetime.date.today()
+    effective = [(parse_effective_date(sched.effective_date), sched.sched_id) for sched in schedules]
+    effective = [entry for entry in effective if entry[0] <= today]
+    return max(effective)[1] if effective else None
+
+
+class ScheduleSnapshot:
+    """
+    SQLite-backed store of parsed schedule responses, keyed by schedule number.
+
+    snapshot = ScheduleSnapshot('bart_schedules.db')
+    bart = Bart(snapshot=snapshot)   # or Bart(snapshot='bart_schedules.db')
+
+    :param path: SQLite file path, ':memory:' for a throwaway store
+    :param max_age: seconds before the stored schedule list is re-checked with scheds()
+    """
+    MMAP_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, path, max_age=24 * 60 * 60):
+        import sqlite3      # only paid for by programs that use a snapshot
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA mmap_size = %d' % self.MMAP_SIZE)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS schedules (
+                sched_id TEXT PRIMARY KEY,
+                effective_date TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS responses (
+                sched_num TEXT NOT NULL,
+                link TEXT NOT NULL,
+                cmd TEXT NOT NULL,
+                params TEXT NOT NULL,
+                root TEXT NOT NULL,
+                PRIMARY KEY (sched_num, link, cmd, params)
+            );
+        """)
+        self._sched_num = self._sched_day = None
+        self._fetched_at = self._db.execute('SELECT MIN(fetched_at) FROM schedules').fetchone()[0]
+
+    def update_schedules(self, schedules):
+        """ Replaces the stored schedule list with schedules (Schedule records). """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM schedules')
+            self._db.executemany('INSERT INTO schedules VALUES (?, ?, ?)',
+                                 [(sched.sched_id, sched.effective_date, now) for sched in schedules])
+            self._sched_num = self._sched_day = None
+            self._fetched_at = now
+
+    def schedules_stale(self):
+        """ Returns True if the schedule list is missing or older than max_age. """
+        return self._fetched_at is None or time.time() - self._fetched_at > self.max_age
+
+    def current_sched(self, today=None):
+        """ Returns the stored schedule number in effect today, None if unknown. """
+        today = today or datetime.date.today()
+        if self._sched_day != today:
+            with self._lock:
+                rows = self._db.execute('SELECT sched_id, effective_date FROM schedules').fetchall()
+            self._sched_num, self._sched_day = current_sched_num([Schedule(*row) for row in rows], today), today
+        return self._sched_num
+
+    @staticmethod
+    def _params(cmd, params):
+        """ Returns params as stored, default-dated commands are pinned to today's date. """
+        if cmd in DATED_COMMANDS and 'date' not in dict(params):
+            params = tuple(sorted(params + (('date', datetime.date.today().strftime(DATE_FORMAT)),)))
+        return json.dumps(params)
+
+    def get(self, sched_num, key):
+        """ Returns the root stored for a cache key (see cache.make_key) under sched_num, None if absent. """
+        link, cmd, params = key
+        with self._lock:
+            row = self._db.execute('SELECT root FROM responses WHERE sched_num = ? AND link = ? AND cmd = ? '
+                                   'AND params = ?', (sched_num, link, cmd, self._params(cmd, params))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, sched_num, key, root):
+        """ Stores root for a cache key under sched_num. """
+        link, cmd, params = key
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                             (sched_num, link, cmd, self._params(cmd, params), json.dumps(root)))
+
+    def put_many(self, rows, encoded=False):
+        """
+        Stores many responses in one transaction.
+
+        :param rows: iterable of (sched_num, cache key, root) triples
+        :param encoded: roots are already JSON text
+        """
+        dump = (lambda root: root) if encoded else json.dumps
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                 [(sched_num, link, cmd, self._params(cmd, params), dump(root))
+                                  for sched_num, (link, cmd, params), root in rows])
+
+    def prune(self, keep):
+        """ Deletes every response not stored under schedule number keep. """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses WHERE sched_num != ?', (keep,))
+
+    def close(self):
+        """ Closes the SQLite connection. """
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory station metadata index.
+
+StationIndex is built once from stns() (and optionally stnaccess()) and
+then answers every lookup locally: abbreviation and name lookups by hash,
+prefix and fuzzy name search over a sorted word list, and nearest-station
+queries over a grid spatial index of the stations' latitude/longitude.
+"""
+
+import difflib
+import math
+import re
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Luis Ulloa"
+
+EARTH_RADIUS_KM = 6371.0088
+
+# grid cell size in degrees, about 5.5 km north-south around the Bay Area
+CELL = 0.05
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """ Returns text lowercased with punctuation collapsed, e.g. 'Civic Center/UN Plaza' -> 'civic center un plaza'. """
+    return ' '.join(WORD.findall(text.lower()))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ Returns the great-circle distance between two points, in kilometers. """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StationIndex:
+    """
+    ----- Station Index -----
+    stations = StationIndex.from_bart(bart, access=True)   # the only network calls
+    stations['EMBR']                    # Station record
+    stations.resolve('civic center')    # 'CIVC', accepts abbreviations, names, prefixes and typos
+    stations.search('mont')             # [Station(abbr='MONT', ...)]
+    stations.fuzzy('embarcadaro')       # [Station(abbr='EMBR', ...)]
+    stations.nearest(37.7793, -122.4193, n=2)   # [(Station, km), ...]
+    stations.access('EMBR')             # StationAccess record, if built with access=True
+
+    :param stations: iterable of Station records (see Bart.stns_data)
+    :param access: optional iterable of StationAccess records (see Bart.stnaccess_data)
+    """
+
+    def __init__(self, stations, access=None):
+        self._by_abbr = {stn.abbr.upper(): stn for stn in stations}
+        self._access = {acc.abbr.upper(): acc for acc in access or () if acc is not None and acc.abbr}
+        self._by_name = {normalize(stn.name): stn.abbr.upper() for stn in self._by_abbr.values()}
+
+        # (word or full name, abbr) pairs sorted for bisect prefix search
+        words = set()
+        for name, abbr in self._by_name.items():
+            words.add((name, abbr))
+            words.update((word, abbr) for word in name.split())
+        self._words = sorted(words)
+        self._keys = [word for word, _ in self._words]
+
+        self._grid = {}
+        for stn in self._by_abbr.values():
+            if stn.latitude is not None and stn.longitude is not None:
+                self._grid.setdefault(self._cell(stn.latitude, stn.longitude), []).append(stn)
+
+    @classmethod
+    def from_bart(cls, bart, access=False, max_workers=8):
+        """
+        Builds the index from bart.stns_data(), plus every station's stnaccess_data()
+        if access is True (fetched concurrently, max_workers at a time).
+        """
+        stations = bart.stns_data() or []
+        records = None
+        if access:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                records = list(executor.map(bart.stnaccess_data, [stn.abbr for stn in stations]))
+        return cls(stations, records)
+
+    @staticmethod
+    def _cell(lat, lon):
+        return int(math.floor(lat / CELL)), int(math.floor(lon / CELL))
+
+    def __len__(self):
+        return len(self._by_abbr)
+
+    def __iter__(self):
+        return iter(self._by_abbr.values())
+
+    def __contains__(self, abbr):
+        return abbr.upper() in self._by_abbr
+
+    def __getitem__(self, abbr):
+        return self._by_abbr[abbr.upper()]
+
+    def get(self, abbr, default=None):
+        """ Returns the Station for abbr (any case), default if there isn't one. """
+        return self._by_abbr.get(abbr.upper(), default)
+
+    def access(self, abbr):
+        """ Returns the StationAccess for abbr, None if it wasn't loaded. """
+        return self._access.get(abbr.upper())
+
+    def by_name(self, name):
+        """ Returns the Station whose full name is name (case and punctuation insensitive), None otherwise. """
+        abbr = self._by_name.get(normalize(name))
+        return self._by_abbr[abbr] if abbr else None
+
+    def search(self, prefix, limit=10):
+        """
+        Returns up to limit Stations whose name, or a word of it, starts with prefix,
+        ordered by name.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = {}
+        for i in range(bisect_left(self._keys, prefix), len(self._keys)):
+            word, abbr = self._words[i]
+            if not word.startswith(prefix):
+                break
+            found[abbr] = self._by_abbr[abbr]
+        return sorted(found.values(), key=lambda stn: stn.name)[:limit]
+
+    def fuzzy(self, text, n=5, cutoff=0.6):
+        """ Returns up to n Stations whose name or abbreviation is closest to text, e.g. with typos. """
+        text = normalize(text)
+        candidates = dict(self._by_name)
+        candidates.update((abbr.lower(), abbr) for abbr in self._by_abbr)
+        candidates.update(self._words)
+        matches = difflib.get_close_matches(text, list(candidates), n=n * 3, cutoff=cutoff)
+        res = []
+        for match in matches:
+            stn = self._by_abbr[candidates[match]]
+            if stn not in res:
+                res.append(stn)
+        return res[:n]
+
+    def resolve(self, text):
+        """
+        Returns the abbreviation user input most likely refers to: an abbreviation, a
+        full name, a prefix matching a single station, or the closest fuzzy match.
+        None if nothing is close.
+        """
+        if text.upper() in self._by_abbr:
+            return text.upper()
+        stn = self.by_name(text)
+        if stn is None:
+            matches = self.search(text, limit=2)
+            stn = matches[0] if len(matches) == 1 else None
+        if stn is None:
+            matches = self.fuzzy(text, n=1)
+            stn = matches[0] if matches else None
+        return stn.abbr.upper() if stn is not None else None
+
+    def nearest(self, lat, lon, n=1, max_km=None):
+        """
+        Returns the n stations nearest to (lat, lon) as (Station, distance in km) pairs,
+        closest first. Visits grid cells ring by ring outwards until no closer station can remain.
+
+        :param max_km: ignore stations farther than this
+        """
+        if not self._grid:
+            return []
+        row, col = self._cell(lat, lon)
+        # a station in a cell ring r away is at least (r - 1) cells away, measured on the
+        # shorter (longitude) side of a cell
+        cell_km = min(haversine(lat, lon, lat + CELL, lon), haversine(lat, lon, lat, lon + CELL))
+        rings = sorted((max(abs(cell[0] - row), abs(cell[1] - col)), cell) for cell in self._grid)
+        found = []
+        for ring, cell in rings:
+            bound = (ring - 1) * cell_km
+            if len(found) >= n and found[n - 1][1] <= bound:
+                break
+            if max_km is not None and bound > max_km:
+                break
+            found.extend((stn, haversine(lat, lon, stn.latitude, stn.longitude)) for stn in self._grid[cell])
+            found.sort(key=lambda pair: pair[1])
+        if max_km is not None:
+            found = [pair for pair in found if pair[1] <= max_km]
+        return found[:n]
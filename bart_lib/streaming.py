@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental JSON parsing for large BART responses.
+
+iter_array() reads a response body chunk by chunk and yields each element
+of one array in it (e.g. the 'station' list of etd, or the 'train' list of
+routesched) as soon as that element's bytes have arrived. Only the element
+being parsed is buffered, so memory stays flat no matter how large the
+response is.
+"""
+
+import codecs
+import json
+import re
+from time import perf_counter
+
+__author__ = "Luis Ulloa"
+
+WHITESPACE = ' \t\n\r'
+
+# characters that can follow a complete array element
+DELIMITERS = WHITESPACE + ',]'
+
+# longest tail of the buffer kept while looking for the array, enough to hold a split '"key" : ['
+SEEK_TAIL = 256
+
+
+class StreamError(ValueError):
+    """ Raised when a response body ends in the middle of the streamed array. """
+
+
+class StreamedResponse:
+    """
+    Status, headers, size and timings of a streamed response, filled in while it's read:
+    pass started as a transport stream()'s on_response and iterate read(chunks).
+
+    :param keep: the body is kept in .content while it's no longer than this many bytes
+    """
+
+    def __init__(self, keep=1024):
+        self.status_code = None
+        self.headers = None
+        self.size = 0
+        self.keep = keep
+        self._head = bytearray()
+        self.opened = perf_counter()
+        self.headers_at = None     # perf_counter() when the headers arrived
+
+    def started(self, status_code, headers):
+        self.status_code, self.headers, self.headers_at = status_code, headers, perf_counter()
+
+    def read(self, chunks):
+        """ Yields chunks, counting their bytes. """
+        for chunk in chunks:
+            self.size += len(chunk)
+            if self.size <= self.keep:
+                self._head += chunk
+            yield chunk
+
+    @property
+    def content(self):
+        """ The body read so far if it's no longer than keep bytes, b'' otherwise. """
+        return bytes(self._head) if self.size <= self.keep else b''
+
+
+def iter_array(chunks, key, encoding='utf-8'):
+    """
+    Yields the decoded elements of the first array stored under key in a JSON
+    document, reading it incrementally from chunks. Yields nothing if the document
+    has no such array, e.g. because the API answered with an error message.
+
+    :param chunks: iterable of bytes making up the document
+    :param key: name of the array, e.g. 'station'
+    :param encoding: body encoding
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buf, pos, in_array = '', 0, False
+
+    for chunk in chunks:
+        buf = buf[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        if not in_array:
+            match = start.search(buf)
+            if match is None:
+                buf = buf[-SEEK_TAIL:]
+                continue
+            in_array, pos = True, match.end()
+
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE + ',':
+                pos += 1
+            if pos == len(buf):
+                break                   # need more data
+            if buf[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break                   # element isn't complete yet
+            if not isinstance(element, (dict, list, str)) and (end == len(buf) or buf[end] not in DELIMITERS):
+                break                   # a number like 12 or 4. may go on in the next chunk
+            yield element
+            pos = end
+
+    if in_array:
+        raise StreamError("response ended inside the %r array" % key)
+
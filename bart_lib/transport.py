@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP transports used by the Bart wrapper.
+
+A transport is any object with a get(url, params) method that returns a
+response exposing .text, .content, .status_code, .headers and .json(), and
+optionally a stream(url, params, timeout, on_response) generator of body chunks
+that calls on_response(status_code, headers) once the headers have arrived.
+Bart keeps one transport for its whole lifetime so that every API call
+reuses the same keep-alive connections instead of opening a new TCP+TLS
+connection per request.
+
+RequestsTransport only imports requests (and urllib3) when it sends its
+first request, so importing bart_lib and creating a Bart stay cheap.
+HTTPClientTransport needs nothing outside the standard library, for the
+fastest cold start. Both ask for gzip/deflate (and brotli, if installed)
+compressed bodies and hand back the decompressed content; the bytes that
+actually crossed the network are in wire_size(response).
+"""
+
+import datetime
+import json
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from bart_lib.decoding import Decompressor, accept_encoding, decompress
+
+__author__ = "Luis Ulloa"
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def wire_size(response):
+    """ Returns the body bytes response took on the network (compressed), None if the transport can't tell. """
+    size = getattr(response, 'wire_size', None)
+    if size is not None:
+        return size
+    tell = getattr(getattr(response, 'raw', None), 'tell', None)     # requests: urllib3 counts raw bytes read
+    return tell() if tell is not None else None
+
+
+class RequestsTransport:
+    """
+    Connection-pooled transport backed by a requests.Session.
+
+    transport = RequestsTransport(pool_size=10, timeout=(3.05, 10), retries=3, backoff=0.3)
+
+    :param pool_size: max keep-alive connections kept per host
+    :param timeout: seconds, either a single number or a (connect, read) tuple
+    :param retries: number of retries on connection errors and 5xx responses
+    :param backoff: backoff factor between retries (0.3 -> 0.3s, 0.6s, 1.2s...)
+    """
+    RETRY_STATUSES = RETRY_STATUSES
+
+    def __init__(self, pool_size=10, timeout=(3.05, 10), retries=3, backoff=0.3):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """ The pooled requests.Session, created (and requests imported) on first use. """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    def _new_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = accept_encoding()     # requests decompresses all of them
+        retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                      status_forcelist=self.RETRY_STATUSES,
+                      allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get(self, url, params=None, timeout=None, headers=None):
+        """
+        Sends a GET request over the pooled session.
+
+        :param url: API link to request
+        :param params: query string payload, None values are dropped
+        :param timeout: overrides the transport's default timeout for this call
+        :param headers: extra request headers, e.g. If-None-Match
+        """
+        return self.session.get(url, params=params, timeout=timeout or self.timeout, headers=headers)
+
+    def stream(self, url, params=None, timeout=None, chunk_size=8192, on_response=None):
+        """
+        Sends a GET request and yields the response body in chunks as they arrive
+        (decompressed), instead of reading it all into memory first.
+
+        :param url: API link to request
+        :param params: query string payload, None values are dropped
+        :param timeout: overrides the transport's default timeout for this call
+        :param chunk_size: max bytes per chunk
+        :param on_response: optional callable(status_code, headers) called before the first chunk
+        """
+        r = self.session.get(url, params=params, timeout=timeout or self.timeout, stream=True)
+        try:
+            if on_response is not None:
+                on_response(r.status_code, r.headers)
+            for chunk in r.iter_content(chunk_size):
+                yield chunk
+        finally:
+            r.close()
+
+    def close(self):
+        """ Closes every pooled connection. """
+        if self._session is not None:
+            self._session.close()
+
+
+class Response:
+    """ Minimal requests.Response stand-in returned by HTTPClientTransport. """
+
+    def __init__(self, status_code, headers, content, url, elapsed, wire_size=None):
+        self.status_code = status_code
+        self.headers = headers      # http.client.HTTPMessage, case-insensitive get()
+        self.content = content      # decompressed
+        self.url = url
+        self.elapsed = elapsed
+        self.wire_size = wire_size if wire_size is not None else len(content)
+        self.encoding = headers.get_content_charset() or 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+    def json(self):
+        return json.loads(self.content.decode(self.encoding))
+
+
+class HTTPClientTransport:
+    """
+    Standard-library transport: keep-alive http.client connections pooled per host,
+    retrying connection errors and 5xx responses, with gzip/deflate (and brotli, if
+    installed) compressed bodies. Nothing else is imported beyond the standard
+    library, which makes it the lightest choice for short-lived processes.
+
+    bart = Bart(transport=HTTPClientTransport())
+
+    :param pool_size: max idle keep-alive connections kept per host
+    :param timeout: seconds, either a single number or a (connect, read) tuple
+    :param retries: number of retries on connection errors and 5xx responses
+    :param backoff: backoff factor between retries (0.3 -> 0.3s, 0.6s, 1.2s...)
+    """
+    RETRY_STATUSES = RETRY_STATUSES
+
+    def __init__(self, pool_size=10, timeout=(3.05, 10), retries=3, backoff=0.3):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._idle = {}     # (scheme, netloc) -> [HTTPConnection]
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, netloc, timeout):
+        """ Returns (connection, reused): an idle pooled connection to netloc, or a new one. """
+        import http.client      # loads socket and ssl, so not before the first request
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        connect_timeout = timeout[0] if isinstance(timeout, tuple) else timeout
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=connect_timeout), False
+        return http.client.HTTPConnection(netloc, timeout=connect_timeout), False
+
+    def _release(self, scheme, netloc, conn, response):
+        """ Returns conn to the pool if the server keeps it open, closes it otherwise. """
+        if response.will_close:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _open(self, url, params, timeout, headers):
+        """ Sends the request, returns (scheme, netloc, conn, response, url, started) once headers arrived. """
+        import http.client
+        import socket
+        timeout = timeout or self.timeout
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', accept_encoding())
+        parts = urlsplit(url)
+        query = urlencode([(k, v) for k, v in (params or {}).items() if v is not None])
+        path = (parts.path or '/') + '?' + '&'.join(filter(None, (parts.query, query)))
+        full_url = '%s://%s%s' % (parts.scheme, parts.netloc, path)
+        attempt = 0
+        while True:
+            conn, reused = self._connect(parts.scheme, parts.netloc, timeout)
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout[1] if isinstance(timeout, tuple) else timeout)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and not isinstance(e, socket.timeout):
+                    continue    # the server closed an idle keep-alive connection, not a real failure
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status not in self.RETRY_STATUSES or attempt == self.retries:
+                    return parts.scheme, parts.netloc, conn, response, full_url, started
+                response.read()
+                self._release(parts.scheme, parts.netloc, conn, response)
+            attempt += 1
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def get(self, url, params=None, timeout=None, headers=None):
+        """
+        Sends a GET request over a pooled connection.
+
+        :param url: API link to request
+        :param params: query string payload, None values are dropped
+        :param timeout: overrides the transport's default timeout for this call
+        :param headers: extra request headers, e.g. If-None-Match
+        """
+        scheme, netloc, conn, response, full_url, started = self._open(url, params, timeout, headers)
+        elapsed = datetime.timedelta(seconds=time.perf_counter() - started)
+        try:
+            content = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        self._release(scheme, netloc, conn, response)
+        return Response(response.status, response.msg, decompress(content, response.getheader('Content-Encoding')),
+                        full_url, elapsed, len(content))
+
+    def stream(self, url, params=None, timeout=None, chunk_size=8192, on_response=None):
+        """
+        Sends a GET request and yields the response body in chunks as they arrive
+        (decompressed), instead of reading it all into memory first.
+
+        :param url: API link to request
+        :param params: query string payload, None values are dropped
+        :param timeout: overrides the transport's default timeout for this call
+        :param chunk_size: max bytes per chunk
+        :param on_response: optional callable(status_code, headers) called before the first chunk
+        """
+        scheme, netloc, conn, response, _, _ = self._open(url, params, timeout, None)
+        decompressor = Decompressor(response.getheader('Content-Encoding'))
+        done = False
+        try:
+            if on_response is not None:
+                on_response(response.status, response.msg)
+            chunk = response.read1(chunk_size)
+            while chunk:
+                chunk = decompressor.decompress(chunk)
+                if chunk:
+                    yield chunk
+                chunk = response.read1(chunk_size)
+            rest = decompressor.flush()
+            if rest:
+                yield rest
+            done = True
+        finally:
+            if done:
+                self._release(scheme, netloc, conn, response)
+            else:
+                conn.close()    # abandoned midway, the rest of the body is still on the socket
+
+    def close(self):
+        """ Closes every pooled connection. """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
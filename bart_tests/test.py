@@ -1,45 +1,752 @@
+import asyncio
+import functools
+import gzip
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from bart_lib.aio import AsyncBart
 from bart_lib.bart import *
+from bart_lib.decoding import load_brotli, available_decoders, get_decoder
+from bart_lib.departures import DepartureIndex, service_minutes
+from bart_lib.fares import FareMatrix
+from bart_lib.history import ETDHistory
+from bart_lib.planner import TripPlanner
+from bart_lib.prefetch import Prefetcher
+from bart_lib.records import format_time, parse_etd, parse_routesched, parse_stnsched, parse_time, render_etd, \
+    render_etd_root, render_routesched, render_routesched_root, render_stnsched, render_stnsched_root
+from bart_lib.replay import RecordingTransport, ReplayTransport, fixture_name
+from bart_lib.transport import HTTPClientTransport, RequestsTransport
 
-if __name__ == "__main__":
-    # example usage
-    bart = Bart()
-    print(bart.bsa())
-    print(bart.train_count())
+# every Bart command, in the order they're printed
+CALLS = [
+    ('bsa', ()),
+    ('train_count', ()),
+    ('elev', ()),
+    ('elev_help', ()),
+    ('etd', ('ALL',)),
+    ('etd_help', ()),
+    ('route_info', (1,)),
+    ('routes', ()),
+    ('route_help', ()),
+    ('stninfo', ('24TH',)),
+    ('stns', ()),
+    ('stnaccess', ('12th',)),
+    ('stn_help', ()),
+    ('arrive', ("ASHB", "CIVC")),
+    ('depart', ("ASHB", "CIVC")),
+    ('fare', ("ASHB", "CIVC")),
+    ('routesched', (1,)),
+    ('scheds', ()),
+    ('special', ()),
+    ('stnsched', ("ASHB",)),
+    ('stn_help', ()),
+    ('help', ()),
+]
+
+
+# cold start: a fresh interpreter importing bart_lib and creating a client
+IMPORTS = [
+    ('import', "import bart_lib.bart"),
+    ('Bart()', "from bart_lib.bart import Bart; Bart()"),
+    ('stdlib', "from bart_lib.bart import Bart; from bart_lib.transport import HTTPClientTransport; "
+               "Bart(transport=HTTPClientTransport())"),
+    ('requests', "import requests"),
+]
+
+
+def import_time(statement, runs):
+    """ Returns the median seconds a fresh interpreter spends running statement, startup excluded. """
+    def median(code):
+        times = []
+        for _ in range(runs):
+            started = timeit.default_timer()
+            subprocess.check_call([sys.executable, '-c', code], stderr=subprocess.DEVNULL)
+            times.append(timeit.default_timer() - started)
+        return statistics.median(times)
+    return median(statement) - median('pass')
+
+
+def decode_bench(directory, runs):
+    """
+    Prints, per command recorded in directory, the body size uncompressed and compressed
+    with each content encoding, and the time each installed JSON decoder takes on it.
+    """
+    brotli = load_brotli()
+    encodings = [('gzip', gzip.compress), ('deflate', zlib.compress)]
+    if brotli is not None:
+        encodings.append(('br', brotli.compress))
+    decoders = [(name, get_decoder(name)) for name in available_decoders()]
+    bodies = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                bodies.setdefault(name.split('-')[0].split('.')[0], []).append(f.read())
+    print("%-12s %9s %s %s" % ('command', 'bytes', ' '.join('%9s' % name for name, _ in encodings),
+                               ' '.join('%12s' % name for name, _ in decoders)))
+    for cmd, contents in sorted(bodies.items()):
+        sizes = [sum(len(compress(content)) for content in contents) for _, compress in encodings]
+        times = [timeit.timeit(lambda: [decode(content) for content in contents], number=runs) / runs
+                 for _, decode in decoders]
+        print("%-12s %9d %s %s" % (cmd, sum(len(content) for content in contents),
+                                   ' '.join('%9d' % size for size in sizes),
+                                   ' '.join('%9.1f us' % (t * 1e6) for t in times)))
+
+
+# stations the stand-in server makes up departures for
+STAND_IN_STATIONS = ['S%02d' % i for i in range(50)]
+
+# route numbers it makes schedules for: route n stops at 25 stations from S(8n-8), 2 minutes apart
+STAND_IN_ROUTES = range(1, 5)
+STAND_IN_DATE, STAND_IN_TIME = '10/17/2026', '08:00:00 AM PDT'
+
+
+def stand_in_root(cmd, params):
+    """ Returns a made-up root for cmd, shaped like BART's answer; an API error for commands it doesn't know. """
+    stamp = {'date': STAND_IN_DATE, 'time': STAND_IN_TIME}
+    if cmd == 'etd':
+        orig = params.get('orig', 'ALL').upper()
+        return dict(stamp, station=[
+            {'name': 'Station %s' % abbr, 'abbr': abbr, 'etd': [
+                {'destination': 'Destination %d' % dest, 'abbreviation': 'D%d' % dest, 'estimate': [
+                    {'minutes': str(5 * n + dest), 'platform': str(dest % 2 + 1), 'direction': 'North',
+                     'color': 'RED', 'length': '8', 'delay': '0'} for n in range(3)]}
+                for dest in range(3)]}
+            for abbr in (STAND_IN_STATIONS if orig == 'ALL' else [orig])])
+    if cmd == 'stns':
+        return dict(stamp, stations={'station': [
+            {'name': 'Station %s' % abbr, 'abbr': abbr, 'address': '%d Main St' % i, 'city': 'Oakland',
+             'state': 'CA', 'zipcode': '94612', 'gtfs_latitude': str(37.8 + i / 1e3), 'gtfs_longitude': '-122.27'}
+            for i, abbr in enumerate(STAND_IN_STATIONS)]})
+    if cmd == 'scheds':
+        return dict(stamp, schedules={'schedule': [{'@id': '61', '@effectivedate': '01/01/2026 12:00 AM'}]})
+    if cmd == 'count':
+        return dict(stamp, traincount='42')
+    if cmd in ('bsa', 'elev'):
+        return dict(stamp, bsa=[{'station': 'BART', 'description': {'#cdata-section': 'No delays reported.'},
+                                 'sms_text': {'#cdata-section': 'No delays reported.'}}])
+    if cmd == 'routes':
+        return dict(stamp, sched_num='61', routes={'route': [
+            {'number': str(n), 'routeID': 'ROUTE %d' % n, 'abbr': 'S%02d-S%02d' % (8 * n - 8, 8 * n + 16),
+             'name': 'Route %d' % n} for n in STAND_IN_ROUTES]})
+    if cmd == 'routesched':     # a train every 6 minutes from 5:00 AM
+        first = 8 * (int(params.get('route', 1)) - 1)
+        return dict(stamp, sched_num='61', route={'train': [
+            {'@trainId': '%s%03d' % (params.get('route', 1), train), 'stop': [
+                {'@station': abbr, '@origTime': format_time(5 * 60 + 6 * train + 2 * i)}
+                for i, abbr in enumerate(STAND_IN_STATIONS[first:first + 25])]}
+            for train in range(150)]})
+    if cmd in ('arrive', 'depart'):     # a trip every 6 minutes around time, 2 minutes per station
+        orig, dest = params['orig'].upper(), params['dest'].upper()
+        minutes = parse_time(params['time']) if params.get('time') else parse_time(STAND_IN_TIME)
+        ride = 2 * abs(STAND_IN_STATIONS.index(dest) - STAND_IN_STATIONS.index(orig))
+        fares = stand_in_root('fare', params)['fares']
+        trips = []
+        for n in range(-int(params.get('b', 2)), int(params.get('a', 2))):
+            leave = minutes + 6 * n if cmd == 'depart' else minutes + 6 * n - ride
+            trips += [{'@origTimeMin': format_time(leave), '@destTimeMin': format_time(leave + ride),
+                       '@origTimeDate': STAND_IN_DATE, '@fare': fares['fare'][0]['@amount'], 'fares': fares},
+                      {'@order': '1', '@origin': orig, '@destination': dest}]     # its leg
+        return dict(stamp, origin=orig, destination=dest, schedule={'request': {'trip': trips}})
+    if cmd == 'fare':
+        stops = abs(STAND_IN_STATIONS.index(params['dest'].upper()) - STAND_IN_STATIONS.index(params['orig'].upper()))
+        return dict(stamp, origin=params['orig'].upper(), destination=params['dest'].upper(), fares={'fare': [
+            {'@name': 'Clipper', '@amount': '%.2f' % (2.15 + 0.25 * stops), '@class': 'clipper'},
+            {'@name': 'Senior/Disabled Clipper', '@amount': '%.2f' % (0.8 + 0.1 * stops), '@class': 'rtcclipper'}]})
+    if cmd == 'stnsched':
+        orig = params.get('orig', 'S00').upper()
+        return dict(stamp, sched_num='61', station={'name': 'Station %s' % orig, 'abbr': orig, 'item': [
+            {'@trainId': str(item), '@line': 'ROUTE %d' % (item % 2 + 1), '@trainHeadStation': 'S24',
+             '@origTime': format_time(4 * 60 + 4 * item), '@destTime': format_time(4 * 60 + 4 * item + 30)}
+            for item in range(300)]})      # a train every 4 minutes from 4:00 AM to midnight
+    return {'message': {'error': {'text': "The stand-in server doesn't answer %s." % cmd}}}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'     # keep-alive, so pooled transports can reuse connections
+    disable_nagle_algorithm = True    # headers and body are separate writes
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        with self.server.lock:
+            self.server.requests += 1
+        status = 429 if self.server.throttled(params.get('key')) else 200
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if status == 429:
+            body = json.dumps({'root': {'message': {'error': {'text': "Too many requests."}}}}).encode('utf-8')
+        else:
+            body = self.server.body(parts.path, params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local stand-in for api.bart.gov, serving on a random port from a background thread.
+    Answers from fixtures recorded with --record when there is one for the request,
+    otherwise with made-up data (see stand_in_root). Counts connections and requests.
+    Like the API, it can limit the requests each key sends, answering 429 over the limit.
+
+    :param fixtures: fixture directory, None to only make data up
+    :param latency: seconds every answer is delayed by, to stand in for the network
+    :param key_rate: requests per second each key may send, None for no limit
+    """
+    daemon_threads = True
+    request_queue_size = 128    # a gather() opens dozens of connections at once
+
+    def __init__(self, fixtures=None, latency=0.0, key_rate=None):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.key_rate = key_rate
+        self.buckets = {}       # key -> (tokens, time.monotonic() they were counted at)
+        self.connections = self.requests = self.throttled_requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def throttled(self, key):
+        """ Returns True, and counts it, if key has no token left in its bucket (burst of 2). """
+        if self.key_rate is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            tokens, counted = self.buckets.get(key, (2.0, now))
+            tokens = min(2.0, tokens + (now - counted) * self.key_rate)
+            throttled = tokens < 1
+            self.buckets[key] = (tokens if throttled else tokens - 1, now)
+            self.throttled_requests += throttled
+            return throttled
+
+    def body(self, path, params):
+        if self.fixtures is not None:
+            try:
+                with open(os.path.join(self.fixtures, fixture_name(path, params)), 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+        return json.dumps({'root': stand_in_root(params.get('cmd'), params)}).encode('utf-8')
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def stand_in(bart, server):
+    """ Points bart's API links at server, returns bart. """
+    for name in dir(Bart):
+        if name.endswith('_API_LINK'):
+            setattr(bart, name, server.url + urlsplit(getattr(Bart, name)).path)
+    return bart
+
+
+class UnpooledTransport:
+    """ What Bart did before it had a transport: a fresh requests.get, and connection, per call. """
+
+    def get(self, url, params=None, timeout=None, headers=None):
+        import requests
+        return requests.get(url, params=params, timeout=timeout, headers=headers)
+
+
+POOLING = [
+    ('requests.get', UnpooledTransport),
+    ('requests', RequestsTransport),
+    ('http.client', lambda: HTTPClientTransport(pool_size=0)),     # closes every connection after use
+    ('http.client pooled', HTTPClientTransport),
+]
 
-    print(bart.elev())
-    print(bart.elev_help())
 
-    print(bart.etd('ALL'))
+def pooled_bench(server, runs):
+    """ Prints per-call latency of etd() and the connections it opened, with and without a connection pool. """
+    for name, transport in POOLING:
+        bart = stand_in(Bart(transport=transport(), cache=False), server)
+        try:
+            bart.etd('S00')     # first connection and imports aren't what's being measured
+        except ImportError as e:
+            print("%-20s %s" % (name, e))
+            continue
+        connections = server.connections
+        seconds = timeit.timeit(lambda: bart.etd('S00'), number=runs)
+        print("%-20s %9.1f us/call %6d connections" % (name, seconds / runs * 1e6, server.connections - connections))
+        bart.close()
 
-    print(bart.etd_help())
 
-    print(bart.route_info(1))
-    print(bart.routes())
+# (command, request path and parameters, Bart's string rendering, *_data records rendering)
+RENDERINGS = [
+    ('etd', ('/api/etd.aspx', {'cmd': 'etd', 'orig': 'ALL'}),
+     (lambda root: render_etd_root(root, 'ALL'), lambda root: render_etd(parse_etd(root), 'ALL'))),
+    ('routesched', ('/api/sched.aspx', {'cmd': 'routesched', 'route': '1'}),
+     (render_routesched_root, lambda root: render_routesched(parse_routesched(root)))),
+    ('stnsched', ('/api/sched.aspx', {'cmd': 'stnsched', 'orig': 'S00'}),
+     (render_stnsched_root, lambda root: render_stnsched(parse_stnsched(root)))),
+]
 
-    print(bart.route_help())
 
-    print(bart.stninfo('24TH'))
+def peak_allocated(fn, *args):
+    """ Returns the peak bytes allocated while fn(*args) runs. """
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
 
-    print(bart.stns())
 
-    print(bart.stnaccess('12th'))
+def records_bench(server, runs):
+    """
+    Prints, per command, the time and peak memory rendering a decoded response takes with
+    Bart's string method (res += straight from the root) and from the *_data records, and
+    whether both texts match.
+    """
+    transport = HTTPClientTransport()
+    names = ('string', 'records')
+    print("%-12s %s %s" % ('command', ' '.join('%12s' % name for name in names),
+                           ' '.join('%10s' % (name + ' KB') for name in names)))
+    for cmd, (path, params), renderings in RENDERINGS:
+        root = transport.get(server.url + path, params=dict(params, json='y')).json()['root']
+        times = [timeit.timeit(lambda: fn(root), number=runs) / runs for fn in renderings]
+        peaks = [peak_allocated(fn, root) / 1024 for fn in renderings]
+        print("%-12s %s %s %s" % (cmd, ' '.join('%9.1f us' % (t * 1e6) for t in times),
+                                  ' '.join('%10.1f' % peak for peak in peaks),
+                                  '' if len({fn(root) for fn in renderings}) == 1 else 'DIFFERENT TEXT'))
+    transport.close()
 
-    print(bart.stn_help())
+# one polling tick: every station's departures and the advisories
+TICK = [('etd', (abbr,)) for abbr in STAND_IN_STATIONS] + [('bsa', ()), ('elev', ()), ('train_count', ())]
 
-    print(bart.arrive("ASHB", "CIVC"))
 
-    print(bart.depart("ASHB", "CIVC"))
+def async_bench(server, runs):
+    """
+    Times a polling tick made with Bart one call after another and with AsyncBart.gather,
+    and checks that AsyncBart's answers, streamed ones included, match Bart's.
+    """
+    bart = stand_in(Bart(transport=HTTPClientTransport(), cache=False), server)
+    started = timeit.default_timer()
+    for _ in range(runs):
+        expected = [getattr(bart, name)(*args) for name, args in TICK]
+    sequential = (timeit.default_timer() - started) / runs
+    expected_stations = bart.etd_data('ALL').stations
+    bart.close()
 
-    print(bart.fare("ASHB", "CIVC"))
+    async def ticks():
+        async with AsyncBart(transport=HTTPClientTransport(pool_size=len(TICK)), cache=False,
+                             max_concurrency=len(TICK)) as abart:
+            stand_in(abart.bart, server)
+            await abart.gather(*[getattr(abart, name)(*args) for name, args in TICK])     # opens the pool
+            started = timeit.default_timer()
+            for _ in range(runs):
+                results = await abart.gather(*[getattr(abart, name)(*args) for name, args in TICK])
+            seconds = (timeit.default_timer() - started) / runs
+            stations = [station async for station in abart.etd_stream('ALL')]
+            return results, seconds, stations
 
-    print(bart.routesched(1))
+    results, concurrent, stations = asyncio.run(ticks())
+    print("%-12s %9.1f ms/tick" % ('Bart', sequential * 1e3))
+    print("%-12s %9.1f ms/tick" % ('AsyncBart', concurrent * 1e3))
+    print("answers %s, streamed stations %s" % ('match' if results == expected else 'DIFFER',
+                                                 'match' if stations == expected_stations else 'DIFFER'))
 
-    print(bart.scheds())
 
-    print(bart.special())
+def etd_many_bench(server, runs):
+    """
+    Times etd_many() against a loop of etd_data() calls for growing sets of stations, with
+    the upstream requests each made, and checks that both find the same departures.
+    """
+    bart = stand_in(Bart(transport=HTTPClientTransport(), cache=False), server)
+    print("%-9s %22s %22s" % ('stations', 'etd_many', 'etd_data loop'))
+    for count in (1, 3, 6, 12):
+        stations = STAND_IN_STATIONS[:count]
+        requests = server.requests
+        started = timeit.default_timer()
+        for _ in range(runs):
+            many = bart.etd_many(stations)
+        many_time, many_requests = (timeit.default_timer() - started) / runs, (server.requests - requests) / runs
+        requests = server.requests
+        started = timeit.default_timer()
+        for _ in range(runs):
+            looped = {abbr: bart.etd_data(abbr).stations[0].departures for abbr in stations}
+        loop_time, loop_requests = (timeit.default_timer() - started) / runs, (server.requests - requests) / runs
+        print("%-9d %8.1f ms %3d requests %8.1f ms %3d requests %s"
+              % (count, many_time * 1e3, many_requests, loop_time * 1e3, loop_requests,
+                 '' if many == looped else 'DIFFERENT DEPARTURES'))
+    bart.close()
 
-    print(bart.stnsched("ASHB"))
 
-    print(bart.stn_help())
+def snapshot_bench(server, runs):
+    """
+    Times creating a Bart with a snapshot file and answering stnsched, stns and routesched,
+    cold (a new file) and warm (the file the cold start filled), with the upstream requests
+    each made.
+    """
+    import tempfile
+    print("%-6s %9s %9s" % ('start', 'ms', 'requests'))
+    with tempfile.TemporaryDirectory() as directory:
+        for start in ('cold', 'warm'):
+            seconds = requests = 0
+            for run in range(runs):
+                path = os.path.join(directory, '%d.db' % run)
+                before = server.requests
+                started = timeit.default_timer()
+                bart = stand_in(Bart(transport=HTTPClientTransport(), snapshot=path), server)
+                bart.stnsched('S00'), bart.stns(), bart.routesched(1)
+                seconds += timeit.default_timer() - started
+                requests += server.requests - before
+                bart.close()
+            print("%-6s %9.1f %9.1f" % (start, seconds / runs * 1e3, requests / runs))
+
+
+def planner_bench(server, runs):
+    """
+    Times building a TripPlanner from the stand-in's route schedules, then answering runs
+    depart_data queries with it (fares cached) and with an uncached Bart, and counts the
+    answers that have trips.
+    """
+    bart = stand_in(Bart(transport=HTTPClientTransport()), server)
+    started = timeit.default_timer()
+    planner = TripPlanner.from_bart(bart, STAND_IN_DATE)
+    print("built %d connections in %.1f ms" % (len(planner), (timeit.default_timer() - started) * 1e3))
+    pairs = [sorted((i % 48, (7 * i + 3) % 48)) for i in range(runs)]     # routes only run up the line
+    queries = [(STAND_IN_STATIONS[orig], STAND_IN_STATIONS[dest], format_time(6 * 60 + 37 * i % 720))
+               for i, (orig, dest) in enumerate(pairs) if orig != dest]
+    for orig, dest, _ in queries:
+        bart.fare_data(orig, dest)      # each pair's fares are fetched once, then cached
+    upstream = stand_in(Bart(transport=HTTPClientTransport(), cache=False), server)
+    for name, depart_data in (('planner', planner.depart_data), ('Bart', upstream.depart_data)):
+        started = timeit.default_timer()
+        plans = [depart_data(orig, dest, time) for orig, dest, time in queries]
+        seconds = timeit.default_timer() - started
+        print("%-8s %9.0f queries/s %5d with trips" % (name, len(queries) / seconds,
+                                                       sum(1 for plan in plans if plan and plan.trips)))
+    upstream.close()
+    bart.close()
+
+
+def fares_bench(server, runs):
+    """
+    Times building a FareMatrix of every stand-in station, saving and loading it, then runs
+    fare_data lookups served from it and from an uncached Bart, and checks both quote the same.
+    """
+    import tempfile
+    bart = stand_in(Bart(transport=HTTPClientTransport(), cache=False), server)
+    requests, started = server.requests, timeit.default_timer()
+    matrix = FareMatrix.build(bart, '61')
+    print("built %d pairs in %.1f ms, %d requests" % (len(matrix), (timeit.default_timer() - started) * 1e3,
+                                                     server.requests - requests))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fares.bin')
+        started = timeit.default_timer()
+        matrix.save(path)
+        saved = timeit.default_timer()
+        matrix = FareMatrix.load(path)
+        print("saved in %.1f ms, loaded in %.1f ms" % ((saved - started) * 1e3, (timeit.default_timer() - saved) * 1e3))
+    served = stand_in(Bart(transport=HTTPClientTransport(), cache=False, fare_matrix=matrix), server)
+    served.fare_data('S00', 'S01')      # checks the schedule once
+    pairs = [(STAND_IN_STATIONS[i % 50], STAND_IN_STATIONS[(7 * i + 3) % 50]) for i in range(runs)]
+    pairs = [(orig, dest) for orig, dest in pairs if orig != dest]
+    quotes = {}
+    for name, fare_data in (('matrix', served.fare_data), ('Bart', bart.fare_data)):
+        started = timeit.default_timer()
+        quotes[name] = [fare_data(orig, dest) for orig, dest in pairs]
+        print("%-8s %9.1f us/lookup" % (name, (timeit.default_timer() - started) / len(pairs) * 1e6))
+    print("quotes %s" % ('match' if quotes['matrix'] == quotes['Bart'] else 'DIFFER'))
+    served.close()
+    bart.close()
+
+
+def prefetch_bench(server, runs):
+    """
+    Times filling a new snapshot with every stand-in station's stnsched and route's routesched,
+    one call after another and with a Prefetcher (parsing on its own thread, or on a process
+    per CPU), and counts the upstream requests a stnsched_data loop still makes afterwards.
+    """
+    import tempfile
+    processes = os.cpu_count() or 1
+    ways = [('serial', None), ('threads only', {'processes': 0}), ('%d process(es)' % processes, {'processes': processes})]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, kwargs in ways:
+            seconds = requests = 0
+            for run in range(runs):
+                bart = stand_in(Bart(transport=HTTPClientTransport(), snapshot=os.path.join(
+                    directory, '%s-%d.db' % (name, run))), server)
+                bart.scheds_data(), bart.stns_data(), bart.routes_data()    # what every way starts with
+                started = timeit.default_timer()
+                if kwargs is None:
+                    for abbr in STAND_IN_STATIONS:
+                        bart.stnsched_data(abbr)
+                    for route in STAND_IN_ROUTES:
+                        bart.routesched_data(route)
+                else:
+                    Prefetcher(bart, **kwargs).run()
+                seconds += timeit.default_timer() - started
+                before = server.requests
+                fresh = stand_in(Bart(transport=HTTPClientTransport(), snapshot=bart.snapshot), server)
+                for abbr in STAND_IN_STATIONS:
+                    fresh.stnsched_data(abbr)
+                requests += server.requests - before
+                fresh.close()
+                bart.close()
+            print("%-12s %9.1f ms %5.0f stnsched requests after" % (name, seconds / runs * 1e3, requests / runs))
+
+
+def history_bench(server, runs):
+    """
+    Records runs copies of the stand-in's etd ALL report, 30 seconds apart, into an ETDHistory,
+    then times flushing and reopening it and each aggregate, with numpy if it's installed
+    and with the stdlib.
+    """
+    import tempfile
+    bart = stand_in(Bart(transport=HTTPClientTransport(), cache=False), server)
+    report, trains = bart.etd_data('ALL'), bart.train_count()
+    bart.close()
+    engines = [('stdlib', False)]
+    if importlib.util.find_spec('numpy') is not None:
+        engines.insert(0, ('numpy', True))
+    else:
+        print("numpy isn't installed, aggregating with the stdlib only")
+    with tempfile.TemporaryDirectory() as directory:
+        history = ETDHistory(directory)
+        started = timeit.default_timer()
+        rows = sum(history.record(report, 1.8e9 + 30 * snap, trains) for snap in range(runs))
+        recorded = timeit.default_timer()
+        history.flush()
+        flushed = timeit.default_timer()
+        history.close()
+        print("%d rows: recorded in %.2f s, flushed in %.2f s" % (rows, recorded - started, flushed - recorded))
+        print("%-14s %s" % ('aggregate', ' '.join('%8s' % name for name, _ in engines)))
+        histories, times = [], []
+        for name, use_numpy in engines:
+            started = timeit.default_timer()
+            histories.append(ETDHistory(directory, use_numpy))
+            times.append(timeit.default_timer() - started)
+        print("%-14s %s" % ('open', ' '.join('%7.2fs' % seconds for seconds in times)))
+        for aggregate in ('headways', 'delays', 'departures', 'train_counts'):
+            times = []
+            for history in histories:
+                started = timeit.default_timer()
+                getattr(history, aggregate)()
+                times.append(timeit.default_timer() - started)
+            print("%-14s %s" % (aggregate, ' '.join('%7.2fs' % seconds for seconds in times)))
+        for history in histories:
+            history.close()
+
+
+def scan_departures(bart, orig, after, n=3):
+    """ What finding the next trains took before DepartureIndex: scan every stnsched_data item. """
+    after = service_minutes(after)
+    items = [item for item in bart.stnsched_data(orig).items if service_minutes(item.orig_time) >= after]
+    return sorted(items, key=lambda item: service_minutes(item.orig_time))[:n]
+
+
+def departures_bench(server, runs):
+    """
+    Times finding a station's next departures with DepartureIndex against rendering stnsched()
+    and scanning stnsched_data() items (all cached), and checks the index and scan agree.
+    """
+    bart = stand_in(Bart(transport=HTTPClientTransport()), server)
+    departures = DepartureIndex(bart)
+    departures.next_departures('S00', '5:40 PM')     # fetches and indexes S00 once
+    ways = [
+        ('stnsched() text', lambda: bart.stnsched('S00')),
+        ('scan stnsched_data', lambda: scan_departures(bart, 'S00', '5:40 PM')),
+        ("next_departures('5:40 PM')", lambda: departures.next_departures('S00', '5:40 PM')),
+        ('next_departures(1060)', lambda: departures.next_departures('S00', 1060)),
+        ('between, one hour', lambda: departures.between('S00', '5:00 PM', '6:00 PM')),
+    ]
+    for name, fn in ways:
+        seconds = min(timeit.repeat(fn, number=runs, repeat=BENCH_REPEATS))
+        print("%-28s %9.1f us" % (name, seconds / runs * 1e6))
+    agree = all(departures.next_departures('S00', after) == scan_departures(bart, 'S00', after)
+                for after in range(4 * 60, 25 * 60, 7))
+    print("index and scan %s" % ('agree' if agree else 'DISAGREE'))
+    bart.close()
+
+
+# requests per second the stand-in server lets each key send in --keys
+STAND_IN_KEY_RATE = 20
+
+
+def keys_bench(server, runs):
+    """
+    Runs 16 threads fanning etd() calls out over a KeyPool of 1, 2, 4 and 8 keys for runs
+    seconds each, against STAND_IN_KEY_RATE requests per second per key, and prints the
+    answers per second and the requests the server throttled.
+    """
+    server.key_rate = STAND_IN_KEY_RATE
+    print("%-5s %9s %9s" % ('keys', 'ok/s', '429s'))
+    for count in (1, 2, 4, 8):
+        keys = ['STAND-IN-KEY-%d-%d' % (count, i) for i in range(count)]     # fresh buckets on the server
+        pool = KeyPool(keys, rate=STAND_IN_KEY_RATE - 1, burst=1)
+        bart = stand_in(Bart(key=pool, transport=HTTPClientTransport(pool_size=16), cache=False), server)
+        answers, throttled = [], server.throttled_requests
+        deadline = timeit.default_timer() + runs
+
+        def fan_out(abbr):
+            while timeit.default_timer() < deadline:
+                ok = bart.etd_data(abbr) is not None
+                if timeit.default_timer() < deadline:     # calls still waiting for a key at the end don't count
+                    answers.append(ok)
+
+        threads = [threading.Thread(target=fan_out, args=(abbr,)) for abbr in STAND_IN_STATIONS[:16]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print("%-5d %9.1f %9d" % (count, sum(answers) / runs, server.throttled_requests - throttled))
+        bart.close()
+    server.key_rate = None
+
+
+# --mode N runs: function(server, runs), default --latency in ms
+STAND_IN_BENCHES = {
+    'pooled': (pooled_bench, 0),
+    'records': (records_bench, 0),
+    'async': (async_bench, 20),
+    'etd-many': (etd_many_bench, 20),
+    'snapshot': (snapshot_bench, 20),
+    'planner': (planner_bench, 20),
+    'fares': (fares_bench, 20),
+    'prefetch': (prefetch_bench, 20),
+    'history': (history_bench, 0),
+    'departures': (departures_bench, 0),
+    'keys': (keys_bench, 0),
+}
+
+
+# how many times its baseline a command's time or peak memory may be before --bench fails
+BENCH_TOLERANCE = 1.5
+
+# --bench times every command this many times and keeps the fastest
+BENCH_REPEATS = 5
+
+
+def bench(bart, runs):
+    """ Returns {command: {'us': microseconds per call, 'peak_kb': tracemalloc peak of one call in KB}}. """
+    results = {}
+    for name, args in CALLS:
+        if name.endswith('help'):
+            continue    # help methods print
+        call = functools.partial(getattr(bart, name), *args)
+        seconds = min(timeit.repeat(call, number=runs, repeat=BENCH_REPEATS))     # least disturbed by noise
+        results[name] = {'us': seconds / runs * 1e6, 'peak_kb': peak_allocated(call) / 1024}
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """ Returns a line for every command and measure in results above tolerance times its baseline. """
+    lines = []
+    for name, measures in sorted(results.items()):
+        for measure, value in sorted(measures.items()):
+            limit = baseline.get(name, {}).get(measure)
+            if limit is not None and value > limit * tolerance:
+                lines.append("%s %s: %.1f, baseline %.1f" % (name, measure, value, limit))
+    return lines
+
+
+def option(name):
+    """ Returns the value following --name on the command line, None if it isn't there. """
+    flag = '--' + name
+    return sys.argv[sys.argv.index(flag) + 1] if flag in sys.argv else None
+
+
+if __name__ == "__main__":
+    # example usage
+    #   python test.py                     calls the live API
+    #   python test.py --record fixtures   calls the live API, saving every response to fixtures/
+    #   python test.py --replay fixtures   no network, answers from fixtures/
+    #   python test.py --replay fixtures --bench 100
+    #                                      times every command (no cache) over the fixtures,
+    #                                      with the peak memory of one call
+    #   python test.py --replay fixtures --bench 100 --save-baseline bench.json
+    #   python test.py --replay fixtures --bench 100 --baseline bench.json [--tolerance 1.5]
+    #                                      exits 1 if a command got slower or bigger than
+    #                                      tolerance times its baseline
+    #   python test.py --imports 20        times importing bart_lib and creating a Bart
+    #   python test.py --decode fixtures 100
+    #                                      bytes per content encoding and decode time per JSON
+    #                                      library, for every command recorded in fixtures/
+    # against a local stand-in server (made-up data, or fixtures/ with --replay fixtures):
+    #   python test.py --pooled 200        etd() latency and connections opened, pooled or not
+    #   python test.py --records 200       rendering strings from the root vs. from records
+    #   python test.py --async 5 --latency 20
+    #                                      a polling tick with Bart vs. AsyncBart.gather, with
+    #                                      20ms per answer, and checks AsyncBart's answers
+    #   python test.py --etd-many 5        etd_many() vs. a loop of etd() calls, 20ms per answer
+    #   python test.py --snapshot 5        starting with an empty vs. a filled snapshot file
+    #   python test.py --planner 200       TripPlanner.depart_data() vs. Bart.depart_data(), 20ms per answer
+    #   python test.py --fares 200         building a FareMatrix, then fare lookups from it vs. upstream
+    #   python test.py --prefetch 3        filling a snapshot with Prefetcher vs. a stnsched/routesched loop
+    #   python test.py --history 2000      recording etd reports into an ETDHistory, then its aggregates
+    #   python test.py --departures 1000   DepartureIndex.next_departures() vs. scanning stnsched
+    #   python test.py --keys 5            etd() throughput with 1 to 8 pooled keys, 20 requests/s per key
+    transport = None
+    if option('record'):
+        transport = RecordingTransport(RequestsTransport(), option('record'))
+    elif option('replay'):
+        transport = ReplayTransport(option('replay'))
+
+    server = None
+    benches = [name for name in STAND_IN_BENCHES if option(name)]
+    if benches:
+        run, latency = STAND_IN_BENCHES[benches[0]]
+        server = StandInServer(option('replay'), float(option('latency') or latency) / 1e3)
+        run(server, int(option(benches[0])))
+    elif option('decode'):
+        decode_bench(option('decode'), int(sys.argv[sys.argv.index('--decode') + 2]))
+    elif option('imports'):
+        runs = int(option('imports'))
+        for name, statement in IMPORTS:
+            try:
+                seconds = import_time(statement, runs)
+            except subprocess.CalledProcessError:
+                print("%-12s not installed" % name)     # requests is optional
+                continue
+            print("%-12s %7.1f ms" % (name, seconds * 1e3))
+    elif option('bench'):
+        bart = Bart(transport=transport, cache=False)
+        results = bench(bart, int(option('bench')))
+        for name, measures in results.items():
+            print("%-12s %9.1f us/call %9.0f calls/s %9.1f KB peak" % (name, measures['us'], 1e6 / measures['us'],
+                                                                       measures['peak_kb']))
+        if option('save-baseline'):
+            with open(option('save-baseline'), 'w') as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+        if option('baseline'):
+            with open(option('baseline')) as f:
+                failed = regressions(results, json.load(f), float(option('tolerance') or BENCH_TOLERANCE))
+            for line in failed:
+                print("regression: " + line)
+            if failed:
+                sys.exit(1)
+    else:
+        bart = Bart(transport=transport)
+        for name, args in CALLS:
+            print(getattr(bart, name)(*args))
 
-    print(bart.help())
\ No newline at end of file
+    if server is not None:
+        server.close()